@@ -90,3 +90,78 @@ def get_permitted_datapoint_ids_for_user(user):
         if page.demo_datapoint is not None:
             datapoint_ids.add(page.demo_datapoint.id)
     return datapoint_ids
+
+
+def get_app_nav_content_for_users(users):
+    """
+    Like `get_app_nav_content_for_user` but for many users at once.
+
+    Parameters
+    ----------
+    users : list of django.contrib.auth.model.User
+        The users for which the the available pages should be computed.
+
+    Returns
+    -------
+    app_nav_content_by_user_pk: dict
+        The app_nav_content (see `get_app_nav_content_for_user`) with the
+        primary keys of the users as keys.
+    """
+    # These imports must be here as they cannot succeed until all apps are
+    # loaded.
+    from emp_main.permissions import get_objects_for_users
+    from .models import DemoAppPage
+
+    pages_by_user_pk = get_objects_for_users(
+        users,
+        "emp_demo_ui_app.view_demoapppage",
+        DemoAppPage.objects.order_by("page_name"),
+    )
+
+    app_nav_content_by_user_pk = {}
+    for user_pk, pages_user in pages_by_user_pk.items():
+        app_pages = OrderedDict()
+        for page_obj in pages_user:
+            app_pages[page_obj.page_name] = page_obj.get_absolute_url()
+        app_nav_content = OrderedDict()
+        app_nav_content["Demo UI App"] = app_pages
+        app_nav_content_by_user_pk[user_pk] = app_nav_content
+
+    return app_nav_content_by_user_pk
+
+
+def get_permitted_datapoint_ids_for_users(users):
+    """
+    Like `get_permitted_datapoint_ids_for_user` but for many users at once.
+
+    Parameters
+    ----------
+    users : list of django.contrib.auth.model.User
+        The users for which the the permitted datapoints should be computed.
+
+    Returns
+    -------
+    datapoint_ids_by_user_pk: dict
+        The datapoint_ids (see `get_permitted_datapoint_ids_for_user`) with
+        the primary keys of the users as keys.
+    """
+    # These imports must be here as they cannot succeed until all apps are
+    # loaded.
+    from emp_main.permissions import get_objects_for_users
+    from .models import DemoAppPage
+
+    pages_by_user_pk = get_objects_for_users(
+        users,
+        "emp_demo_ui_app.view_demoapppage",
+        DemoAppPage.objects.only("id", "demo_datapoint_id"),
+    )
+
+    datapoint_ids_by_user_pk = {}
+    for user_pk, pages_user in pages_by_user_pk.items():
+        datapoint_ids = set()
+        for page in pages_user:
+            if page.demo_datapoint_id is not None:
+                datapoint_ids.add(page.demo_datapoint_id)
+        datapoint_ids_by_user_pk[user_pk] = datapoint_ids
+
+    return datapoint_ids_by_user_pk
@@ -5,6 +5,9 @@ from guardian.shortcuts import assign_perm
 from ..models import DemoAppPage
 from ..apps import app_url_prefix
 from ..apps import get_app_nav_content_for_user
+from ..apps import get_app_nav_content_for_users
+from ..apps import get_permitted_datapoint_ids_for_user
+from ..apps import get_permitted_datapoint_ids_for_users
 
 
 class TestGetAppNavContentForUser(TestCase):
@@ -72,3 +75,20 @@ class TestGetAppNavContentForUser(TestCase):
             "/" + app_url_prefix + "/" + self.expected_page_slug_1 + "/"
         )
         self.assertEqual(page_url, expected_page_url)
+
+    def test_batch_variants_same_as_for_single_user(self):
+        """
+        The batch variants must compute the same as those for single users.
+        """
+        users = [self.anon_user, self.test_user_1]
+        app_nav_content_by_user_pk = get_app_nav_content_for_users(users)
+        dp_ids_by_user_pk = get_permitted_datapoint_ids_for_users(users)
+        for user in users:
+            self.assertEqual(
+                app_nav_content_by_user_pk[user.pk],
+                get_app_nav_content_for_user(user),
+            )
+            self.assertEqual(
+                dp_ids_by_user_pk[user.pk],
+                get_permitted_datapoint_ids_for_user(user),
+            )
@@ -11,6 +11,9 @@ class EmpEnergyFlow(AppConfig):
 
     name = "emp_energy_flow"
 
+    def ready(self):
+        import emp_energy_flow.signals
+
 
 # The first part of the url, that is used to identify the pages
 # belongig to this app. No leading or trailing slashes, they will
@@ -59,11 +62,49 @@ def get_app_nav_content_for_user(user):
     return app_nav_content
 
 
+def get_app_nav_content_for_users(users):
+    """
+    Like `get_app_nav_content_for_user` but for many users at once.
+
+    Parameters
+    ----------
+    users : list of django.contrib.auth.model.User
+        The users for which the the available pages should be computed.
+
+    Returns
+    -------
+    app_nav_content_by_user_pk: dict
+        The app_nav_content (see `get_app_nav_content_for_user`) with the
+        primary keys of the users as keys.
+    """
+    # These imports must be here as they cannot succeed until all apps are
+    # loaded.
+    from emp_main.permissions import get_objects_for_users
+    from .models import EnergyFlow
+
+    pages = EnergyFlow.objects.filter(is_active=True).order_by("name")
+    pages_by_user_pk = get_objects_for_users(
+        users, "emp_energy_flow.view_energyflow", pages
+    )
+
+    app_nav_content_by_user_pk = {}
+    for user_pk, pages_user in pages_by_user_pk.items():
+        app_pages = OrderedDict()
+        for page_obj in pages_user:
+            app_pages[page_obj.name] = page_obj.get_absolute_url()
+        app_nav_content = OrderedDict()
+        app_nav_content["Energy Flow"] = app_pages
+        app_nav_content_by_user_pk[user_pk] = app_nav_content
+
+    return app_nav_content_by_user_pk
+
+
 def get_permitted_datapoint_ids_for_user(user):
     """
     Returns a list of all ids of datapoints the user has access to.
 
-    TODO: Restrict here.
+    These are the datapoints of the active widgets on the EnergyFlow pages
+    the user has view permissions for.
 
     This is a staticmethod as we want to call it without creating an
     instance of the Config class, e.g. as the later would also involve
@@ -80,15 +121,62 @@ def get_permitted_datapoint_ids_for_user(user):
     datapoint_ids: set
         as e.g. {1, 23, 49}
     """
-    from .models import EnergyFlow, Widget
+    # This import must be here as it cannot succeed until all apps are loaded.
+    from guardian.shortcuts import get_objects_for_user
+    from .models import Widget
+
+    # Widgets without energyflow are excluded by the filter too.
+    pages_user = get_objects_for_user(user, "emp_energy_flow.view_energyflow")
+    widgets = Widget.objects.filter(is_active=True, energyflow__in=pages_user)
+    widget_dp_ids = widgets.values_list("datapoint1_id", "datapoint2_id")
 
     datapoint_ids = set()
-    for widget in Widget.objects.all():
-        if not widget.is_active or widget.energyflow is None:
-            continue
-        if widget.datapoint1 is not None:
-            datapoint_ids.add(widget.datapoint1.id)
-        if widget.datapoint2 is not None:
-            datapoint_ids.add(widget.datapoint2.id)
+    for datapoint1_id, datapoint2_id in widget_dp_ids:
+        datapoint_ids.update((datapoint1_id, datapoint2_id))
+    datapoint_ids.discard(None)
 
     return datapoint_ids
+
+
+def get_permitted_datapoint_ids_for_users(users):
+    """
+    Like `get_permitted_datapoint_ids_for_user` but for many users at once.
+
+    Parameters
+    ----------
+    users : list of django.contrib.auth.model.User
+        The users for which the the permitted datapoints should be computed.
+
+    Returns
+    -------
+    datapoint_ids_by_user_pk: dict
+        The datapoint_ids (see `get_permitted_datapoint_ids_for_user`) with
+        the primary keys of the users as keys.
+    """
+    # These imports must be here as they cannot succeed until all apps are
+    # loaded.
+    from emp_main.permissions import get_objects_for_users
+    from .models import EnergyFlow, Widget
+
+    pages_by_user_pk = get_objects_for_users(
+        users, "emp_energy_flow.view_energyflow", EnergyFlow.objects.only("id")
+    )
+
+    widgets = Widget.objects.filter(is_active=True, energyflow__isnull=False)
+    widget_dp_ids = widgets.values_list(
+        "energyflow_id", "datapoint1_id", "datapoint2_id"
+    )
+    datapoint_ids_by_page_id = {}
+    for energyflow_id, datapoint1_id, datapoint2_id in widget_dp_ids:
+        page_dp_ids = datapoint_ids_by_page_id.setdefault(energyflow_id, set())
+        page_dp_ids.update((datapoint1_id, datapoint2_id))
+
+    datapoint_ids_by_user_pk = {}
+    for user_pk, pages_user in pages_by_user_pk.items():
+        datapoint_ids = set()
+        for page in pages_user:
+            datapoint_ids.update(datapoint_ids_by_page_id.get(page.id, ()))
+        datapoint_ids.discard(None)
+        datapoint_ids_by_user_pk[user_pk] = datapoint_ids
+
+    return datapoint_ids_by_user_pk
@@ -0,0 +1,30 @@
+import logging
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Flow, Widget
+from .views import get_layout_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Widget)
+@receiver(post_delete, sender=Widget)
+@receiver(post_save, sender=Flow)
+@receiver(post_delete, sender=Flow)
+def invalidate_layout(sender, instance, **kwargs):
+    """
+    Remove the cached layout of the EnergyFlow page the changed Widget or
+    Flow belongs to.
+
+    Widgets or flows moved to another page are detected while loading the
+    layout of the previous page, as the IDs of the widgets and flows on the
+    page are stored with the layout.
+    """
+    if instance.energyflow_id is None:
+        return
+    logger.debug("Invalidating layout of EnergyFlow %s", instance.energyflow_id)
+    cache.delete(get_layout_cache_key(instance.energyflow_id))
@@ -0,0 +1,94 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from guardian.shortcuts import assign_perm
+
+from emp_main.models import Datapoint
+from ..models import EnergyFlow
+from ..models import Widget
+from ..apps import get_app_nav_content_for_user
+from ..apps import get_app_nav_content_for_users
+from ..apps import get_permitted_datapoint_ids_for_user
+from ..apps import get_permitted_datapoint_ids_for_users
+
+
+class TestGetPermittedDatapointIdsForUser(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Create a test user with access to one of two pages and widgets
+        which should and should not grant access to their datapoints.
+        """
+        User = get_user_model()
+        cls.test_user_1 = User.objects.create_user(username="u1", password="p1")
+        cls.test_user_2 = User.objects.create_user(username="u2", password="p2")
+        cls.anon_user = User.get_anonymous()
+
+        cls.page_1 = EnergyFlow.objects.create(name="EF 1", slug="ef-1")
+        cls.page_2 = EnergyFlow.objects.create(name="EF 2", slug="ef-2")
+        assign_perm(
+            "emp_energy_flow.view_energyflow", cls.test_user_1, cls.page_1
+        )
+
+        cls.datapoints = [
+            Datapoint.objects.create(type="Sensor") for _ in range(7)
+        ]
+        dps = cls.datapoints
+        cls.widget_active = cls.create_widget(cls.page_1, dps[0], dps[1])
+        cls.widget_one_datapoint = cls.create_widget(cls.page_1, dps[2], None)
+        cls.widget_inactive = cls.create_widget(
+            cls.page_1, dps[3], dps[4], is_active=False
+        )
+        cls.widget_without_page = cls.create_widget(None, dps[5], None)
+        cls.widget_other_page = cls.create_widget(cls.page_2, dps[6], None)
+
+    @staticmethod
+    def create_widget(energyflow, datapoint1, datapoint2, is_active=True):
+        return Widget.objects.create(
+            energyflow=energyflow,
+            name="Widget",
+            is_active=is_active,
+            icon_url="",
+            grid_position_left=1,
+            grid_position_right=2,
+            grid_position_top=1,
+            grid_position_bottom=2,
+            datapoint1=datapoint1,
+            datapoint2=datapoint2,
+        )
+
+    def test_datapoints_of_active_widgets_of_permitted_pages_returned(self):
+        """
+        Only the datapoints of active widgets on the pages the user has
+        access to should be returned, without None for missing datapoints.
+        """
+        expected_datapoint_ids = {dp.id for dp in self.datapoints[:3]}
+
+        datapoint_ids = get_permitted_datapoint_ids_for_user(self.test_user_1)
+
+        self.assertEqual(datapoint_ids, expected_datapoint_ids)
+
+    def test_no_datapoints_without_page_permission(self):
+        """
+        A user without access to any page gets no datapoints, including
+        those of widgets without page.
+        """
+        datapoint_ids = get_permitted_datapoint_ids_for_user(self.test_user_2)
+
+        self.assertEqual(datapoint_ids, set())
+
+    def test_batch_variants_same_as_for_single_user(self):
+        """
+        The batch variants must compute the same as those for single users.
+        """
+        users = [self.anon_user, self.test_user_1, self.test_user_2]
+        app_nav_content_by_user_pk = get_app_nav_content_for_users(users)
+        dp_ids_by_user_pk = get_permitted_datapoint_ids_for_users(users)
+        for user in users:
+            self.assertEqual(
+                app_nav_content_by_user_pk[user.pk],
+                get_app_nav_content_for_user(user),
+            )
+            self.assertEqual(
+                dp_ids_by_user_pk[user.pk],
+                get_permitted_datapoint_ids_for_user(user),
+            )
@@ -0,0 +1,155 @@
+from datetime import datetime
+from datetime import timezone
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth import get_user_model
+from guardian.shortcuts import assign_perm
+
+from emp_main.models import Datapoint
+from emp_main.models import LastValueMessage
+from ..models import EnergyFlow
+from ..models import Flow
+from ..models import Widget
+from ..views import compute_widget_area_id
+from ..views import get_layout_cache_key
+
+TIME = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+
+def create_widget(energyflow, column, **kwargs):
+    """
+    Create a widget with two datapoints in the given column of the first row.
+    """
+    datapoints = []
+    for _ in range(2):
+        datapoint = Datapoint.objects.create(type="Sensor")
+        LastValueMessage.objects.create(
+            datapoint=datapoint, time=TIME, value=1.0
+        )
+        datapoints.append(datapoint)
+    widget_kwargs = {
+        "energyflow": energyflow,
+        "name": "Widget {}".format(column),
+        "icon_url": "",
+        "grid_position_left": column,
+        "grid_position_right": column + 1,
+        "grid_position_top": 1,
+        "grid_position_bottom": 2,
+        "datapoint1": datapoints[0],
+        "datapoint2": datapoints[1],
+    }
+    widget_kwargs.update(kwargs)
+    return Widget.objects.create(**widget_kwargs)
+
+
+def create_flow(energyflow, origin_device, target_device):
+    value_datapoint = Datapoint.objects.create(type="Sensor")
+    LastValueMessage.objects.create(
+        datapoint=value_datapoint, time=TIME, value=2.0
+    )
+    return Flow.objects.create(
+        energyflow=energyflow,
+        origin_device=origin_device,
+        target_device=target_device,
+        value_datapoint=value_datapoint,
+    )
+
+
+class TestEMPEnergyFlowView(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Create a test user with access to two pages.
+        """
+        User = get_user_model()
+        cls.test_user = User.objects.create_user(username="u1", password="p1")
+
+        cls.energyflow_1 = EnergyFlow.objects.create(name="EF 1", slug="ef-1")
+        cls.energyflow_2 = EnergyFlow.objects.create(name="EF 2", slug="ef-2")
+        for energyflow in [cls.energyflow_1, cls.energyflow_2]:
+            assign_perm(
+                "emp_energy_flow.view_energyflow", cls.test_user, energyflow
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.test_user)
+
+    def get_page(self, energyflow):
+        response = self.client.get(energyflow.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def count_queries_of_page(self, energyflow):
+        """
+        Return the number of queries of a page request after the caches
+        have been filled by a previous request.
+        """
+        self.get_page(energyflow)
+        with CaptureQueriesContext(connection) as context:
+            self.get_page(energyflow)
+        return len(context.captured_queries)
+
+    def test_number_of_queries_independent_of_widgets_and_flows(self):
+        """
+        The widgets, flows and their datapoints should be loaded with one
+        query per model, regardless of how many are on the page.
+        """
+        widget_1 = create_widget(self.energyflow_1, column=1)
+        widget_2 = create_widget(self.energyflow_1, column=2)
+        create_flow(self.energyflow_1, widget_1, widget_2)
+        expected_num_queries = self.count_queries_of_page(self.energyflow_1)
+
+        previous_widget = widget_2
+        for column in range(3, 8):
+            widget = create_widget(self.energyflow_1, column=column)
+            create_flow(self.energyflow_1, previous_widget, widget)
+            previous_widget = widget
+        self.get_page(self.energyflow_1)
+
+        with self.assertNumQueries(expected_num_queries):
+            response = self.get_page(self.energyflow_1)
+        self.assertEqual(len(response.context["widgets"]), 7)
+        self.assertEqual(len(response.context["flows"]), 6)
+
+    def test_widget_save_invalidates_layout(self):
+        """
+        Changing the position of a widget must be reflected in the layout.
+        """
+        widget = create_widget(self.energyflow_1, column=1)
+        response = self.get_page(self.energyflow_1)
+        self.assertEqual(response.context["n_columns"], 1)
+        cache_key = get_layout_cache_key(self.energyflow_1.id)
+        self.assertIsNotNone(cache.get(cache_key))
+
+        widget.grid_position_left = 2
+        widget.grid_position_right = 3
+        widget.save()
+
+        self.assertIsNone(cache.get(cache_key))
+        response = self.get_page(self.energyflow_1)
+        self.assertEqual(response.context["n_columns"], 2)
+
+    def test_widget_move_invalidates_layout_of_both_pages(self):
+        """
+        A widget moved to another page must disappear from the layout of
+        the previous page and appear in the layout of the new one.
+        """
+        widget = create_widget(self.energyflow_1, column=1)
+        create_widget(self.energyflow_1, column=2)
+        area_id = compute_widget_area_id(widget.id)
+        response = self.get_page(self.energyflow_1)
+        self.assertIn(area_id, response.context["areas_big"])
+        response = self.get_page(self.energyflow_2)
+        self.assertNotIn(area_id, response.context["areas_big"])
+
+        widget.energyflow = self.energyflow_2
+        widget.save()
+
+        response = self.get_page(self.energyflow_1)
+        self.assertNotIn(area_id, response.context["areas_big"])
+        response = self.get_page(self.energyflow_2)
+        self.assertIn(area_id, response.context["areas_big"])
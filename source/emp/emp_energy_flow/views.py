@@ -1,6 +1,7 @@
 import json
 from math import log
 
+from django.core.cache import cache
 from django.http import Http404
 from django.utils.html import escapejs
 from django.shortcuts import get_object_or_404
@@ -8,6 +9,115 @@ from django.shortcuts import get_object_or_404
 from emp_main.views import EMPBaseView
 from .models import EnergyFlow, Widget, Flow
 
+# Seconds the layout of an EnergyFlow page is kept in the cache. Saving a
+# Widget or Flow invalidates the layout immediately, the timeout only limits
+# how long changes that bypass the model signals may remain unnoticed.
+LAYOUT_CACHE_TIMEOUT = 3600
+
+
+def get_layout_cache_key(energyflow_id):
+    """
+    Returns the key of the cached layout of an EnergyFlow page.
+    """
+    return "emp.energy_flow.layout.{}".format(energyflow_id)
+
+
+def compute_widget_area_id(widget_id):
+    """
+    Returns a unique id used within the energy-flow-plot to place the
+    widgets in the grid.
+    """
+    return "widget_area_" + str(widget_id)
+
+
+def compute_layout(widgets, flows):
+    """
+    Computes everything of the page that depends on the grid positions of
+    the widgets only.
+
+    Parameters
+    ----------
+    widgets : list of Widget
+        The active widgets of the page.
+    flows : list of Flow
+        The flows between active widgets of the page.
+
+    Returns
+    -------
+    layout : dict
+        as {"n_rows": int, "n_cols": int, "areas_small": str,
+        "areas_big": str, "direction_by_flow_id": dict,
+        "widget_ids": list, "flow_ids": list}
+    """
+    # Compute the required number of rows and columns. css
+    # grid coordinates are referenced until the grid line before they end.
+    # See also: https://www.w3schools.com/css/css_grid_item.asp
+    n_cols = max([w.grid_position_right for w in widgets], default=1) - 1
+    n_rows = max([w.grid_position_bottom for w in widgets], default=1) - 1
+
+    # Compute the grid areas, normal (wide) layout on large screens
+    # and a 90° degree rotated version on small screens.
+    areas_big = [["." for k in range(n_cols)] for j in range(n_rows)]
+    areas_small = [["." for k in range(n_rows)] for j in range(n_cols)]
+    for widget in widgets:
+        area_id = compute_widget_area_id(widget.id)
+        for i in range(widget.grid_position_top, widget.grid_position_bottom):
+            for j in range(
+                widget.grid_position_left, widget.grid_position_right
+            ):
+                areas_big[i - 1][j - 1] = area_id
+                areas_small[j - 1][i - 1] = area_id
+    areas_small = "\n".join(['"' + " ".join(row) + '"' for row in areas_small])
+    areas_big = "\n".join(['"' + " ".join(row) + '"' for row in areas_big])
+
+    # Compute the direction of the flows based on the grid coordinates.
+    # This works only for direct connections in x, y direction.
+    # Yields errors for diagonal flows.
+    direction_by_flow_id = {}
+    for flow in flows:
+        td = flow.target_device
+        od = flow.origin_device
+        if od.grid_position_bottom > td.grid_position_bottom:
+            direction = "up"
+        elif od.grid_position_top < td.grid_position_top:
+            direction = "down"
+        elif od.grid_position_left < td.grid_position_left:
+            direction = "right"
+        elif od.grid_position_right > td.grid_position_right:
+            direction = "left"
+        else:
+            direction = ""
+        direction_by_flow_id[flow.id] = direction
+
+    layout = {
+        "n_rows": n_rows,
+        "n_cols": n_cols,
+        "areas_small": areas_small,
+        "areas_big": areas_big,
+        "direction_by_flow_id": direction_by_flow_id,
+        # These allow detecting widgets and flows that have been added,
+        # removed or (de)activated.
+        "widget_ids": [w.id for w in widgets],
+        "flow_ids": [f.id for f in flows],
+    }
+    return layout
+
+
+def get_layout(energyflow, widgets, flows):
+    """
+    Like `compute_layout` but takes the layout from cache if possible.
+    """
+    cache_key = get_layout_cache_key(energyflow.id)
+    layout = cache.get(cache_key)
+    if (
+        layout is None
+        or layout["widget_ids"] != [w.id for w in widgets]
+        or layout["flow_ids"] != [f.id for f in flows]
+    ):
+        layout = compute_layout(widgets=widgets, flows=flows)
+        cache.set(cache_key, layout, timeout=LAYOUT_CACHE_TIMEOUT)
+    return layout
+
 
 class EMPEnergyFlowView(EMPBaseView):
 
@@ -21,65 +131,37 @@ class EMPEnergyFlowView(EMPBaseView):
         energyflow = get_object_or_404(EnergyFlow, slug=energyflow_slug,)
         if not energyflow.is_active:
             raise Http404()
+
+        # Load all related objects required to render the page (also by the
+        # templates) with one query per model.
         widgets = Widget.objects.filter(energyflow=energyflow, is_active=True,)
+        widgets = widgets.select_related(
+            "datapoint1__last_value_message", "datapoint2__last_value_message",
+        )
+        widgets = list(widgets.order_by("id"))
         flows = Flow.objects.filter(
             energyflow=energyflow,
             origin_device__is_active=True,
             target_device__is_active=True,
         )
+        flows = flows.select_related(
+            "origin_device",
+            "target_device",
+            "value_datapoint__last_value_message",
+        )
+        flows = list(flows.order_by("id"))
+
+        layout = get_layout(energyflow=energyflow, widgets=widgets, flows=flows)
 
-        # Compute the required number of rows and columns. css
-        # grid coordinates are referenced until the grid line before they end.
-        # See also: https://www.w3schools.com/css/css_grid_item.asp
-        n_cols = max(widgets.values_list("grid_position_right"))[0] - 1
-        n_rows = max(widgets.values_list("grid_position_bottom"))[0] - 1
-
-        # Compute the grid areas, normal (wide) layout on large screens
-        # and a 90° degree rotated version on small screens.
-        def compute_widget_area_id(widget):
-            """
-            Returns a unique id used within the energy-flow-plot to place the
-            widgets in the grid.
-            """
-            return "widget_area_" + str(widget.id)
-
-        areas_big = [["." for k in range(n_cols)] for j in range(n_rows)]
-        areas_small = [["." for k in range(n_rows)] for j in range(n_cols)]
-        # areas_small = [["." for k in range(n_rows)] for j in range(n_cols)]
         for widget in widgets:
-            widget.area_id = compute_widget_area_id(widget)
-            for i in range(
-                widget.grid_position_top, widget.grid_position_bottom
-            ):
-                for j in range(
-                    widget.grid_position_left, widget.grid_position_right
-                ):
-                    areas_big[i - 1][j - 1] = widget.area_id
-                    areas_small[j - 1][i - 1] = widget.area_id
-        areas_small = "\n".join(
-            ['"' + " ".join(row) + '"' for row in areas_small]
-        )
-        areas_big = "\n".join(['"' + " ".join(row) + '"' for row in areas_big])
+            widget.area_id = compute_widget_area_id(widget.id)
 
         # Prepare the flow objects for the template.
         for flow in flows:
             flow.html_id = "flow_" + str(flow.id)
-            flow.origin_area_id = compute_widget_area_id(flow.origin_device)
-            flow.target_area_id = compute_widget_area_id(flow.target_device)
-
-            # Compute the direction of the flows based on the grid coordinates.
-            # This works only for direct connections in x, y direction.
-            # Yields errors for diagonal flows.
-            td = flow.target_device
-            od = flow.origin_device
-            if od.grid_position_bottom > td.grid_position_bottom:
-                flow.direction = "up"
-            elif od.grid_position_top < td.grid_position_top:
-                flow.direction = "down"
-            elif od.grid_position_left < td.grid_position_left:
-                flow.direction = "right"
-            elif od.grid_position_right > td.grid_position_right:
-                flow.direction = "left"
+            flow.origin_area_id = compute_widget_area_id(flow.origin_device_id)
+            flow.target_area_id = compute_widget_area_id(flow.target_device_id)
+            flow.direction = layout["direction_by_flow_id"][flow.id]
 
             # Also compute initial values for the flow animation.
             flow.moving_stopped = "stopped"
@@ -115,10 +197,10 @@ class EMPEnergyFlowView(EMPBaseView):
 
         context["widgets"] = widgets
         context["flows"] = flows
-        context["n_rows"] = n_rows
-        context["n_columns"] = n_cols
-        context["areas_small"] = areas_small
-        context["areas_big"] = areas_big
+        context["n_rows"] = layout["n_rows"]
+        context["n_columns"] = layout["n_cols"]
+        context["areas_small"] = layout["areas_small"]
+        context["areas_big"] = layout["areas_big"]
         context["min_max_by_datapoint_id"] = escapejs(
             json.dumps(min_max_by_datapoint_id)
         )
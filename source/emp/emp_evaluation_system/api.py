@@ -0,0 +1,183 @@
+"""
+REST API endpoints of the evaluation system.
+
+The `router` is added to the EMP API by `emp_main.urls`, i.e. the endpoints
+are available below `/api/evaluation_system/`.
+"""
+from datetime import datetime
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from django.http import HttpResponse
+from ninja import Query
+from ninja import Router
+from ninja import Schema
+from pydantic import BaseModel
+from pydantic import Field
+
+from esg.models.request import HTTPError
+from esg.services.base import RequestInducedException
+
+from emp_main.api import GenericAPIView
+from .metric_engine import compile_formulas
+from .metric_engine import evaluate_formulas
+from .metric_engine import evaluate_formulas_latest
+from .models import Metric
+
+router = Router()
+
+
+class MetricEvaluationParams(Schema):
+    """
+    Query parameters of the metric evaluation endpoint.
+    """
+
+    id__in: List[int] = Field(
+        ..., description="The IDs of the metrics to evaluate.",
+    )
+    time__gte: datetime = Field(
+        None,
+        description=(
+            "Only use values of the datapoints at or after this time. If not "
+            "set the metrics are evaluated for the last values of the "
+            "datapoints, which doesn't require loading the value history."
+        ),
+    )
+    time__lt: datetime = Field(
+        None,
+        description=(
+            "Only use values of the datapoints before this time. Requires "
+            "`time__gte`."
+        ),
+    )
+    include_series: bool = Field(
+        False,
+        description=(
+            "Return the result at every time in the time range as `times` "
+            "and `values` too. Requires `time__gte`."
+        ),
+    )
+
+
+class MetricResult(BaseModel):
+    value: float = Field(
+        None,
+        description=(
+            "The result of the metric, i.e. the last item of `values` if the "
+            "result is a time series. `null` if undefined or on error."
+        ),
+    )
+    times: Optional[List[datetime]] = Field(
+        None,
+        description=(
+            "The times of the items of `values`. Empty if the formula of the "
+            "metric only uses aggregated datapoints, like `sum(dp_1)`. Only "
+            "returned if `include_series` is set."
+        ),
+    )
+    values: Optional[List[Optional[float]]] = Field(
+        None,
+        description=(
+            "The result at each time at which any datapoint in the formula "
+            "has a value, datapoints keep their last value in between. "
+            "`null` where undefined. Only returned if `include_series` is "
+            "set."
+        ),
+    )
+    error: str = Field(
+        None,
+        description=(
+            "Why the metric could not be evaluated, e.g. as its formula is "
+            "not valid. `null` if the metric has been evaluated."
+        ),
+    )
+
+
+class MetricResultByMetricId(BaseModel):
+    __root__: Dict[str, MetricResult]
+
+
+class MetricEvaluationAPIView(GenericAPIView):
+    """
+    Methods for handling calls to /evaluation_system/metric/ endpoints.
+    """
+
+    @GenericAPIView._handle_exceptions
+    def evaluate(self, request, evaluation_params):
+        """
+        Evaluate several metrics over the requested time range, or for the
+        last values of the datapoints if no time range is requested.
+
+        The values of all datapoints used by the metrics are loaded
+        together, see `emp_evaluation_system.metric_engine`. Metrics that
+        don't exist or have an invalid formula yield an error in their
+        result, the other metrics are evaluated anyway.
+        """
+        if evaluation_params.time__gte is None:
+            if evaluation_params.time__lt is not None:
+                raise RequestInducedException(
+                    detail="`time__lt` requires `time__gte`."
+                )
+            if evaluation_params.include_series:
+                raise RequestInducedException(
+                    detail="`include_series` requires `time__gte`."
+                )
+
+        metric_ids = set(evaluation_params.id__in)
+        metrics = Metric.objects.filter(id__in=metric_ids)
+        formulas_by_id = {
+            str(metric.id): metric.formula or "" for metric in metrics
+        }
+        compiled_by_id, errors_by_id = compile_formulas(formulas_by_id)
+        for metric_id in metric_ids - {int(i) for i in formulas_by_id}:
+            errors_by_id[str(metric_id)] = "Metric does not exist."
+
+        valid_formulas_by_id = {
+            metric_id: formulas_by_id[metric_id] for metric_id in compiled_by_id
+        }
+        if evaluation_params.time__gte is None:
+            results_by_id = evaluate_formulas_latest(valid_formulas_by_id)
+        else:
+            results_by_id = evaluate_formulas(
+                valid_formulas_by_id,
+                time__gte=evaluation_params.time__gte,
+                time__lt=evaluation_params.time__lt,
+            )
+            if not evaluation_params.include_series:
+                results_by_id = {
+                    metric_id: {"value": result["value"]}
+                    for metric_id, result in results_by_id.items()
+                }
+        for metric_id, error in errors_by_id.items():
+            results_by_id[metric_id] = {"error": error}
+
+        content_pydantic = MetricResultByMetricId(__root__=results_by_id)
+        content = content_pydantic.json()
+
+        return HttpResponse(
+            content, status=200, content_type="application/json"
+        )
+
+
+metric_evaluation_view = MetricEvaluationAPIView()
+
+
+@router.get(
+    "/metric/evaluate/",
+    response={200: MetricResultByMetricId, 400: HTTPError, 500: HTTPError},
+    tags=["Evaluation System"],
+    summary=" ",  # Deactivate summary.
+)
+def get_metric_evaluate(
+    request, evaluation_params: MetricEvaluationParams = Query(...),
+):
+    """
+    Return the results of one or more metrics, over a time range or for
+    the last values of the datapoints.
+    """
+
+    response = metric_evaluation_view.evaluate(
+        request=request, evaluation_params=evaluation_params,
+    )
+    return response
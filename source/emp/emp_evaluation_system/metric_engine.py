@@ -0,0 +1,592 @@
+"""
+Server side evaluation of `Metric.formula`.
+
+A formula like `sum(dp_3) / dp_1` is parsed into a Python AST, checked
+against a whitelist of allowed nodes and compiled once. Compiled formulas
+are cached by formula string, i.e. a metric is recompiled automatically if
+its formula changes. The formulas are evaluated with NumPy over the value
+history of the referenced datapoints, which is loaded with a single query
+for all metrics evaluated together, see `evaluate_formulas`. Realtime values
+don't need the history, `evaluate_formulas_latest` uses the last values of
+the datapoints instead and lets the database compute the reductions.
+"""
+import ast
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from functools import lru_cache
+from itertools import groupby
+import re
+
+from django.db.models import Avg
+from django.db.models import Max
+from django.db.models import Min
+from django.db.models import Sum
+import numpy as np
+
+from emp_main.models import LastValueMessage
+from emp_main.models import ValueMessage
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+DATAPOINT_NAME_PATTERN = re.compile(r"^dp_(\d+)$")
+
+BINARY_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div)
+UNARY_OPERATORS = (ast.UAdd, ast.USub)
+
+
+def _nanmean(values):
+    if np.all(np.isnan(values)):
+        return np.nan
+    return np.nanmean(values)
+
+
+def _nanmin(values):
+    if np.all(np.isnan(values)):
+        return np.nan
+    return np.nanmin(values)
+
+
+def _nanmax(values):
+    if np.all(np.isnan(values)):
+        return np.nan
+    return np.nanmax(values)
+
+
+# The functions that reduce all values of a datapoint in the evaluated time
+# range to one value. Values that are not numeric are ignored.
+FORMULA_FUNCTIONS = {
+    "sum": np.nansum,
+    "mean": _nanmean,
+    "min": _nanmin,
+    "max": _nanmax,
+}
+
+# The database aggregates matching `FORMULA_FUNCTIONS`, NULL values are
+# ignored by the aggregates like NaN by the functions above.
+FORMULA_AGGREGATES = {
+    "sum": Sum,
+    "mean": Avg,
+    "min": Min,
+    "max": Max,
+}
+
+
+class FormulaError(ValueError):
+    """
+    Raised if a formula is not valid.
+    """
+
+
+class CompiledFormula:
+    """
+    A validated and compiled metric formula.
+
+    Datapoints used directly in the formula (like `dp_1 * dp_2`) yield a
+    time series, with one value for every time any of these datapoints has
+    a message, the datapoints keep their last value in between. Datapoints
+    used as argument of one of the `FORMULA_FUNCTIONS` (like `sum(dp_3)`)
+    are reduced over their own messages, i.e. independent of the other
+    datapoints in the formula.
+
+    Parameters
+    ----------
+    formula : str
+        The formula, e.g. `sum(dp_3) / dp_1`.
+
+    Raises
+    ------
+    FormulaError
+        If the formula contains anything else than numbers, datapoints,
+        the operators `+`, `-`, `*` and `/`, brackets and calls of
+        `FORMULA_FUNCTIONS` with exactly one datapoint as argument.
+    """
+
+    def __init__(self, formula):
+        self.formula = formula
+        try:
+            tree = ast.parse(formula.strip(), mode="eval")
+        except SyntaxError:
+            raise FormulaError("Formula `{}` is not valid.".format(formula))
+
+        # The datapoints used as time series and the (function name,
+        # datapoint ID) pairs of the reduced datapoints.
+        self.series_datapoint_ids = set()
+        self.reductions = set()
+        tree.body = self._check_node(tree.body)
+        self.datapoint_ids = self.series_datapoint_ids | {
+            dp_id for _, dp_id in self.reductions
+        }
+        tree = ast.fix_missing_locations(tree)
+        self.code = compile(tree, "<formula>", "eval")
+
+    def _raise(self, detail):
+        raise FormulaError("Formula `{}`: {}".format(self.formula, detail))
+
+    def _get_datapoint_id(self, node):
+        if not isinstance(node, ast.Name):
+            return None
+        match = DATAPOINT_NAME_PATTERN.match(node.id)
+        if match is None:
+            return None
+        return int(match.group(1))
+
+    def _check_node(self, node):
+        """
+        Check one node of the AST recursively and replace the calls of
+        `FORMULA_FUNCTIONS` by names of variables holding the results.
+        """
+        if isinstance(node, ast.BinOp):
+            if not isinstance(node.op, BINARY_OPERATORS):
+                self._raise("Operator not allowed.")
+            node.left = self._check_node(node.left)
+            node.right = self._check_node(node.right)
+            return node
+
+        if isinstance(node, ast.UnaryOp):
+            if not isinstance(node.op, UNARY_OPERATORS):
+                self._raise("Operator not allowed.")
+            node.operand = self._check_node(node.operand)
+            return node
+
+        if isinstance(node, ast.Constant):
+            if type(node.value) not in (int, float):
+                self._raise("Only numbers are allowed as constants.")
+            return node
+
+        if isinstance(node, ast.Name):
+            dp_id = self._get_datapoint_id(node)
+            if dp_id is None:
+                self._raise("Unknown name `{}`.".format(node.id))
+            self.series_datapoint_ids.add(dp_id)
+            return node
+
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or (
+                node.func.id not in FORMULA_FUNCTIONS
+            ):
+                self._raise("Unknown function.")
+            if node.keywords or len(node.args) != 1:
+                self._raise(
+                    "`{}` expects exactly one argument.".format(node.func.id)
+                )
+            dp_id = self._get_datapoint_id(node.args[0])
+            if dp_id is None:
+                self._raise(
+                    "The argument of `{}` must be a datapoint.".format(
+                        node.func.id
+                    )
+                )
+            self.reductions.add((node.func.id, dp_id))
+            return ast.copy_location(
+                ast.Name(
+                    id=self._get_reduction_name(node.func.id, dp_id),
+                    ctx=ast.Load(),
+                ),
+                node,
+            )
+
+        self._raise("Expression not allowed.")
+
+    @staticmethod
+    def _get_reduction_name(function_name, dp_id):
+        return "{}__dp_{}".format(function_name, dp_id)
+
+    def evaluate(self, series_by_dp_id):
+        """
+        Compute the result of the formula.
+
+        Parameters
+        ----------
+        series_by_dp_id : dict
+            The `(times, values)` arrays of all datapoints in
+            `datapoint_ids`, as returned by `load_value_series`.
+
+        Returns
+        -------
+        times : numpy.ndarray or None
+            The times of the result as microseconds since epoch. None if the
+            result is a single value, i.e. doesn't depend on time.
+        result : numpy.ndarray or float
+            The values of the result, NaN where undefined.
+        """
+        namespace = {}
+        for function_name, dp_id in self.reductions:
+            _, values = series_by_dp_id[dp_id]
+            name = self._get_reduction_name(function_name, dp_id)
+            namespace[name] = FORMULA_FUNCTIONS[function_name](values)
+
+        times, values_by_dp_id = align_series(
+            {
+                dp_id: series_by_dp_id[dp_id]
+                for dp_id in self.series_datapoint_ids
+            }
+        )
+        for dp_id, values in values_by_dp_id.items():
+            namespace["dp_{}".format(dp_id)] = values
+
+        result = self._eval(namespace)
+        if not self.series_datapoint_ids:
+            return None, float(result)
+        return times, result
+
+    def evaluate_latest(self, latest_by_dp_id, reduced_by_function):
+        """
+        Compute the result of the formula for the last values only.
+
+        The result equals the last value of `evaluate` over the full
+        history, but doesn't need the history of the datapoints.
+
+        Parameters
+        ----------
+        latest_by_dp_id : dict
+            The last value of all datapoints in `series_datapoint_ids`, as
+            returned by `load_latest_values`.
+        reduced_by_function : dict
+            The reduced values of all datapoints in `reductions`, as
+            returned by `load_reduced_values`.
+
+        Returns
+        -------
+        result : float
+            The value of the result, NaN if undefined.
+        """
+        namespace = {}
+        for function_name, dp_id in self.reductions:
+            name = self._get_reduction_name(function_name, dp_id)
+            namespace[name] = reduced_by_function[function_name][dp_id]
+        for dp_id in self.series_datapoint_ids:
+            namespace["dp_{}".format(dp_id)] = latest_by_dp_id[dp_id]
+
+        return float(self._eval(namespace))
+
+    def _eval(self, namespace):
+        # Only the nodes checked by `_check_node` can be evaluated here.
+        with np.errstate(all="ignore"):
+            try:
+                return eval(self.code, {"__builtins__": {}}, namespace)
+            except ZeroDivisionError:
+                # Division of plain numbers, NumPy yields inf or NaN instead.
+                return np.nan
+
+
+@lru_cache(maxsize=1024)
+def compile_formula(formula):
+    """
+    Return the `CompiledFormula`, which is only created once per formula.
+    """
+    return CompiledFormula(formula)
+
+
+def compile_formulas(formulas_by_key):
+    """
+    Compile several formulas, collecting the errors instead of raising.
+
+    Parameters
+    ----------
+    formulas_by_key : dict
+        The formulas as strings, with arbitrary keys, e.g. the metric IDs.
+
+    Returns
+    -------
+    compiled_by_key : dict
+        The `CompiledFormula` of every valid formula.
+    errors_by_key : dict
+        The error message of every invalid formula.
+    """
+    compiled_by_key = {}
+    errors_by_key = {}
+    for key, formula in formulas_by_key.items():
+        try:
+            compiled_by_key[key] = compile_formula(formula)
+        except FormulaError as e:
+            errors_by_key[key] = str(e)
+    return compiled_by_key, errors_by_key
+
+
+def to_microseconds(time):
+    return (time - EPOCH) // timedelta(microseconds=1)
+
+
+def from_microseconds(microseconds):
+    return EPOCH + timedelta(microseconds=int(microseconds))
+
+
+def align_series(series_by_dp_id):
+    """
+    Resample time series to the union of their times.
+
+    Every series keeps its last value until its next one, and is NaN before
+    its first value.
+
+    Parameters
+    ----------
+    series_by_dp_id : dict
+        `(times, values)` arrays with the datapoint IDs as keys.
+
+    Returns
+    -------
+    times : numpy.ndarray
+        The union of the times of all series.
+    values_by_dp_id : dict
+        The resampled values, one for each item of `times`.
+    """
+    if not series_by_dp_id:
+        return np.array([], dtype=np.int64), {}
+
+    times = np.unique(
+        np.concatenate([times for times, _ in series_by_dp_id.values()])
+    )
+    values_by_dp_id = {}
+    for dp_id, (dp_times, dp_values) in series_by_dp_id.items():
+        # The index of the last value of the datapoint at each time.
+        index = np.searchsorted(dp_times, times, side="right") - 1
+        values = np.full(len(times), np.nan)
+        has_value = index >= 0
+        values[has_value] = dp_values[index[has_value]]
+        values_by_dp_id[dp_id] = values
+    return times, values_by_dp_id
+
+
+def load_value_series(datapoint_ids, time__gte=None, time__lt=None):
+    """
+    Load the numeric value history of several datapoints with one query.
+
+    Parameters
+    ----------
+    datapoint_ids : iterable of int
+        The IDs of the datapoints.
+    time__gte : datetime.datetime, optional
+        Only load values at or after this time.
+    time__lt : datetime.datetime, optional
+        Only load values before this time.
+
+    Returns
+    -------
+    series_by_dp_id : dict
+        `(times, values)` arrays sorted by time for every datapoint, with
+        times as microseconds since epoch. Values which are not numeric
+        are NaN.
+    """
+    datapoint_ids = set(datapoint_ids)
+    messages = ValueMessage.objects.filter(datapoint_id__in=datapoint_ids)
+    if time__gte is not None:
+        messages = messages.filter(time__gte=time__gte)
+    if time__lt is not None:
+        messages = messages.filter(time__lt=time__lt)
+    rows = messages.order_by("datapoint_id", "time").values_list(
+        "datapoint_id", "time", "_value_float"
+    )
+
+    series_by_dp_id = {
+        dp_id: (np.array([], dtype=np.int64), np.array([], dtype=float))
+        for dp_id in datapoint_ids
+    }
+    for dp_id, dp_rows in groupby(rows.iterator(), key=lambda r: r[0]):
+        dp_rows = list(dp_rows)
+        times = np.array([to_microseconds(r[1]) for r in dp_rows])
+        values = np.array([r[2] for r in dp_rows], dtype=float)
+        series_by_dp_id[dp_id] = (times, values)
+    return series_by_dp_id
+
+
+def to_float(value):
+    """
+    Convert a value like `ValueMessage` does for `_value_float`, values
+    that are not numeric are NaN.
+    """
+    if isinstance(value, bool):
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def load_latest_values(datapoint_ids):
+    """
+    Load the last numeric value of several datapoints with one query.
+
+    Parameters
+    ----------
+    datapoint_ids : iterable of int
+        The IDs of the datapoints.
+
+    Returns
+    -------
+    latest_by_dp_id : dict
+        The last value of every datapoint, NaN if the datapoint has no
+        value or the value is not numeric.
+    """
+    datapoint_ids = set(datapoint_ids)
+    latest_by_dp_id = {dp_id: np.nan for dp_id in datapoint_ids}
+    if not datapoint_ids:
+        return latest_by_dp_id
+
+    rows = LastValueMessage.objects.filter(
+        datapoint_id__in=datapoint_ids
+    ).values_list("datapoint_id", "value")
+    for dp_id, value in rows:
+        latest_by_dp_id[dp_id] = to_float(value)
+    return latest_by_dp_id
+
+
+def load_reduced_values(datapoint_ids):
+    """
+    Reduce the full value history of several datapoints in the database.
+
+    All `FORMULA_AGGREGATES` are computed with one grouped query, i.e.
+    the history itself is not loaded.
+
+    Parameters
+    ----------
+    datapoint_ids : iterable of int
+        The IDs of the datapoints.
+
+    Returns
+    -------
+    reduced_by_function : dict
+        For every name in `FORMULA_FUNCTIONS` the reduced value of every
+        datapoint, with the same results as the functions, e.g. 0 for the
+        sum and NaN for the other functions if there is no numeric value.
+    """
+    datapoint_ids = set(datapoint_ids)
+    reduced_by_function = {
+        function_name: {
+            dp_id: 0.0 if function_name == "sum" else np.nan
+            for dp_id in datapoint_ids
+        }
+        for function_name in FORMULA_AGGREGATES
+    }
+    if not datapoint_ids:
+        return reduced_by_function
+
+    rows = (
+        ValueMessage.objects.filter(datapoint_id__in=datapoint_ids)
+        .order_by()
+        .values("datapoint_id")
+        .annotate(
+            **{
+                function_name: aggregate("_value_float")
+                for function_name, aggregate in FORMULA_AGGREGATES.items()
+            }
+        )
+    )
+    for row in rows:
+        for function_name in FORMULA_AGGREGATES:
+            if row[function_name] is not None:
+                reduced = reduced_by_function[function_name]
+                reduced[row["datapoint_id"]] = float(row[function_name])
+    return reduced_by_function
+
+
+def to_jsonable(value):
+    """
+    Convert a result value to float, and undefined values to None.
+    """
+    if value is None or not np.isfinite(value):
+        return None
+    return float(value)
+
+
+def evaluate_formulas(formulas_by_key, time__gte=None, time__lt=None):
+    """
+    Evaluate several formulas over the same time range.
+
+    The values of all datapoints referenced by any of the formulas are
+    loaded with a single query.
+
+    Parameters
+    ----------
+    formulas_by_key : dict
+        The formulas as strings, with arbitrary keys, e.g. the metric IDs.
+    time__gte : datetime.datetime, optional
+        Only use values at or after this time.
+    time__lt : datetime.datetime, optional
+        Only use values before this time.
+
+    Returns
+    -------
+    results_by_key : dict
+        The result of each formula as
+        {"value": ..., "times": [...], "values": [...]}, where `value` is
+        the last item of `values` if the result is a time series, `times`
+        and `values` are empty if the result is a single value. Undefined
+        values are None.
+
+    Raises
+    ------
+    FormulaError
+        If any of the formulas is not valid.
+    """
+    compiled_by_key = {
+        key: compile_formula(formula)
+        for key, formula in formulas_by_key.items()
+    }
+    datapoint_ids = set()
+    for compiled in compiled_by_key.values():
+        datapoint_ids.update(compiled.datapoint_ids)
+    series_by_dp_id = load_value_series(
+        datapoint_ids, time__gte=time__gte, time__lt=time__lt
+    )
+
+    results_by_key = {}
+    for key, compiled in compiled_by_key.items():
+        times, result = compiled.evaluate(series_by_dp_id)
+        if times is None:
+            results_by_key[key] = {
+                "value": to_jsonable(result),
+                "times": [],
+                "values": [],
+            }
+            continue
+        values = [to_jsonable(v) for v in result]
+        results_by_key[key] = {
+            "value": values[-1] if values else None,
+            "times": [from_microseconds(t) for t in times],
+            "values": values,
+        }
+    return results_by_key
+
+
+def evaluate_formulas_latest(formulas_by_key):
+    """
+    Evaluate several formulas for the last values of the datapoints.
+
+    This is what realtime values need, the result equals the last value of
+    `evaluate_formulas` without time range, but the value history is not
+    loaded. The last values are loaded with one query and the reductions
+    are computed by the database with another one.
+
+    Parameters
+    ----------
+    formulas_by_key : dict
+        The formulas as strings, with arbitrary keys, e.g. the metric IDs.
+
+    Returns
+    -------
+    results_by_key : dict
+        The result of each formula as {"value": ...}, None if undefined.
+
+    Raises
+    ------
+    FormulaError
+        If any of the formulas is not valid.
+    """
+    compiled_by_key = {
+        key: compile_formula(formula)
+        for key, formula in formulas_by_key.items()
+    }
+    series_datapoint_ids = set()
+    reduced_datapoint_ids = set()
+    for compiled in compiled_by_key.values():
+        series_datapoint_ids.update(compiled.series_datapoint_ids)
+        reduced_datapoint_ids.update(dp_id for _, dp_id in compiled.reductions)
+    latest_by_dp_id = load_latest_values(series_datapoint_ids)
+    reduced_by_function = load_reduced_values(reduced_datapoint_ids)
+
+    results_by_key = {}
+    for key, compiled in compiled_by_key.items():
+        result = compiled.evaluate_latest(latest_by_dp_id, reduced_by_function)
+        results_by_key[key] = {"value": to_jsonable(result)}
+    return results_by_key
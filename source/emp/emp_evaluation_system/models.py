@@ -1,6 +1,7 @@
 import os
 
 from django.db import models
+from django.core.exceptions import ValidationError
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
@@ -12,6 +13,7 @@ from emp_main import settings
 from emp_main.models import Datapoint
 
 from .apps import app_url_prefix
+from .metric_engine import FormulaError, compile_formula
 
 import re, datetime
 
@@ -222,6 +224,14 @@ class Metric(models.Model):
             "Provide a description for other users. This description will only be shwon in admin panel context."
         )
     )
+
+    def clean(self):
+        # Reject formulas the metric engine could not evaluate later.
+        if self.formula:
+            try:
+                compile_formula(self.formula)
+            except FormulaError as e:
+                raise ValidationError({"formula": str(e)})
     
     def __str__(self):
         if self.name is not None:
@@ -64,6 +64,18 @@ function getDataPointSchedulesOf(datapointId, timestamp) {
     return $.getJSON(datapoint_api_url + datapointId + "/schedule/" + timestamp + "/");
 }
 
+// The API endpoint for metric queries.
+var metric_api_url = "http://localhost:8000/api/evaluation_system/metric/";
+
+/**
+ * Calls the metric API, evaluates several metrics for the last values of their datapoints on the server and returns the results with the metric ids as keys.
+ * Metrics that could not be evaluated have a null value and an error message.
+ * @param {*} metricIds An array of the ids of the requested metric objects
+ */
+function evaluateMetrics(metricIds) {
+    return $.getJSON(metric_api_url + "evaluate/", $.param({"id__in": metricIds}, true));
+}
+
 // The API endpoint for simulation queries
 var simulation_api_url = "http://localhost:8018/"
 
@@ -134,13 +134,29 @@ async function calculateMetricDataSet(formula, timestamps, data=null) {
 }
 
 /**
- * Setting up all realtime (not simulated) metric elements on the page 
+ * Setting up all realtime (not simulated) metric elements on the page.
+ * All metrics are evaluated on the server with one request.
  */ 
 async function setUpAllMetricElements() {
     var allMetricElements = $("[class*=realtime_metric]");
+    var metricIds = [];
     for (var metricElement of allMetricElements) {
-        var formula = metricElement.getAttribute("formula");
-        var result = await calculate(formula);
-        metricElement.innerHTML = result;
+        var match = metricElement.className.match("mt_(\\d+)_");
+        if (match != null) {
+            metricIds.push(match[1]);
+        }
+    }
+    if (metricIds.length == 0) return;
+    var results = await evaluateMetrics(metricIds);
+    for (var metricElement of allMetricElements) {
+        var match = metricElement.className.match("mt_(\\d+)_");
+        if (match == null || results[match[1]] == undefined) {
+            continue;
+        }
+        if (results[match[1]]["error"] != null) {
+            console.warn("Metric " + match[1] + ": " + results[match[1]]["error"]);
+        }
+        var value = results[match[1]]["value"];
+        metricElement.innerHTML = (value == null) ? "N/A" : value;
     }
 }
\ No newline at end of file
@@ -1,3 +1,304 @@
+from datetime import datetime
+from datetime import timezone
+
+import numpy as np
+import pytest
+from django.test import Client
 from django.test import TestCase
 
-# Create your tests here.
+from emp_main.models import Datapoint
+from emp_main.models import LastValueMessage
+from emp_main.models import ValueMessage
+from emp_main.urls import API_ROOT_PATH
+
+from .metric_engine import CompiledFormula
+from .metric_engine import FormulaError
+from .metric_engine import align_series
+from .metric_engine import compile_formula
+from .metric_engine import compile_formulas
+from .metric_engine import evaluate_formulas
+from .metric_engine import evaluate_formulas_latest
+from .metric_engine import to_microseconds
+from .models import Metric
+
+
+class TestCompiledFormula:
+    def test_datapoints_found(self):
+        compiled = CompiledFormula("sum(dp_3) / dp_1 + 2 * dp_2")
+
+        assert compiled.datapoint_ids == {1, 2, 3}
+        assert compiled.series_datapoint_ids == {1, 2}
+        assert compiled.reductions == {("sum", 3)}
+
+    def test_compiled_once(self):
+        assert compile_formula("dp_1 * dp_2") is compile_formula("dp_1 * dp_2")
+
+    def test_invalid_formulas_rejected(self):
+        invalid_formulas = [
+            "dp_1 +",
+            "__import__('os')",
+            "dp_1.real",
+            "dp_1 ** 2",
+            "x * 2",
+            "'a'",
+            "True",
+            "sum(dp_1, dp_2)",
+            "sum(dp_1 * 2)",
+            "(lambda: 1)()",
+        ]
+        for formula in invalid_formulas:
+            with pytest.raises(FormulaError):
+                CompiledFormula(formula)
+
+    def test_series_evaluated(self):
+        series_by_dp_id = {
+            1: (np.array([10, 20]), np.array([1.0, 2.0])),
+            2: (np.array([15]), np.array([5.0])),
+        }
+
+        times, result = CompiledFormula("dp_1 * dp_2").evaluate(
+            series_by_dp_id
+        )
+
+        assert times.tolist() == [10, 15, 20]
+        assert np.isnan(result[0])
+        assert result[1:].tolist() == [5.0, 10.0]
+
+    def test_reductions_use_own_values(self):
+        series_by_dp_id = {
+            1: (np.array([10, 20]), np.array([1.0, 2.0])),
+            3: (np.array([1, 2, 3]), np.array([1.0, 2.0, np.nan])),
+        }
+
+        times, result = CompiledFormula("sum(dp_3) / dp_1").evaluate(
+            series_by_dp_id
+        )
+        assert times.tolist() == [10, 20]
+        assert result.tolist() == [3.0, 1.5]
+
+        times, result = CompiledFormula("mean(dp_3)").evaluate(
+            series_by_dp_id
+        )
+        assert times is None
+        assert result == 1.5
+
+    def test_division_by_zero_undefined(self):
+        _, result = CompiledFormula("1 / 0").evaluate({})
+        assert np.isnan(result)
+
+    def test_latest_evaluated(self):
+        compiled = CompiledFormula("sum(dp_3) / dp_1 + dp_2")
+
+        result = compiled.evaluate_latest({1: 2.0, 2: 1.0}, {"sum": {3: 6.0}})
+        assert result == 4.0
+
+        result = compiled.evaluate_latest({1: 0.0, 2: 1.0}, {"sum": {3: 6.0}})
+        assert np.isnan(result)
+
+
+class TestCompileFormulas:
+    def test_errors_collected(self):
+        compiled_by_key, errors_by_key = compile_formulas(
+            {"1": "dp_1 * 2", "2": "dp_1 +", "3": ""}
+        )
+
+        assert compiled_by_key == {"1": compile_formula("dp_1 * 2")}
+        assert set(errors_by_key) == {"2", "3"}
+
+
+class TestAlignSeries:
+    def test_last_value_kept(self):
+        times, values_by_dp_id = align_series(
+            {
+                1: (np.array([1, 3]), np.array([1.0, 3.0])),
+                2: (np.array([2]), np.array([2.0])),
+            }
+        )
+
+        assert times.tolist() == [1, 2, 3]
+        assert values_by_dp_id[1].tolist() == [1.0, 1.0, 3.0]
+        assert np.isnan(values_by_dp_id[2][0])
+        assert values_by_dp_id[2][1:].tolist() == [2.0, 2.0]
+
+
+class TestEvaluateFormulas(TestCase):
+    def setUp(self):
+        self.datapoint_1 = Datapoint.objects.create(type="Sensor")
+        self.datapoint_2 = Datapoint.objects.create(type="Sensor")
+        self.times = [
+            datetime(2022, 1, 1, hour, tzinfo=timezone.utc)
+            for hour in range(4)
+        ]
+        for time, value in zip(self.times, [1.0, 2.0, 3.0, 4.0]):
+            ValueMessage.objects.create(
+                datapoint=self.datapoint_1, time=time, value=value
+            )
+        ValueMessage.objects.create(
+            datapoint=self.datapoint_2, time=self.times[1], value=10.0
+        )
+
+    def test_metrics_evaluated_with_one_query(self):
+        dp_id_1 = self.datapoint_1.id
+        dp_id_2 = self.datapoint_2.id
+        formulas_by_key = {
+            "1": "dp_{} * dp_{}".format(dp_id_1, dp_id_2),
+            "2": "sum(dp_{})".format(dp_id_1),
+        }
+
+        with self.assertNumQueries(1):
+            results_by_key = evaluate_formulas(formulas_by_key)
+
+        assert results_by_key["1"]["times"] == self.times
+        assert results_by_key["1"]["values"] == [None, 20.0, 30.0, 40.0]
+        assert results_by_key["1"]["value"] == 40.0
+        assert results_by_key["2"] == {"value": 10.0, "times": [], "values": []}
+
+    def test_time_range_applied(self):
+        formulas_by_key = {"1": "mean(dp_{})".format(self.datapoint_1.id)}
+
+        results_by_key = evaluate_formulas(
+            formulas_by_key, time__gte=self.times[1], time__lt=self.times[3]
+        )
+
+        assert results_by_key["1"]["value"] == 2.5
+
+    def test_microseconds_exact(self):
+        time = datetime(2022, 1, 1, 0, 0, 0, 123456, tzinfo=timezone.utc)
+        formulas_by_key = {"1": "dp_{}".format(self.datapoint_2.id)}
+        ValueMessage.objects.create(
+            datapoint=self.datapoint_2, time=time, value=1.0
+        )
+
+        results_by_key = evaluate_formulas(formulas_by_key)
+
+        assert results_by_key["1"]["times"][0] == time
+        assert to_microseconds(time) % 1000000 == 123456
+
+    def test_latest_equals_last_value_of_history(self):
+        dp_id_1 = self.datapoint_1.id
+        dp_id_2 = self.datapoint_2.id
+        LastValueMessage.objects.create(
+            datapoint=self.datapoint_1, time=self.times[3], value=4.0
+        )
+        LastValueMessage.objects.create(
+            datapoint=self.datapoint_2, time=self.times[1], value=10.0
+        )
+        formulas_by_key = {
+            "1": "dp_{} * dp_{}".format(dp_id_1, dp_id_2),
+            "2": "sum(dp_{}) + max(dp_{})".format(dp_id_1, dp_id_2),
+            "3": "mean(dp_{}) / min(dp_{})".format(dp_id_1, dp_id_1),
+        }
+
+        # One query for the last values and one for the reductions.
+        with self.assertNumQueries(2):
+            results_by_key = evaluate_formulas_latest(formulas_by_key)
+
+        expected_results_by_key = {
+            key: {"value": result["value"]}
+            for key, result in evaluate_formulas(formulas_by_key).items()
+        }
+        assert results_by_key == expected_results_by_key
+        assert results_by_key["1"] == {"value": 40.0}
+
+    def test_latest_undefined_without_values(self):
+        datapoint = Datapoint.objects.create(type="Sensor")
+        LastValueMessage.objects.create(
+            datapoint=self.datapoint_2, time=self.times[1], value="on"
+        )
+        formulas_by_key = {
+            "1": "dp_{}".format(datapoint.id),
+            "2": "dp_{}".format(self.datapoint_2.id),
+            "3": "sum(dp_{})".format(datapoint.id),
+            "4": "mean(dp_{})".format(datapoint.id),
+        }
+
+        results_by_key = evaluate_formulas_latest(formulas_by_key)
+
+        assert results_by_key == {
+            "1": {"value": None},
+            "2": {"value": None},
+            "3": {"value": 0.0},
+            "4": {"value": None},
+        }
+
+
+class TestMetricEvaluationEndpoint(TestCase):
+    endpoint_url = "/" + API_ROOT_PATH + "evaluation_system/metric/evaluate/"
+
+    def setUp(self):
+        self.client = Client()
+        self.datapoint = Datapoint.objects.create(type="Sensor")
+        self.times = [
+            datetime(2022, 1, 1, hour, tzinfo=timezone.utc)
+            for hour in range(3)
+        ]
+        for time, value in zip(self.times, [1.0, 2.0, 3.0]):
+            ValueMessage.objects.create(
+                datapoint=self.datapoint, time=time, value=value
+            )
+        LastValueMessage.objects.create(
+            datapoint=self.datapoint, time=self.times[-1], value=3.0
+        )
+        self.metric = Metric.objects.create(
+            name="Double", formula="2 * dp_{}".format(self.datapoint.id)
+        )
+
+    def get_results(self, params):
+        response = self.client.get(self.endpoint_url, params)
+        assert response.status_code == 200, response.content
+        return response.json()
+
+    def test_latest_evaluated_without_series(self):
+        results = self.get_results({"id__in": [self.metric.id]})
+
+        assert results == {
+            str(self.metric.id): {
+                "value": 6.0,
+                "times": None,
+                "values": None,
+                "error": None,
+            }
+        }
+
+    def test_series_returned_if_requested(self):
+        params = {
+            "id__in": [self.metric.id],
+            "time__gte": self.times[1].isoformat(),
+        }
+
+        results = self.get_results(params)
+        assert results[str(self.metric.id)]["value"] == 6.0
+        assert results[str(self.metric.id)]["values"] is None
+
+        params["include_series"] = True
+        results = self.get_results(params)
+        assert results[str(self.metric.id)]["times"] == [
+            t.isoformat() for t in self.times[1:]
+        ]
+        assert results[str(self.metric.id)]["values"] == [4.0, 6.0]
+
+    def test_errors_returned_per_metric(self):
+        invalid_metric = Metric.objects.create(name="Invalid", formula="dp_1 +")
+        missing_id = invalid_metric.id + 1
+
+        results = self.get_results(
+            {"id__in": [self.metric.id, invalid_metric.id, missing_id]}
+        )
+
+        assert results[str(self.metric.id)]["value"] == 6.0
+        assert results[str(self.metric.id)]["error"] is None
+        assert results[str(invalid_metric.id)]["value"] is None
+        assert "not valid" in results[str(invalid_metric.id)]["error"]
+        assert results[str(missing_id)] == {
+            "value": None,
+            "times": None,
+            "values": None,
+            "error": "Metric does not exist.",
+        }
+
+    def test_series_requires_time_range(self):
+        params = {"id__in": [self.metric.id], "include_series": True}
+
+        response = self.client.get(self.endpoint_url, params)
+
+        assert response.status_code == 400
@@ -68,6 +68,46 @@ def get_app_nav_content_for_user(user):
     return app_nav_content
 
 
+def get_app_nav_content_for_users(users):
+    """
+    Like `get_app_nav_content_for_user` but for many users at once.
+
+    Parameters
+    ----------
+    users : list of django.contrib.auth.model.User
+        The users for which the the available pages should be computed.
+
+    Returns
+    -------
+    app_nav_content_by_user_pk: dict
+        The app_nav_content (see `get_app_nav_content_for_user`) with the
+        primary keys of the users as keys.
+    """
+    # These imports must be here as they cannot succeed until all apps are
+    # loaded.
+    from emp_main.permissions import get_objects_for_users
+    from .models import ExternalPage
+
+    pages = ExternalPage.objects.select_related("group").order_by("id", "name")
+    pages_by_user_pk = get_objects_for_users(
+        users, "emp_external_page.view_externalpage", pages
+    )
+
+    app_nav_content_by_user_pk = {}
+    for user_pk, pages_user in pages_by_user_pk.items():
+        app_nav_content = OrderedDict()
+        for page_obj in pages_user:
+            group_name = page_obj.group.name
+            if group_name not in app_nav_content:
+                app_nav_content[group_name] = OrderedDict()
+
+            page_url = page_obj.get_absolute_url()
+            app_nav_content[group_name][page_obj.name] = page_url
+        app_nav_content_by_user_pk[user_pk] = app_nav_content
+
+    return app_nav_content_by_user_pk
+
+
 def get_permitted_datapoint_ids_for_user(user):
     """
     External pages have no direct access to datapoint data.
@@ -14,23 +14,39 @@ this file is hence grouped in to `View` classes, quite similar to Django's
 class based views. However, due to the limitation in Ninja, patching up
 the methods to the NinjaAPI must happen outside this classes.
 """
+import asyncio
+import base64
 from datetime import datetime
+from enum import Enum
+import hashlib
+from io import BytesIO
 import json
 import logging
+from time import monotonic
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
+from django.conf import settings
 from django.db import IntegrityError
+from django.db import connection
 from django.db import models
 from django.db import transaction
 from django.http import HttpResponse
 from django.http import Http404
+from django.http import StreamingHttpResponse
+from django.db.models import Q
+from django.db.models.functions import DenseRank
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from ninja import NinjaAPI
 from ninja import Path
 from ninja import Query
 from ninja import Schema
-import pandas as pd
+import orjson
+from prometheus_client import Histogram
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pydantic import Field
 
 from esg.models.datapoint import DatapointList
@@ -43,6 +59,7 @@ from esg.models.datapoint import ScheduleMessageListByDatapointId
 from esg.models.datapoint import SetpointMessageByDatapointId
 from esg.models.datapoint import SetpointMessageListByDatapointId
 from esg.models.datapoint import ForecastMessageListByDatapointId
+from esg.django_models.datapoint import ScheduleSetpointJSONEncoder
 from esg.django_models.filter import DatapointFilterParams
 from esg.django_models.filter import ValueMessageFilterParams
 from esg.django_models.filter import ScheduleMessageFilterParams
@@ -56,8 +73,13 @@ from esg.models.metadata import ProductRunList
 from esg.models.metadata import PlantList
 from esg.models.request import HTTPError
 from esg.services.base import RequestInducedException
-from esg.utils.pandas import value_dataframe_from_dataframe
 
+from . import ingest
+from . import rollups
+from . import write_behind
+from . import serializers
+from .caches import ChangeCounter
+from .caches import LatestMessageCache
 from .models import Datapoint as DatapointDb
 from emp_main.models import ValueMessage as ValueHistoryDb
 from emp_main.models import LastValueMessage as ValueLatestDb
@@ -72,9 +94,85 @@ from emp_main.models import Plant as PlantDb
 
 logger = logging.getLogger(__name__)
 
+prom_channel_layer_publish_duration = Histogram(
+    "emp_api_channel_layer_publish_duration_seconds",
+    "Time spent by the REST API to publish updates on the channel layer, "
+    "per request.",
+    ["group_name"],
+)
+
 
 api = NinjaAPI(title="EMP API", version="v1", docs_url="/",)
 
+# Changes of the datapoint metadata, which also affect the responses of the
+# datapoint related endpoints, as these can filter by datapoint metadata.
+metadata_change_counter = ChangeCounter("metadata")
+
+
+class StreamingParams(Schema):
+    """
+    Query parameters to control how history data is returned.
+    """
+
+    stream: bool = Field(
+        False,
+        description=(
+            "If `true` the response is streamed, i.e. generated incrementally "
+            "while the data is read from the database. This keeps memory "
+            "usage flat for large time ranges. The content of the response "
+            "is the same, but messages are ordered by datapoint and time."
+        ),
+    )
+
+
+class PaginationParams(Schema):
+    """
+    Query parameters to fetch large results in several pages.
+    """
+
+    limit: int = Field(
+        None,
+        ge=1,
+        description=(
+            "The maximum number of items returned. Defaults to, and is "
+            "capped at, the server side maximum page size. If more items "
+            "match the filters the response carries a `X-Next-Cursor` "
+            "header."
+        ),
+    )
+    cursor: str = Field(
+        None,
+        description=(
+            "The value of the `X-Next-Cursor` header of the previous "
+            "response. Returns the page following that response. All other "
+            "query parameters should be the same as in the previous request."
+        ),
+    )
+
+
+class ColumnarFormat(str, Enum):
+    """
+    The formats supported by the columnar history endpoints.
+    """
+
+    arrow = "arrow"
+    parquet = "parquet"
+
+
+class ColumnarParams(Schema):
+    """
+    Query parameters of the columnar history endpoints.
+    """
+
+    format: ColumnarFormat = Field(
+        ColumnarFormat.arrow,
+        description=(
+            "`arrow` returns an Apache Arrow IPC stream, `parquet` a Parquet "
+            "file. Both contain the columns `time`, `datapoint_id` and the "
+            "payload columns of the respective message type."
+        ),
+    )
+
 
 class GenericAPIView:
     """
@@ -87,10 +185,14 @@ class GenericAPIView:
         serialize the output of `list_*` operations.
     DBModel: esg.django_models.DjangoBaseModel instance.
         The django model to interact with the DB.
+    change_counters: list of emp_main.caches.ChangeCounter
+        The counters of all tables the response of `list_latest` depends
+        on. These are used to compute the ETag. Empty disables ETags.
     """
 
     PydanticModel = None
     DBModel = None
+    change_counters = []
 
     def _handle_exceptions(method):
         """
@@ -158,8 +260,250 @@ class GenericAPIView:
                 active_filters[filter_key] = filter_value
         return active_filters
 
+    def encode_cursor(self, key_values):
+        """
+        Create the opaque pagination token pointing after an item.
+
+        Arguments:
+        ----------
+        key_values: list
+            The values of the key fields of the last item of a page.
+
+        Returns:
+        --------
+        cursor: str
+            The token as URL safe string.
+        """
+        key_values_jsonable = []
+        for key_value in key_values:
+            if isinstance(key_value, datetime):
+                key_value = key_value.isoformat()
+            key_values_jsonable.append(key_value)
+        cursor_json = json.dumps(key_values_jsonable)
+        cursor = base64.urlsafe_b64encode(cursor_json.encode()).decode()
+        return cursor
+
+    def decode_cursor(self, cursor, key_fields):
+        """
+        Reverse of `encode_cursor`.
+
+        Arguments:
+        ----------
+        cursor: str
+            The pagination token as received from the client.
+        key_fields: list of str
+            The names of the fields the token has been created for.
+
+        Returns:
+        --------
+        key_values: list
+            The values of the key fields, one for each item in `key_fields`.
+
+        Raises:
+        -------
+        RequestInducedException:
+            If the token is not valid for `key_fields`.
+        """
+        try:
+            cursor_json = base64.urlsafe_b64decode(cursor.encode()).decode()
+            key_values = json.loads(cursor_json)
+            if len(key_values) != len(key_fields):
+                raise ValueError("Cursor has wrong number of key values.")
+            for i, key_field in enumerate(key_fields):
+                if key_field == "time":
+                    key_values[i] = datetime.fromisoformat(key_values[i])
+        except Exception:
+            raise RequestInducedException(
+                detail="Invalid pagination cursor: `{}`".format(cursor)
+            )
+        return key_values
+
+    def get_page_queryset(
+        self, objects, key_fields, pagination_params=None, limit=None
+    ):
+        """
+        Apply keyset pagination to a queryset.
+
+        Keyset pagination orders by `key_fields` and continues after the
+        key values encoded in the cursor. In contrast to offset based
+        pagination this can be answered from an index without scanning
+        the skipped rows.
+
+        Arguments:
+        ----------
+        objects: django.db.models.QuerySet
+            The objects to paginate. `key_fields` must identify an object
+            uniquely.
+        key_fields: list of str
+            The field names used for ordering and to build the cursor.
+        pagination_params: instance of `PaginationParams`
+            The pagination parameters as requested by the client.
+        limit: int
+            The limit used if the client hasn't requested one.
+
+        Returns:
+        --------
+        objects: django.db.models.QuerySet
+            The ordered objects after the cursor, not yet sliced.
+        limit: int or None
+            The number of objects that should be returned. None if
+            neither the client nor the `limit` argument define one.
+        """
+        cursor = None
+        if pagination_params is not None:
+            cursor = pagination_params.cursor
+            if pagination_params.limit is not None:
+                if limit is None or pagination_params.limit < limit:
+                    limit = pagination_params.limit
+
+        objects = objects.order_by(*key_fields)
+
+        if cursor is not None:
+            key_values = self.decode_cursor(cursor, key_fields)
+            # Build (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ... which is
+            # the expanded form of (k1, k2, ...) > (v1, v2, ...).
+            keyset_filter = Q()
+            for i, key_field in enumerate(key_fields):
+                filter_kwargs = dict(zip(key_fields[:i], key_values[:i]))
+                filter_kwargs[key_field + "__gt"] = key_values[i]
+                keyset_filter |= Q(**filter_kwargs)
+            objects = objects.filter(keyset_filter)
+
+        return objects, limit
+
+    def get_page(self, objects, key_fields, pagination_params=None):
+        """
+        Fetch one page of objects with keyset pagination.
+
+        The page size is limited to `settings.API_MAX_PAGE_SIZE`. See
+        `get_page_queryset` for the arguments.
+
+        Raises:
+        -------
+        RequestInducedException:
+            If the client hasn't requested pagination (i.e. neither `limit`
+            nor `cursor`) but there are more objects than fit in one page.
+            Silently truncating the result would break clients that are
+            not aware of pagination.
+
+        Returns:
+        --------
+        page: list
+            The objects of the page. These are model instances or dicts,
+            depending on `objects`.
+        next_cursor: str or None
+            The cursor pointing to the next page. None if this is the
+            last page.
+        """
+        objects, limit = self.get_page_queryset(
+            objects=objects,
+            key_fields=key_fields,
+            pagination_params=pagination_params,
+            limit=settings.API_MAX_PAGE_SIZE,
+        )
+
+        # Fetch one more object then requested to check if there is a
+        # next page, without the need of an extra query.
+        page = list(objects[: limit + 1])
+        next_cursor = None
+        if len(page) > limit:
+            paginated = pagination_params is not None and (
+                pagination_params.limit is not None
+                or pagination_params.cursor is not None
+            )
+            if not paginated:
+                raise RequestInducedException(
+                    detail=(
+                        "The result contains more than {} items. Please "
+                        "fetch it in pages using the `limit` and `cursor` "
+                        "query parameters.".format(limit)
+                    )
+                )
+            page = page[:limit]
+            last_object = page[-1]
+            if isinstance(last_object, dict):
+                key_values = [last_object[f] for f in key_fields]
+            else:
+                key_values = [getattr(last_object, f) for f in key_fields]
+            next_cursor = self.encode_cursor(key_values)
+
+        return page, next_cursor
+
+    def add_next_cursor_header(self, response, next_cursor):
+        """
+        Inform the client that there is a next page, if there is one.
+        """
+        if next_cursor is not None:
+            response["X-Next-Cursor"] = next_cursor
+        return response
+
+    def get_etag(self, request):
+        """
+        Compute the ETag of the response to the request without touching
+        the DB, from the versions in `change_counters` and the requested URL.
+
+        Arguments:
+        ----------
+        request: django.http.HttpRequest or None
+            The request to compute the ETag for. None if the caller is
+            not a HTTP client (e.g. the websocket consumers).
+
+        Returns:
+        --------
+        etag: str or None
+            The quoted ETag or None if ETags are not available.
+        last_modified: float or None
+            The time of the last change of any of the tables as unix
+            timestamp, None if ETags are not available.
+        """
+        if request is None or not self.change_counters:
+            return None, None
+        if not all(counter.enabled for counter in self.change_counters):
+            return None, None
+
+        versions = []
+        last_modified = 0
+        for change_counter in self.change_counters:
+            version, counter_last_modified = change_counter.get()
+            versions.append(str(version))
+            last_modified = max(last_modified, counter_last_modified)
+
+        # The same tables serve different responses for different filters.
+        url_hash = hashlib.sha1(request.get_full_path().encode())
+        etag = '"{}-{}"'.format("-".join(versions), url_hash.hexdigest()[:16])
+        return etag, last_modified
+
+    def get_not_modified_response(self, request, etag, last_modified):
+        """
+        Return a 304 response if the client has the current version already.
+
+        Only `If-None-Match` is evaluated, as `Last-Modified` has a resolution
+        of one second only, which would hide changes that follow each other
+        quickly.
+
+        Returns:
+        --------
+        http_response: django.http.HttpResponse or None
+            The 304 response or None if the full response must be sent.
+        """
+        if etag is None:
+            return None
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            return None
+        return self.add_etag_headers(response, etag, last_modified)
+
+    def add_etag_headers(self, response, etag, last_modified):
+        """
+        Add `ETag` and `Last-Modified` headers, if ETags are available.
+        """
+        if etag is not None:
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
     @_handle_exceptions
-    def list_latest(self, request, filter_params=None):
+    def list_latest(self, request, filter_params=None, pagination_params=None):
         """
         List latest state of plants.
 
@@ -171,8 +515,14 @@ class GenericAPIView:
         active_filters = self.build_active_filter_dict(filter_params)
         objects_filtered = objects_all.filter(**active_filters)
 
+        objects_page, next_cursor = self.get_page(
+            objects=objects_filtered,
+            key_fields=["id"],
+            pagination_params=pagination_params,
+        )
+
         objects_as_python = []
-        for object in objects_filtered:
+        for object in objects_page:
             objects_as_python.append(object.load_to_dict())
 
         objects_pydantic = self.PydanticModel.construct_recursive(
@@ -181,9 +531,10 @@ class GenericAPIView:
 
         objects_json = objects_pydantic.json()
 
-        return HttpResponse(
+        response = HttpResponse(
             content=objects_json, status=200, content_type="application/json"
         )
+        return self.add_next_cursor_header(response, next_cursor)
 
     @_handle_exceptions
     def update_latest(self, request, objects_pydantic):
@@ -249,9 +600,17 @@ class GenericDatapointAPIView(GenericAPIView):
     -----------
     DatapointModel: django.db.models.Model
         The django model used to fetch/write datapoint metadata from/to db.
+    publish_concurrency: int
+        The maximum number of messages that are sent concurrently to the
+        channel layer by `publish_on_channel_layer`.
+    publish_batch_size: int
+        The maximum number of datapoints contained in one message sent
+        to the channel layer by `publish_on_channel_layer`.
     """
 
     DatapointModel = DatapointDb
+    publish_concurrency = 100
+    publish_batch_size = 1000
 
     def __init__(self):
         """
@@ -259,6 +618,72 @@ class GenericDatapointAPIView(GenericAPIView):
         """
         self.channel_layer = get_channel_layer()
 
+    def publish_on_channel_layer(self, group_name, json_by_dp_id):
+        """
+        Publish updated data on the broadcast group of the message type.
+
+        The messages are sent in batches of up to `publish_batch_size`
+        datapoints, each batch is a single message on the channel layer
+        that is fanned out to the subscribed websocket connections by the
+        consumers (see `emp_main.subscriptions`). All batches are sent
+        concurrently within one pass through the event loop. The time
+        spent is recorded in a Prometheus histogram.
+
+        Arguments:
+        ----------
+        group_name: str
+            The name of the channel layer group, e.g.
+            `datapoint.value.latest`.
+        json_by_dp_id: dict
+            The JSON strings to publish as values, the datapoint IDs (as str)
+            as keys.
+        """
+        if not json_by_dp_id:
+            return
+
+        publish_start = monotonic()
+        async_to_sync(self._group_send_all)(group_name, json_by_dp_id)
+        publish_duration = monotonic() - publish_start
+
+        prom_channel_layer_publish_duration.labels(
+            group_name=group_name
+        ).observe(publish_duration)
+        logger.debug(
+            "Published %s messages on channel layer group %s in %.3f s.",
+            len(json_by_dp_id),
+            group_name,
+            publish_duration,
+        )
+
+    async def _group_send_all(self, group_name, json_by_dp_id):
+        """
+        Async part of `publish_on_channel_layer`.
+
+        The number of concurrent `group_send` calls is limited by
+        `publish_concurrency` as every pending call may hold a connection
+        to the channel layer backend.
+        """
+        semaphore = asyncio.Semaphore(self.publish_concurrency)
+
+        async def group_send(json_by_dp_id_batch):
+            async with semaphore:
+                await self.channel_layer.group_send(
+                    group_name,
+                    {
+                        "type": "datapoint.related.batch",
+                        "group": group_name,
+                        "json_by_dp_id": json_by_dp_id_batch,
+                    },
+                )
+
+        dp_ids = list(json_by_dp_id)
+        batches = []
+        for i in range(0, len(dp_ids), self.publish_batch_size):
+            batch_dp_ids = dp_ids[i : i + self.publish_batch_size]
+            batches.append({d: json_by_dp_id[d] for d in batch_dp_ids})
+
+        await asyncio.gather(*[group_send(b) for b in batches])
+
     def get_filtered_datapoints(self, datapoint_filter_params):
         """
         Return a queryset of datapoints matching the requested filter
@@ -362,8 +787,29 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
         Like `unique_together_fields_latest` but for `RelatedDataHistoryModel`.
     second_related_field_name : str
         The field name of the second related field.
-    channel_group_base_name: str
-        The the non datapoint id dependend part of the channels group name.
+    channel_group_name: str
+        The name of the channel layer group updates are published on.
+    stream_chunk_size: int
+        The number of rows fetched from DB (and sent to the client) at once
+        if `list_history` is called with `stream=True`. Also used as size
+        of the record batches of `list_history_columnar`.
+    ndjson_batch_size: int
+        The number of messages written to DB at once by
+        `update_history_ndjson`.
+    latest_cache: emp_main.caches.LatestMessageCache
+        The cache for the items of `RelatedDataLatestModel`. None disables
+        caching.
+    latest_change_counter: emp_main.caches.ChangeCounter
+        Counts the changes of `RelatedDataLatestModel`. Should also be
+        contained in `change_counters` to enable ETags for `list_latest`.
+    row_serializer: emp_main.serializers.RowSerializer
+        Converts the rows of the related models to JSON in the format
+        of `list_latest_response_model` and `list_history_response_model`.
+    columnar_history_columns: dict
+        Maps column names to `(field name, pyarrow type)` tuples defining
+        the payload columns returned by `list_history_columnar`. The columns
+        `time` and `datapoint_id` are always included. Values of string
+        columns that are not strings already are JSON encoded.
 
     """
 
@@ -375,7 +821,39 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
     unique_together_fields_latest = ["datapoint"]
     unique_together_fields_history = ["datapoint", "time"]
     second_related_field_name = None
-    channel_group_base_name = None
+    channel_group_name = None
+    stream_chunk_size = 2000
+    ndjson_batch_size = 10000
+    latest_cache = None
+    latest_change_counter = None
+    row_serializer = None
+    columnar_history_columns = {}
+
+    def get_message_fields(self, response_model):
+        """
+        Return the field names of the messages contained in a response model.
+
+        The response models have a `Dict[str, Message]` or a
+        `Dict[str, List[Message]]` as root element, pydantic stores the
+        innermost type as `type_`. The field names are identical to the
+        columns of the related Django models, which allows fetching
+        exactly the serialized columns with `values()`.
+
+        Arguments:
+        ----------
+        response_model: esg.models.base._BaseModel
+            `list_latest_response_model` or `list_history_response_model`.
+
+        Returns:
+        --------
+        message_model: esg.models.base._BaseModel
+            The pydantic model of a single message.
+        field_names: list of str
+            The names of the fields of `message_model`.
+        """
+        message_model = response_model.__fields__["__root__"].type_
+        field_names = list(message_model.__fields__)
+        return message_model, field_names
 
     @GenericAPIView._handle_exceptions
     def list_latest(
@@ -384,10 +862,26 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
         datapoint_filter_params,
         related_filter_params=None,
         second_related_filter_params=None,
+        pagination_params=None,
     ):
         """
         Returns the latest data item per datapoint.
         """
+        # Check first if the client has the latest version already.
+        etag, last_modified = self.get_etag(request)
+        response = self.get_not_modified_response(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        response = self.list_latest_from_cache(
+            datapoint_filter_params=datapoint_filter_params,
+            related_filter_params=related_filter_params,
+            second_related_filter_params=second_related_filter_params,
+            pagination_params=pagination_params,
+        )
+        if response is not None:
+            return self.add_etag_headers(response, etag, last_modified)
+
         # TODO: Add test that list calls this method to fetch filtered
         #       datapoints, and of course that the query params are forewarded.
         datapoints = self.get_filtered_datapoints(datapoint_filter_params)
@@ -410,18 +904,108 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
             active_filters.update(active_filters_second)
         related_objects = related_objects.filter(**active_filters)
 
-        # Group by datapoint ID.
+        # Fetch only the serialized columns. Using the `datapoint_id` column
+        # directly prevents one extra query per row for the datapoint.
+        _, message_fields = self.get_message_fields(
+            self.list_latest_response_model
+        )
+        related_objects = related_objects.values(
+            "datapoint_id", *message_fields
+        )
+
+        related_objects_page, next_cursor = self.get_page(
+            objects=related_objects,
+            key_fields=["datapoint_id"],
+            pagination_params=pagination_params,
+        )
+
+        # Group by datapoint ID and convert to jsonable.
         related_objects_as_dict = {}
-        for obj in related_objects:
-            related_objects_as_dict[str(obj.datapoint.id)] = obj.load_to_dict()
+        for related_object in related_objects_page:
+            dp_id = str(related_object.pop("datapoint_id"))
+            related_objects_as_dict[dp_id] = self.row_serializer.convert(
+                related_object
+            )
 
-        # Convert to jsonable, skip validation.
-        output_pydantic_model = self.list_latest_response_model
-        related_objects_as_pydantic = output_pydantic_model.construct_recursive(
-            __root__=related_objects_as_dict
+        related_objects_as_json = serializers.dumps(related_objects_as_dict)
+
+        response = HttpResponse(
+            content=related_objects_as_json,
+            status=200,
+            content_type="application/json",
+        )
+        response = self.add_etag_headers(response, etag, last_modified)
+        return self.add_next_cursor_header(response, next_cursor)
+
+    def list_latest_from_cache(
+        self,
+        datapoint_filter_params,
+        related_filter_params=None,
+        second_related_filter_params=None,
+        pagination_params=None,
+    ):
+        """
+        Like `list_latest` but loads the items from `latest_cache`.
+
+        The cache is only used for requests that filter by datapoint IDs
+        only, which is how dashboards and the websocket consumers request
+        the latest items. Items missing in the cache are loaded from DB
+        and added to the cache.
+
+        Returns:
+        --------
+        http_response: django.http.HttpResponse or None
+            The requested items as JSON string or None if the request can't
+            be served from cache.
+        """
+        if self.latest_cache is None or not self.latest_cache.enabled:
+            return None
+        datapoint_filters = self.build_active_filter_dict(
+            datapoint_filter_params
         )
+        if list(datapoint_filters) != ["id__in"]:
+            return None
+        if self.build_active_filter_dict(related_filter_params):
+            return None
+        if self.build_active_filter_dict(second_related_filter_params):
+            return None
+        if self.build_active_filter_dict(pagination_params):
+            return None
+        datapoint_ids = sorted({int(i) for i in datapoint_filters["id__in"]})
+        if len(datapoint_ids) > settings.API_MAX_PAGE_SIZE:
+            return None
+
+        related_objects_by_dp_id = self.latest_cache.get_many(datapoint_ids)
+
+        missing_dp_ids = [
+            dp_id
+            for dp_id in datapoint_ids
+            if dp_id not in related_objects_by_dp_id
+        ]
+        if missing_dp_ids:
+            _, message_fields = self.get_message_fields(
+                self.list_latest_response_model
+            )
+            related_objects = self.RelatedDataLatestModel.objects.filter(
+                datapoint_id__in=missing_dp_ids
+            ).values("datapoint_id", *message_fields)
+            loaded_objects_by_dp_id = {}
+            for related_object in related_objects:
+                dp_id = related_object.pop("datapoint_id")
+                loaded_objects_by_dp_id[dp_id] = self.row_serializer.convert(
+                    related_object
+                )
+            self.latest_cache.set_many(loaded_objects_by_dp_id)
+            related_objects_by_dp_id.update(loaded_objects_by_dp_id)
 
-        related_objects_as_json = related_objects_as_pydantic.json()
+        # Same order as the items loaded from DB in `list_latest`.
+        related_objects_as_dict = {}
+        for dp_id in datapoint_ids:
+            if dp_id in related_objects_by_dp_id:
+                related_object = related_objects_by_dp_id[dp_id]
+                related_objects_as_dict[str(dp_id)] = related_object
+
+        related_objects_as_json = serializers.dumps(related_objects_as_dict)
 
         return HttpResponse(
             content=related_objects_as_json,
@@ -429,16 +1013,25 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
             content_type="application/json",
         )
 
-    @GenericAPIView._handle_exceptions
-    def list_history(
+    def get_filtered_history_objects(
         self,
-        request,
         datapoint_filter_params,
         related_filter_params,
         second_related_filter_params=None,
     ):
         """
-        Returns the historic data item per datapoint.
+        Return a queryset of history items matching the requested filter
+        parameters.
+
+        Arguments:
+        ----------
+        datapoint_filter_params: instance of `DatapointFilterParams`
+            Defines the filters that should be applied to the datapoints.
+        related_filter_params: instance of `ninja.Schema`
+            Defines the filters that should be applied to the history items.
+        second_related_filter_params: instance of `ninja.Schema`
+            Defines the filters that should be applied to the second related
+            model. Only used if `SecondRelatedModel` is defined.
         """
         datapoints = self.get_filtered_datapoints(datapoint_filter_params)
 
@@ -464,27 +1057,262 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
             active_filters[second_objects_filter] = second_related_objects
         related_objects = related_objects.filter(**active_filters)
 
-        # Make a list of objects belonging to datapoint ID for each datapoint.
+        return related_objects
+
+    @GenericAPIView._handle_exceptions
+    def list_history(
+        self,
+        request,
+        datapoint_filter_params,
+        related_filter_params,
+        second_related_filter_params=None,
+        stream=False,
+        pagination_params=None,
+    ):
+        """
+        Returns the historic data item per datapoint.
+
+        If `stream` is True the response is a `StreamingHttpResponse` that
+        is generated while iterating over the rows in DB, which keeps the
+        memory usage independent of the number of returned items. Streamed
+        responses are only paginated if the client requests a limit, as
+        the streaming is intended to deliver large results in one go.
+        """
+        related_objects = self.get_filtered_history_objects(
+            datapoint_filter_params=datapoint_filter_params,
+            related_filter_params=related_filter_params,
+            second_related_filter_params=second_related_filter_params,
+        )
+        # Sorting by datapoint first is also required by the streaming,
+        # which groups by datapoint while writing the output.
+        key_fields = ["datapoint_id", "time"]
+
+        # Fetch only the serialized columns, see `list_latest`.
+        _, message_fields = self.get_message_fields(
+            self.list_history_response_model
+        )
+        related_objects = related_objects.values(
+            "datapoint_id", *message_fields
+        )
+
+        if stream:
+            related_objects, limit = self.get_page_queryset(
+                objects=related_objects,
+                key_fields=key_fields,
+                pagination_params=pagination_params,
+            )
+            next_cursor = None
+            if limit is not None:
+                # Check if there is an item after the page, that is
+                # before any content has been streamed.
+                boundary = related_objects.values_list(*key_fields)
+                boundary = list(boundary[limit - 1 : limit + 1])
+                if len(boundary) > 1:
+                    next_cursor = self.encode_cursor(boundary[0])
+                related_objects = related_objects[:limit]
+            response = StreamingHttpResponse(
+                streaming_content=self._iter_history_json(related_objects),
+                status=200,
+                content_type="application/json",
+            )
+            return self.add_next_cursor_header(response, next_cursor)
+
+        related_objects_page, next_cursor = self.get_page(
+            objects=related_objects,
+            key_fields=key_fields,
+            pagination_params=pagination_params,
+        )
+
+        # Make a list of objects belonging to datapoint ID for each datapoint
+        # and convert to jsonable.
         related_objects_as_dict = {}
-        for obj in related_objects:
-            dp_id = str(obj.datapoint.id)
+        for related_object in related_objects_page:
+            dp_id = str(related_object.pop("datapoint_id"))
             objects_datapoint = related_objects_as_dict.get(dp_id, [])
-            objects_datapoint.append(obj.load_to_dict())
+            related_object = self.row_serializer.convert(related_object)
+            objects_datapoint.append(related_object)
             related_objects_as_dict[dp_id] = objects_datapoint
 
-        # Convert to jsonable, skip validation.
-        output_pydantic_model = self.list_history_response_model
-        related_objects_as_pydantic = output_pydantic_model.construct_recursive(
-            __root__=related_objects_as_dict
-        )
-
-        related_objects_as_json = related_objects_as_pydantic.json()
+        related_objects_as_json = serializers.dumps(related_objects_as_dict)
 
-        return HttpResponse(
+        response = HttpResponse(
             content=related_objects_as_json,
             status=200,
             content_type="application/json",
         )
+        return self.add_next_cursor_header(response, next_cursor)
+
+    def _iter_history_json(self, related_objects):
+        """
+        Yield the JSON representation of the history data chunk by chunk.
+
+        The yielded strings concatenate to the same JSON document the non
+        streaming version of `list_history` would return, i.e. to
+        `{"dp_id": [msg, ...], ...}`. The queryset is iterated with
+        `iterator` which uses server side cursors on PostgreSQL, so only
+        `stream_chunk_size` rows are held in memory at any time.
+
+        Arguments:
+        ----------
+        related_objects: django.db.models.QuerySet
+            The history items to serialize as dicts, i.e. the result of
+            `values()` including `datapoint_id`. Must be ordered by
+            datapoint.
+
+        Yields:
+        -------
+        json_chunk: bytes
+            A part of the JSON document.
+        """
+        yield b"{"
+        current_dp_id = None
+        json_chunk = []
+        try:
+            related_objects_iter = related_objects.iterator(
+                chunk_size=self.stream_chunk_size
+            )
+            for related_object in related_objects_iter:
+                dp_id = str(related_object.pop("datapoint_id"))
+                if dp_id != current_dp_id:
+                    if current_dp_id is not None:
+                        json_chunk.append(b"],")
+                    json_chunk.append(serializers.dumps(dp_id) + b":[")
+                    current_dp_id = dp_id
+                else:
+                    json_chunk.append(b",")
+
+                json_chunk.append(self.row_serializer.dumps(related_object))
+
+                if len(json_chunk) >= self.stream_chunk_size:
+                    yield b"".join(json_chunk)
+                    json_chunk = []
+        except Exception:
+            # The status code has already been sent at this point, the best
+            # we can do is to stop and leave the client with a broken JSON.
+            logger.exception("Caught exception while streaming history.")
+            raise
+
+        if current_dp_id is not None:
+            json_chunk.append(b"]")
+        json_chunk.append(b"}")
+        yield b"".join(json_chunk)
+
+    @GenericAPIView._handle_exceptions
+    def list_history_columnar(
+        self,
+        request,
+        datapoint_filter_params,
+        related_filter_params,
+        columnar_params,
+        second_related_filter_params=None,
+    ):
+        """
+        Returns the historic data items as columns, i.e. as Apache Arrow IPC
+        stream or as Parquet file.
+
+        This is intended for clients that process large amounts of data,
+        as the data can be loaded (e.g. into pandas) without parsing one
+        JSON object per message. Like the streaming version of
+        `list_history` the response is generated while iterating over
+        the rows in DB.
+        """
+        related_objects = self.get_filtered_history_objects(
+            datapoint_filter_params=datapoint_filter_params,
+            related_filter_params=related_filter_params,
+            second_related_filter_params=second_related_filter_params,
+        )
+        related_objects = related_objects.order_by("datapoint_id", "time")
+
+        if columnar_params.format == ColumnarFormat.parquet:
+            content_type = "application/vnd.apache.parquet"
+        else:
+            content_type = "application/vnd.apache.arrow.stream"
+
+        return StreamingHttpResponse(
+            streaming_content=self._iter_history_columnar(
+                related_objects=related_objects,
+                columnar_format=columnar_params.format,
+            ),
+            status=200,
+            content_type=content_type,
+        )
+
+    def _iter_history_columnar(self, related_objects, columnar_format):
+        """
+        Yield the history data as Arrow IPC stream or Parquet file.
+
+        Arguments:
+        ----------
+        related_objects: django.db.models.QuerySet
+            The history items to serialize.
+        columnar_format: ColumnarFormat
+            The format of the output.
+
+        Yields:
+        -------
+        data_chunk: bytes
+            A part of the Arrow IPC stream or Parquet file.
+        """
+        schema_fields = [
+            ("time", pa.timestamp("us", tz="UTC")),
+            ("datapoint_id", pa.int64()),
+        ]
+        db_field_names = ["time", "datapoint_id"]
+        for column_name, column_spec in self.columnar_history_columns.items():
+            db_field_name, column_type = column_spec
+            schema_fields.append((column_name, column_type))
+            db_field_names.append(db_field_name)
+        schema = pa.schema(schema_fields)
+
+        # Only read the columns we need, this also skips the creation of
+        # model instances.
+        rows = related_objects.values_list(*db_field_names)
+        rows_iter = rows.iterator(chunk_size=self.stream_chunk_size)
+
+        sink = BytesIO()
+        if columnar_format == ColumnarFormat.parquet:
+            writer = pq.ParquetWriter(sink, schema)
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+
+        def write_rows(rows_chunk):
+            arrays = []
+            for column_values, field in zip(zip(*rows_chunk), schema):
+                if pa.types.is_string(field.type):
+                    column_values = [
+                        v
+                        if v is None or isinstance(v, str)
+                        else json.dumps(v, cls=ScheduleSetpointJSONEncoder)
+                        for v in column_values
+                    ]
+                arrays.append(pa.array(column_values, type=field.type))
+            batch = pa.RecordBatch.from_arrays(arrays, schema=schema)
+            if columnar_format == ColumnarFormat.parquet:
+                writer.write_table(pa.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+
+        def drain_sink():
+            data_chunk = sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+            return data_chunk
+
+        try:
+            rows_chunk = []
+            for row in rows_iter:
+                rows_chunk.append(row)
+                if len(rows_chunk) >= self.stream_chunk_size:
+                    write_rows(rows_chunk)
+                    rows_chunk = []
+                    yield drain_sink()
+            if rows_chunk:
+                write_rows(rows_chunk)
+            writer.close()
+        except Exception:
+            logger.exception("Caught exception while streaming columnar data.")
+            raise
+        yield drain_sink()
 
     @GenericAPIView._handle_exceptions
     def update_latest(
@@ -492,8 +1320,12 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
     ):
         """
         Update or create the latest state of the data items.
-        """
 
+        In write-behind mode (see `emp_main.write_behind`) the items are
+        appended to the queue instead of writing these to DB, the cache
+        and the channel layer are updated right away nevertheless.
+        """
+        second_related_object = None
         if self.SecondRelatedModel is not None:
             active_filters_second = self.build_active_filter_dict(
                 second_related_filter_params
@@ -525,6 +1357,164 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
             single_dp_json = single_dp_pydantic.json()
             related_data_json_by_id[dp_id] = single_dp_json
 
+        # Prepare the items for the cache, also before they are modified.
+        latest_objects_by_dp_id = {}
+        if self.latest_cache is not None and self.latest_cache.enabled:
+            _, message_fields = self.get_message_fields(
+                self.list_latest_response_model
+            )
+            for dp_id, related_data_item in related_data_dict.items():
+                latest_object = {
+                    f: related_data_item[f]
+                    for f in message_fields
+                    if f in related_data_item
+                }
+                latest_objects_by_dp_id[int(dp_id)] = (
+                    self.row_serializer.convert(latest_object)
+                )
+
+        write_behind_entry_id = None
+        if write_behind.is_enabled() and self.SecondRelatedModel is None:
+            write_behind_entry_id = write_behind.queue.append(
+                kind=self.channel_group_name, payload=related_data.json()
+            )
+            # The numbers are unknown until the queue has been processed.
+            summary = (0, 0)
+        else:
+            summary, written_datapoint_ids = self.write_latest(
+                related_data_dict=related_data_dict,
+                second_related_object=second_related_object,
+                datapoints_db_by_id=datapoints_db_by_id,
+            )
+            # Don't replace newer messages in the cache with older ones.
+            latest_objects_by_dp_id = {
+                dp_id: latest_object
+                for dp_id, latest_object in latest_objects_by_dp_id.items()
+                if dp_id in written_datapoint_ids
+            }
+
+        # Write through to the cache. The messages haven't been compared
+        # with those in DB in write-behind mode, but the cache must not
+        # replace newer messages either.
+        if latest_objects_by_dp_id and write_behind_entry_id is not None:
+            self.latest_cache.set_many_if_not_older(latest_objects_by_dp_id)
+        elif latest_objects_by_dp_id:
+            self.latest_cache.set_many(latest_objects_by_dp_id)
+
+        # Invalidate the ETags of `list_latest`.
+        if self.latest_change_counter is not None:
+            self.latest_change_counter.bump()
+
+        # Publish updated data on channel layer.
+        self.publish_on_channel_layer(
+            group_name=self.channel_group_name,
+            json_by_dp_id=related_data_json_by_id,
+        )
+
+        if write_behind_entry_id is not None and (
+            settings.API_WRITE_BEHIND_ACK == "persisted"
+        ):
+            persisted = write_behind.queue.wait_persisted(
+                entry_id=write_behind_entry_id,
+                timeout=settings.API_WRITE_BEHIND_ACK_TIMEOUT,
+            )
+            if not persisted:
+                http_error = HTTPError(
+                    detail=(
+                        "The messages have been queued but not been written "
+                        "to DB in time. They will be written later."
+                    )
+                )
+                return HttpResponse(
+                    http_error.json(),
+                    status=503,
+                    content_type="application/json",
+                )
+
+        # Finally report, the stats
+        content_pydantic = PutSummary(
+            objects_created=summary[0], objects_updated=summary[1],
+        )
+        content = content_pydantic.json()
+
+        return HttpResponse(
+            content, status=200, content_type="application/json"
+        )
+
+    def write_latest(
+        self,
+        related_data_dict,
+        second_related_object,
+        datapoints_db_by_id=None,
+        write_history=True,
+    ):
+        """
+        Update or create items in `RelatedDataLatestModel` and (by default)
+        `RelatedDataHistoryModel` in one transaction.
+
+        On PostgreSQL both tables are written with a single statement (see
+        `emp_main.ingest.upsert_latest_and_history`), which also ensures
+        that an item doesn't replace a newer one in the latest table.
+
+        Arguments:
+        ----------
+        related_data_dict: dict
+            One message per datapoint with the datapoint IDs (as str) as
+            keys.
+        second_related_object: django.db.models.Model or None
+            The object of `SecondRelatedModel` the messages belong to.
+        datapoints_db_by_id: dict or None
+            As returned by `get_datapoints_by_ids`. Fetched if None.
+        write_history: bool
+            If False the items are only written to the latest table.
+
+        Returns:
+        --------
+        summary: tuple
+            The number of created and updated messages in the latest table.
+        written_datapoint_ids: set of int
+            The IDs of the datapoints which items have been written to the
+            latest table, i.e. without those with a newer item in DB.
+
+        Raises:
+        -------
+        RequestInducedException:
+            If datapoints could not be found for one or more IDs
+        """
+        if datapoints_db_by_id is None:
+            datapoints_db_by_id = self.get_datapoints_by_ids(
+                datapoint_ids_as_str=related_data_dict.keys()
+            )
+
+        if (
+            ingest.single_statement_upsert_available()
+            and self.SecondRelatedModel is None
+        ):
+            rows = []
+            for dp_id_str, related_data_item in related_data_dict.items():
+                row = dict(related_data_item)
+                row["datapoint_id"] = datapoints_db_by_id[dp_id_str].id
+                rows.append(self.prepare_history_item(row))
+            history_model = None
+            if write_history:
+                history_model = self.RelatedDataHistoryModel
+            n_created, n_updated, written_datapoint_ids = (
+                ingest.upsert_latest_and_history(
+                    latest_model=self.RelatedDataLatestModel,
+                    history_model=history_model,
+                    rows=rows,
+                    latest_conflict_columns=self.get_conflict_columns(
+                        self.RelatedDataLatestModel,
+                        self.unique_together_fields_latest,
+                    ),
+                    history_conflict_columns=self.get_conflict_columns(
+                        self.RelatedDataHistoryModel,
+                        self.unique_together_fields_history,
+                    ),
+                )
+            )
+            return (n_created, n_updated), written_datapoint_ids
+
         # Flatten to prepare for bulk update.
         # TODO: This is actually stupid, we flatten here and bulk_update
         # sorts back by datapoint id.
@@ -538,23 +1528,54 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
                 related_data_item[field_name] = second_related_object
             related_data_items.append(related_data_item)
 
-        # Write into latest table.
-        summary = self.RelatedDataLatestModel.bulk_update_or_create(
-            self.RelatedDataLatestModel, related_data_items
-        )
+        with transaction.atomic():
+            # Write into latest table.
+            summary = self.RelatedDataLatestModel.bulk_update_or_create(
+                self.RelatedDataLatestModel, related_data_items
+            )
 
-        # Also write into history table.
-        _ = self.RelatedDataHistoryModel.bulk_update_or_create(
-            self.RelatedDataHistoryModel, related_data_items
-        )
+            # Also write into history table.
+            if write_history:
+                _ = self.RelatedDataHistoryModel.bulk_update_or_create(
+                    self.RelatedDataHistoryModel, related_data_items
+                )
+        written_datapoint_ids = {
+            datapoint.id for datapoint in datapoints_db_by_id.values()
+        }
+        return summary, written_datapoint_ids
 
-        # Publish updated data on channel layer.
-        # TODO: Make this parallel
-        for dp_id, single_dp_json in related_data_json_by_id.items():
-            async_to_sync(self.channel_layer.group_send)(
-                self.channel_group_base_name + dp_id,
-                {"type": "datapoint.related", "json": single_dp_json},
+    @staticmethod
+    def get_conflict_columns(model, unique_together_fields):
+        """
+        Return the column names of the fields that identify a message.
+        """
+        return [
+            model._meta.get_field(field_name).column
+            for field_name in unique_together_fields
+        ]
+
+    @GenericAPIView._handle_exceptions
+    def update_history(
+        self, request, related_data, second_related_filter_params=None,
+    ):
+        """
+        Update or create the latest state of the data items.
+        """
+        second_related_object = None
+        if self.SecondRelatedModel is not None:
+            active_filters_second = self.build_active_filter_dict(
+                second_related_filter_params
             )
+            second_related_object = get_object_or_404(
+                self.SecondRelatedModel, **active_filters_second
+            )
+
+        related_data_dict = related_data.dict()["__root__"]
+
+        summary = self.write_history(
+            related_data_dict=related_data_dict,
+            second_related_object=second_related_object,
+        )
 
         # Finally report, the stats
         content_pydantic = PutSummary(
@@ -567,12 +1588,21 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
         )
 
     @GenericAPIView._handle_exceptions
-    def update_history(
-        self, request, related_data, second_related_filter_params=None,
+    def update_history_ndjson(
+        self, request, second_related_filter_params=None,
     ):
         """
-        Update or create the latest state of the data items.
+        Like `update_history` but reads the messages from a NDJSON body.
+
+        Every line of the body holds one message as JSON object, with the
+        fields of the messages of `list_history_response_model` plus
+        `datapoint_id`. The lines are parsed and validated while reading the
+        body and written in batches of `ndjson_batch_size` messages, which
+        allows arbitrarily large uploads with bounded memory. All batches
+        are written in one transaction, i.e. nothing is written if a line
+        is invalid.
         """
+        second_related_object = None
         if self.SecondRelatedModel is not None:
             active_filters_second = self.build_active_filter_dict(
                 second_related_filter_params
@@ -581,39 +1611,168 @@ class GenericDatapointRelatedAPIView(GenericDatapointAPIView):
                 self.SecondRelatedModel, **active_filters_second
             )
 
-        related_data_dict = related_data.dict()["__root__"]
+        message_model, _ = self.get_message_fields(
+            self.list_history_response_model
+        )
+
+        n_created = 0
+        n_updated = 0
+        with transaction.atomic():
+            related_data_dict = {}
+            n_items = 0
+            for line_number, line in enumerate(request, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    item = orjson.loads(line)
+                    datapoint_id = item.pop("datapoint_id")
+                    message = message_model.parse_obj(item)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    raise RequestInducedException(
+                        detail=(
+                            "Line {} is not a valid message with "
+                            "`datapoint_id`.".format(line_number)
+                        )
+                    )
+                dp_id_str = str(datapoint_id)
+                related_data_list = related_data_dict.setdefault(dp_id_str, [])
+                related_data_list.append(message.dict())
+                n_items += 1
+
+                if n_items >= self.ndjson_batch_size:
+                    summary = self.write_history(
+                        related_data_dict=related_data_dict,
+                        second_related_object=second_related_object,
+                    )
+                    n_created += summary[0]
+                    n_updated += summary[1]
+                    related_data_dict = {}
+                    n_items = 0
+
+            if related_data_dict:
+                summary = self.write_history(
+                    related_data_dict=related_data_dict,
+                    second_related_object=second_related_object,
+                )
+                n_created += summary[0]
+                n_updated += summary[1]
+
+        content_pydantic = PutSummary(
+            objects_created=n_created, objects_updated=n_updated,
+        )
+        content = content_pydantic.json()
+
+        return HttpResponse(
+            content, status=200, content_type="application/json"
+        )
+
+    def write_history(self, related_data_dict, second_related_object):
+        """
+        Update or create history items in `RelatedDataHistoryModel`.
+
+        Large payloads are written with `COPY` on PostgreSQL, see
+        `copy_update_history`.
+
+        Arguments:
+        ----------
+        related_data_dict: dict
+            The messages as lists with the datapoint IDs (as str) as keys.
+        second_related_object: django.db.models.Model or None
+            The object of `SecondRelatedModel` the messages belong to.
+
+        Returns:
+        --------
+        summary: tuple
+            The number of created and updated messages.
 
+        Raises:
+        -------
+        RequestInducedException:
+            If datapoints could not be found for one or more IDs
+        """
         # Fetch the datapoint objects belonging to the data.
         datapoints_db_by_id = self.get_datapoints_by_ids(
             datapoint_ids_as_str=related_data_dict.keys()
         )
 
-        # Flatten to prepare for bulk update.
-        # TODO: This is actually stupid, we flatten here and bulk_update
-        # sorts back by datapoint id.
-        related_data_items = []
-        for datapoint_id_str, related_data_list in related_data_dict.items():
-            for related_data_item in related_data_list:
-                related_data_item["datapoint"] = datapoints_db_by_id[
-                    datapoint_id_str
-                ]
-                if self.SecondRelatedModel is not None:
-                    field_name = self.second_related_field_name
-                    related_data_item[field_name] = second_related_object
-                related_data_items.append(related_data_item)
-
-        summary = self.RelatedDataHistoryModel.bulk_update_or_create(
-            self.RelatedDataHistoryModel, related_data_items
-        )
+        n_items = sum(len(items) for items in related_data_dict.values())
+        if ingest.copy_upsert_available(n_items):
+            summary = self.copy_update_history(
+                related_data_dict=related_data_dict,
+                second_related_object=second_related_object,
+            )
+        else:
+            # Flatten to prepare for bulk update.
+            # TODO: This is actually stupid, we flatten here and bulk_update
+            # sorts back by datapoint id.
+            related_data_items = []
+            for dp_id_str, related_data_list in related_data_dict.items():
+                for related_data_item in related_data_list:
+                    related_data_item["datapoint"] = datapoints_db_by_id[
+                        dp_id_str
+                    ]
+                    if self.SecondRelatedModel is not None:
+                        field_name = self.second_related_field_name
+                        related_data_item[field_name] = second_related_object
+                    related_data_items.append(related_data_item)
+
+            summary = self.RelatedDataHistoryModel.bulk_update_or_create(
+                self.RelatedDataHistoryModel, related_data_items
+            )
+        return summary
 
-        # Finally report, the stats
-        content_pydantic = PutSummary(
-            objects_created=summary[0], objects_updated=summary[1],
+    def prepare_history_item(self, related_data_item):
+        """
+        Add the values of fields that are derived from the message fields
+        before writing to `RelatedDataHistoryModel` with `COPY`, i.e.
+        without the model logic. Overload if required.
+        """
+        return related_data_item
+
+    def copy_update_history(self, related_data_dict, second_related_object):
+        """
+        Write history items with `COPY`, see `emp_main.ingest`.
+
+        Arguments:
+        ----------
+        related_data_dict: dict
+            The messages as lists with the datapoint IDs (as str) as keys.
+            The datapoints must exist.
+        second_related_object: django.db.models.Model or None
+            The object of `SecondRelatedModel` the messages belong to.
+
+        Returns:
+        --------
+        summary: tuple
+            The number of created and updated messages.
+        """
+        model = self.RelatedDataHistoryModel
+        columns = [
+            field.attname
+            for field in model._meta.concrete_fields
+            if not field.primary_key
+        ]
+        conflict_columns = self.get_conflict_columns(
+            model, self.unique_together_fields_history
         )
-        content = content_pydantic.json()
 
-        return HttpResponse(
-            content, status=200, content_type="application/json"
+        def iter_rows():
+            for dp_id_str, related_data_list in related_data_dict.items():
+                for related_data_item in related_data_list:
+                    related_data_item["datapoint_id"] = int(dp_id_str)
+                    if second_related_object is not None:
+                        field_name = self.second_related_field_name
+                        related_data_item[field_name + "_id"] = (
+                            second_related_object.pk
+                        )
+                    self.prepare_history_item(related_data_item)
+                    yield [related_data_item.get(c) for c in columns]
+
+        return ingest.copy_upsert(
+            model=model,
+            columns=columns,
+            rows=iter_rows(),
+            conflict_columns=conflict_columns,
         )
 
 
@@ -627,8 +1786,12 @@ class DatapointMetadataAPIView(GenericDatapointAPIView):
     methods for handling calls to /datapoint/metadata/ endpoints.
     """
 
+    change_counters = [metadata_change_counter]
+
     @GenericAPIView._handle_exceptions
-    def list_latest(self, request, datapoint_filter_params={}):
+    def list_latest(
+        self, request, datapoint_filter_params={}, pagination_params=None
+    ):
         """
         Return the latest state of metadata of zero or more datapoints matching
         the requested filter parameters.
@@ -637,27 +1800,46 @@ class DatapointMetadataAPIView(GenericDatapointAPIView):
         ----------
         datapoint_filter_params: instance of `DatapointFilterParams`
             Defines the filters that should be applied to the datapoints.
+        pagination_params: instance of `PaginationParams`
+            Defines which page of the datapoints should be returned.
         Returns:
         --------
         http_response: django.http.HttpResponse
             The requested datapoints as JSON string.
         """
+        # Check first if the client has the latest version already.
+        etag, last_modified = self.get_etag(request)
+        response = self.get_not_modified_response(request, etag, last_modified)
+        if response is not None:
+            return response
+
         # TODO: Add test that list calls this method to fetch filtered
         #       datapoints, and of course that the query params are forewarded.
         datapoints = self.get_filtered_datapoints(datapoint_filter_params)
 
+        # Fetch only the fields of the pydantic model.
+        datapoint_model = DatapointList.__fields__["__root__"].type_
+        datapoints = datapoints.values(*datapoint_model.__fields__)
+
+        datapoints_page, next_cursor = self.get_page(
+            objects=datapoints,
+            key_fields=["id"],
+            pagination_params=pagination_params,
+        )
+
         # Convert to jsonable, skip validation.
         datapoints_as_dict = []
-        for datapoint in datapoints:
-            datapoints_as_dict.append(datapoint.load_to_dict())
-        datapoints_as_pydantic = DatapointList.construct_recursive(
-            __root__=datapoints_as_dict
-        )
-        content = datapoints_as_pydantic.json()
+        for datapoint in datapoints_page:
+            datapoints_as_dict.append(
+                serializers.datapoint_serializer.convert(datapoint)
+            )
+        content = serializers.dumps(datapoints_as_dict)
 
-        return HttpResponse(
+        response = HttpResponse(
             content, status=200, content_type="application/json"
         )
+        response = self.add_etag_headers(response, etag, last_modified)
+        return self.add_next_cursor_header(response, next_cursor)
 
     @GenericAPIView._handle_exceptions
     def update_latest(self, request, datapoints):
@@ -668,29 +1850,59 @@ class DatapointMetadataAPIView(GenericDatapointAPIView):
         the following:
         * If the ID field of a `Datapoint` object is not `null` it is
           assumed that the datapoint with this ID should be updated.
+        * Else if `origin` and `origin_id` are both not `null` the
+          datapoint with these values is updated, or created if it doesn't
+          exist yet.
+        * Else a new datapoint is created.
+
+        Existing datapoints are resolved with two queries and all changes
+        are written in bulk within one transaction, i.e. either all
+        datapoints are updated/created or none.
         """
+        dp_dicts = [datapoint.dict() for datapoint in datapoints.__root__]
+
+        # Resolve all existing datapoints at once, by id and by origin.
+        dp_ids = [d["id"] for d in dp_dicts if d["id"]]
+        datapoints_db_by_id = DatapointDb.objects.in_bulk(dp_ids)
+
+        origin_pairs = [
+            (d["origin"], d["origin_id"])
+            for d in dp_dicts
+            if not d["id"] and d["origin"] and d["origin_id"]
+        ]
+        datapoints_db_by_origin = {}
+        if origin_pairs:
+            # This may fetch a few datapoints too many, e.g. if the same
+            # `origin_id` is used by two origins. These are just not used.
+            candidates = DatapointDb.objects.filter(
+                origin__in={p[0] for p in origin_pairs},
+                origin_id__in={p[1] for p in origin_pairs},
+            )
+            for dp_db in candidates:
+                datapoints_db_by_origin[(dp_db.origin, dp_db.origin_id)] = dp_db
+
         created_datapoints = []
         non_existing_datapoint_ids = []
-        for datapoint in datapoints.__root__:
-            dp_dict = datapoint.dict()
+        update_fields = set()
+        for dp_dict in dp_dicts:
             if dp_dict["id"]:
                 # If `id` is not None assume there is a datapoint that should
                 # be updated.
-                try:
-                    dp_db = DatapointDb.objects.get(id=dp_dict["id"])
-                except DatapointDb.DoesNotExist:
+                dp_db = datapoints_db_by_id.get(dp_dict["id"])
+                if dp_db is None:
                     non_existing_datapoint_ids.append(dp_dict["id"])
                     continue
             elif dp_dict["origin"] and dp_dict["origin_id"]:
                 # If `id` is None but both `origin` and `origin_id` fields
                 # are not None we use these fields to check for an existing
                 # datapoint and create a new one if that doesn't exist.
-                try:
-                    dp_db = DatapointDb.objects.get(
-                        origin=dp_dict["origin"], origin_id=dp_dict["origin_id"]
-                    )
-                except DatapointDb.DoesNotExist:
+                origin_pair = (dp_dict["origin"], dp_dict["origin_id"])
+                dp_db = datapoints_db_by_origin.get(origin_pair)
+                if dp_db is None:
                     dp_db = DatapointDb(**dp_dict)
+                    # Later items with the same origin must update this
+                    # object instead of creating a duplicate.
+                    datapoints_db_by_origin[origin_pair] = dp_db
 
             else:
                 # As a last resort: Create a new datapoint if we have neither
@@ -706,6 +1918,7 @@ class DatapointMetadataAPIView(GenericDatapointAPIView):
                 if field == "id":
                     continue
                 setattr(dp_db, field, value)
+                update_fields.add(field)
 
             created_datapoints.append(dp_db)
 
@@ -718,30 +1931,99 @@ class DatapointMetadataAPIView(GenericDatapointAPIView):
             )
 
         # Now we know all datapoints are all right, save and prepare output.
+        # The same object may occur several times in `created_datapoints`
+        # but must only be written once.
+        unique_datapoints = {id(dp_db): dp_db for dp_db in created_datapoints}
+        datapoints_to_create = []
+        datapoints_to_update = []
+        for dp_db in unique_datapoints.values():
+            if dp_db.pk is None:
+                datapoints_to_create.append(dp_db)
+            else:
+                datapoints_to_update.append(dp_db)
+
+        try:
+            with transaction.atomic():
+                self.create_datapoints(datapoints_to_create)
+                if datapoints_to_update:
+                    DatapointDb.objects.bulk_update(
+                        datapoints_to_update, fields=update_fields
+                    )
+        except IntegrityError as exp:
+            raise RequestInducedException(
+                detail=(
+                    'Exception while writing datapoints to DB: "{}".'
+                    "".format(str(exp))
+                )
+            )
+
         created_datapoints_dict = []
         for dp_db in created_datapoints:
-            dp_db.save()
             created_datapoints_dict.append(dp_db.load_to_dict())
 
         created_datapoints_pydantic = DatapointList.construct_recursive(
             __root__=created_datapoints_dict
         )
 
+        # Invalidate the ETags of all views that depend on the metadata.
+        metadata_change_counter.bump()
+
         # Publish updated datapoints in channel layer.
-        # TODO: Make this parallel
+        dp_json_by_id = {}
         for dp_pydantic in created_datapoints_pydantic.__root__:
-            dp_id = str(dp_pydantic.id)
-            dp_json = dp_pydantic.json()
-            async_to_sync(self.channel_layer.group_send)(
-                "datapoint.metadata.latest." + dp_id,
-                {"type": "datapoint.related", "json": dp_json},
-            )
+            dp_json_by_id[str(dp_pydantic.id)] = dp_pydantic.json()
+        self.publish_on_channel_layer(
+            group_name="datapoint.metadata.latest",
+            json_by_dp_id=dp_json_by_id,
+        )
 
         created_datapoints_json = created_datapoints_pydantic.json()
         return HttpResponse(
             created_datapoints_json, status=200, content_type="application/json"
         )
 
+    def create_datapoints(self, datapoints_to_create):
+        """
+        Create datapoints in bulk and set their primary keys, which are
+        required for the output.
+
+        `bulk_create` sets the primary keys only if the DB can return the
+        inserted rows (e.g. PostgreSQL). Else the datapoints are fetched
+        again by `origin` and `origin_id`, and those without are saved one
+        by one.
+
+        Arguments:
+        ----------
+        datapoints_to_create: list of emp_main.models.Datapoint
+            The unsaved datapoints. Two of these must not have the same
+            `origin` and `origin_id`.
+        """
+        if connection.features.can_return_rows_from_bulk_insert:
+            DatapointDb.objects.bulk_create(datapoints_to_create)
+            return
+
+        datapoints_by_origin = {}
+        for dp_db in datapoints_to_create:
+            if dp_db.origin and dp_db.origin_id:
+                origin_pair = (dp_db.origin, dp_db.origin_id)
+                datapoints_by_origin[origin_pair] = dp_db
+            else:
+                dp_db.save()
+        if not datapoints_by_origin:
+            return
+
+        DatapointDb.objects.bulk_create(datapoints_by_origin.values())
+        created = DatapointDb.objects.filter(
+            origin__in={p[0] for p in datapoints_by_origin},
+            origin_id__in={p[1] for p in datapoints_by_origin},
+        ).values_list("origin", "origin_id", "pk")
+        for origin, origin_id, pk in created:
+            dp_db = datapoints_by_origin.get((origin, origin_id))
+            if dp_db is not None:
+                dp_db.pk = pk
+                dp_db._state.adding = False
+                dp_db._state.db = connection.alias
+
 
 dpm_view = DatapointMetadataAPIView()
 
@@ -753,7 +2035,9 @@ dpm_view = DatapointMetadataAPIView()
     summary=" ",  # Deactivate summary.
 )
 def get_datapoint_metadata_latest(
-    request, datapoint_filter_params: DatapointFilterParams = Query(...),
+    request,
+    datapoint_filter_params: DatapointFilterParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return a queryset of datapoints matching the requested filter
@@ -761,7 +2045,9 @@ def get_datapoint_metadata_latest(
     """
 
     response = dpm_view.list_latest(
-        request=request, datapoint_filter_params=datapoint_filter_params
+        request=request,
+        datapoint_filter_params=datapoint_filter_params,
+        pagination_params=pagination_params,
     )
     return response
 
@@ -809,7 +2095,69 @@ class DatapointValueAPIView(GenericDatapointRelatedAPIView):
     RelatedDataHistoryModel = ValueHistoryDb
     list_latest_response_model = ValueMessageByDatapointId
     list_history_response_model = ValueMessageListByDatapointId
-    channel_group_base_name = "datapoint.value.latest."
+    latest_cache = LatestMessageCache("value")
+    latest_change_counter = ChangeCounter("value")
+    change_counters = [metadata_change_counter, latest_change_counter]
+    row_serializer = serializers.value_message_serializer
+    channel_group_name = "datapoint.value.latest"
+    columnar_history_columns = {"value": ("_value_float", pa.float64())}
+
+    def prepare_history_item(self, related_data_item):
+        """
+        Store the value in the internal fields for numeric and bool values,
+        like the model does on save.
+        """
+        value = related_data_item.get("value")
+        related_data_item["_value_float"] = None
+        related_data_item["_value_bool"] = None
+        if isinstance(value, bool):
+            related_data_item["_value_bool"] = value
+        else:
+            try:
+                related_data_item["_value_float"] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return related_data_item
+
+    def write_latest(
+        self,
+        related_data_dict,
+        second_related_object,
+        datapoints_db_by_id=None,
+        write_history=True,
+    ):
+        """
+        Like the parent method but also refreshes the rollups if values
+        older than the refresh window of these have been written to the
+        history, see `rollups.refresh_after_commit`.
+        """
+        result = super().write_latest(
+            related_data_dict=related_data_dict,
+            second_related_object=second_related_object,
+            datapoints_db_by_id=datapoints_db_by_id,
+            write_history=write_history,
+        )
+        if write_history:
+            rollups.refresh_after_commit(
+                item["time"] for item in related_data_dict.values()
+            )
+        return result
+
+    def write_history(self, related_data_dict, second_related_object):
+        """
+        Like the parent method but also refreshes the rollups, see
+        `write_latest`.
+        """
+        summary = super().write_history(
+            related_data_dict=related_data_dict,
+            second_related_object=second_related_object,
+        )
+        rollups.refresh_after_commit(
+            item["time"]
+            for related_data_list in related_data_dict.values()
+            for item in related_data_list
+        )
+        return summary
 
     @GenericAPIView._handle_exceptions
     def list_history_at_interval(
@@ -823,15 +2171,13 @@ class DatapointValueAPIView(GenericDatapointRelatedAPIView):
         """
         Returns datapoint values at specified interval.
 
-        Note: This is not covered in any test yet.
-        TODO: Add a test!
+        The values are aggregated by the DB and streamed as `ValueDataFrame`
+        one datapoint after the other. The aggregates are computed from the
+        coarsest rollup that yields the same result as the raw values (see
+        `emp_main.rollups`), and from the raw values if there is none.
         """
         datapoints = self.get_filtered_datapoints(datapoint_filter_params)
 
-        related_objects = self.RelatedDataHistoryModel.timescale.filter(
-            datapoint__in=datapoints
-        )
-
         # Filter by query parameters.
         active_filters = self.build_active_filter_dict(related_filter_params)
         if self.SecondRelatedModel is not None:
@@ -840,88 +2186,131 @@ class DatapointValueAPIView(GenericDatapointRelatedAPIView):
                 second_related_filter_params
             )
             active_filters.update(active_filters_second)
-        related_objects = related_objects.filter(**active_filters)
 
-        # Aggregate by interval.
-        related_objects = related_objects.time_bucket(
-            "time", time_bucket_params.interval
+        rollup = rollups.get_rollup(
+            interval=time_bucket_params.interval,
+            aggregation=time_bucket_params.aggregation,
+            active_filters=active_filters,
         )
-        aggregation_func = getattr(models, time_bucket_params.aggregation)
-        related_objects = related_objects.annotate(
-            value=aggregation_func("_value_float"),
-            datapoint_id=models.F("datapoint__id"),
-        )
-        # Late first, newest item last in list. This should not cost anything
-        # extra as the timescaledb django plugin orders too, but just the other
-        # way around.
-        related_objects = related_objects.order_by("bucket")
-
-        # Shortcut for an empty queryset, as `from_records` below will
-        # fail for an empty QS.
-        if not related_objects:
-            return HttpResponse(
-                content=ValueDataFrame(values={}, times=[]).json(),
-                status=200,
-                content_type="application/json",
+        if rollup is not None:
+            related_objects = rollups.get_rollup_queryset(
+                rollup=rollup,
+                datapoints=datapoints,
+                interval=time_bucket_params.interval,
+                filters=active_filters,
             )
+            bucket_name = rollups.ROLLUP_BUCKET_NAME
+        else:
+            related_objects = self.RelatedDataHistoryModel.timescale.filter(
+                datapoint__in=datapoints
+            )
+            related_objects = related_objects.filter(**active_filters)
 
-        """
-        At this point related_objects is a TimescaleQuerySet type.
-        The elements are dicts that look like this:
-        {
-            'bucket': datetime.datetime(2022, 5, 17, 8, 55, tzinfo=<UTC>),
-            'value': 23.275,
-            'datapoint_id': 1
-        }
-
-        In order to retrieve the desired DataFrame style output we would need
-        to group by `datapoint_id` and `bucket` fields and fill any possibly
-        empty values. This might become very complex and to keep it simple
-        we let pandas to the work.
-        """
-        # Parse to DataFrame,
-        related_objects_as_df = pd.DataFrame.from_records(
-            related_objects, index="bucket"
-        )
-        """
-        `related_objects_as_df` looks like this:
-                                       value  datapoint_id
-        bucket
-        2022-05-17 08:30:00+00:00  23.328571             2
-        2022-05-17 08:30:00+00:00  23.328571             1
-        2022-05-17 08:35:00+00:00  23.507143             2
-        2022-05-17 08:35:00+00:00  23.507143             1
-        """
-        related_objects_as_df = related_objects_as_df.pivot(
-            columns="datapoint_id", values="value"
-        )
-        # This is important! `ValueDataFrame` expects a string
-        # as column and `dataframe_from_value_dataframe` doesn't
-        # check if it is a string or not.
-        related_objects_as_df.columns = related_objects_as_df.columns.astype(
-            str
-        )
-        """
-        And now organized by datapoint id:
-        datapoint_id                       1          2
-        bucket
-        2022-05-17 08:30:00+00:00  23.328571  23.328571
-        2022-05-17 08:35:00+00:00  23.507143  23.507143
-        2022-05-17 08:40:00+00:00  23.455000  23.455000
-        """
+            # Aggregate by interval.
+            related_objects = related_objects.time_bucket(
+                "time", time_bucket_params.interval
+            )
+            bucket_name = "bucket"
 
-        # Convert to json, skips validation.
-        related_objects_as_pydantic = value_dataframe_from_dataframe(
-            pandas_dataframe=related_objects_as_df
+        if rollup is not None:
+            related_objects = rollups.annotate_rollup_value(
+                related_objects, time_bucket_params.aggregation
+            )
+        else:
+            aggregation_func = getattr(models, time_bucket_params.aggregation)
+            related_objects = related_objects.annotate(
+                value=aggregation_func("_value_float"),
+                datapoint_id=models.F("datapoint__id"),
+            )
+        # The position of the bucket in the `times` of the `ValueDataFrame`,
+        # i.e. among all buckets that contain at least one value. A bucket
+        # ranked r of N ascending is ranked N + 1 - r descending, which
+        # yields the length of the columns with the first row already.
+        related_objects = related_objects.annotate(
+            bucket_rank=models.Window(
+                expression=DenseRank(),
+                order_by=models.F(bucket_name).asc(),
+            ),
+            bucket_rank_desc=models.Window(
+                expression=DenseRank(),
+                order_by=models.F(bucket_name).desc(),
+            ),
         )
-        related_objects_as_json = related_objects_as_pydantic.json()
+        # One row per datapoint and bucket, i.e. one column of the
+        # `ValueDataFrame` after the other, oldest bucket first.
+        related_objects = related_objects.order_by("datapoint_id", bucket_name)
 
-        return HttpResponse(
-            content=related_objects_as_json,
+        return StreamingHttpResponse(
+            streaming_content=self._iter_value_dataframe_json(
+                related_objects=related_objects, bucket_name=bucket_name
+            ),
             status=200,
             content_type="application/json",
         )
 
+    def _iter_value_dataframe_json(self, related_objects, bucket_name):
+        """
+        Yield the JSON representation of a `ValueDataFrame` column by column.
+
+        Buckets without value for a datapoint are returned as null, like
+        the missing values of a pivoted DataFrame. Only one column and the
+        `times` are held in memory at any time. The `times` are collected
+        from the rows while streaming, as they are sent last.
+
+        Arguments:
+        ----------
+        related_objects: django.db.models.QuerySet
+            The aggregated values as dicts with the bucket, `value`,
+            `datapoint_id`, and the ranks of the bucket among all buckets
+            as `bucket_rank` and `bucket_rank_desc`. Must be ordered by
+            datapoint and bucket.
+        bucket_name: str
+            The key of the bucket in the dicts, i.e. `bucket` for the raw
+            values and `rollups.ROLLUP_BUCKET_NAME` for the rollups.
+
+        Yields:
+        -------
+        json_chunk: bytes
+            A part of the JSON document.
+        """
+        yield b'{"values":{'
+        current_dp_id = None
+        column = None
+        times = []
+        try:
+            related_objects_iter = related_objects.iterator(
+                chunk_size=self.stream_chunk_size
+            )
+            for related_object in related_objects_iter:
+                if current_dp_id is None:
+                    n_buckets = (
+                        related_object["bucket_rank"]
+                        + related_object["bucket_rank_desc"]
+                        - 1
+                    )
+                    times = [None] * n_buckets
+
+                dp_id = str(related_object["datapoint_id"])
+                if dp_id != current_dp_id:
+                    if current_dp_id is not None:
+                        yield serializers.dumps(column) + b","
+                    yield serializers.dumps(dp_id) + b":"
+                    current_dp_id = dp_id
+                    column = [None] * len(times)
+
+                i = related_object["bucket_rank"] - 1
+                times[i] = related_object[bucket_name]
+                column[i] = related_object["value"]
+        except Exception:
+            # The status code has already been sent at this point, the best
+            # we can do is to stop and leave the client with a broken JSON.
+            logger.exception("Caught exception while streaming values.")
+            raise
+
+        if current_dp_id is not None:
+            yield serializers.dumps(column)
+        yield b'},"times":' + serializers.dumps(times) + b"}"
+
 
 dp_value_view = DatapointValueAPIView()
 
@@ -936,6 +2325,7 @@ def get_datapoint_value_latest(
     request,
     datapoint_filter_params: DatapointFilterParams = Query(...),
     value_filter_params: ValueMessageFilterParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return the latest values for datapoints targeted by the filter.
@@ -945,6 +2335,7 @@ def get_datapoint_value_latest(
         request=request,
         datapoint_filter_params=datapoint_filter_params,
         related_filter_params=value_filter_params,
+        pagination_params=pagination_params,
     )
     return response
 
@@ -963,6 +2354,8 @@ def get_datapoint_value_history(
     request,
     datapoint_filter_params: DatapointFilterParams = Query(...),
     value_filter_params: ValueMessageFilterParams = Query(...),
+    streaming_params: StreamingParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return one or more value messages for datapoints targeted by the filter.
@@ -972,6 +2365,34 @@ def get_datapoint_value_history(
         request=request,
         datapoint_filter_params=datapoint_filter_params,
         related_filter_params=value_filter_params,
+        stream=streaming_params.stream,
+        pagination_params=pagination_params,
+    )
+    return response
+
+
+@api.get(
+    "/datapoint/value/history/columnar/",
+    response={400: HTTPError, 500: HTTPError},
+    tags=["Datapoint Value"],
+    summary=" ",  # Deactivate summary.
+)
+def get_datapoint_value_history_columnar(
+    request,
+    datapoint_filter_params: DatapointFilterParams = Query(...),
+    value_filter_params: ValueMessageFilterParams = Query(...),
+    columnar_params: ColumnarParams = Query(...),
+):
+    """
+    Return value messages for datapoints targeted by the filter as columnar
+    data, i.e. as Apache Arrow IPC stream or as Parquet file.
+    """
+
+    response = dp_value_view.list_history_columnar(
+        request=request,
+        datapoint_filter_params=datapoint_filter_params,
+        related_filter_params=value_filter_params,
+        columnar_params=columnar_params,
     )
     return response
 
@@ -1040,6 +2461,25 @@ def put_datapoint_value_history(
     return response
 
 
+@api.put(
+    "/datapoint/value/history/ndjson/",
+    response={200: PutSummary, 400: HTTPError, 500: HTTPError},
+    tags=["Datapoint Value"],
+    summary=" ",  # Deactivate summary.
+)
+def put_datapoint_value_history_ndjson(request):
+    """
+    Like `PUT /datapoint/value/history/` but for large uploads. The body
+    (content type `application/x-ndjson`) holds one value message per line
+    as JSON object with an additional `datapoint_id` field, e.g.:
+    `{"datapoint_id": 1, "time": "2022-01-01T00:00:00Z", ...}`. The messages
+    are validated and written in batches while the body is read.
+    """
+
+    response = dp_value_view.update_history_ndjson(request=request)
+    return response
+
+
 ##############################################################################
 # Datapoint Schedule Messages -> /datapoint/schedule/*
 ##############################################################################
@@ -1050,7 +2490,12 @@ class DatapointScheduleAPIView(GenericDatapointRelatedAPIView):
     RelatedDataHistoryModel = ScheduleHistoryDb
     list_latest_response_model = ScheduleMessageByDatapointId
     list_history_response_model = ScheduleMessageListByDatapointId
-    channel_group_base_name = "datapoint.schedule.latest."
+    latest_cache = LatestMessageCache("schedule")
+    latest_change_counter = ChangeCounter("schedule")
+    change_counters = [metadata_change_counter, latest_change_counter]
+    row_serializer = serializers.schedule_message_serializer
+    channel_group_name = "datapoint.schedule.latest"
+    columnar_history_columns = {"schedule": ("schedule", pa.string())}
 
 
 dp_schedule_view = DatapointScheduleAPIView()
@@ -1070,6 +2515,7 @@ def get_datapoint_schedule_latest(
     request,
     datapoint_filter_params: DatapointFilterParams = Query(...),
     schedule_filter_params: ScheduleMessageFilterParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return the latest schedules for datapoints targeted by the filter.
@@ -1079,6 +2525,7 @@ def get_datapoint_schedule_latest(
         request=request,
         datapoint_filter_params=datapoint_filter_params,
         related_filter_params=schedule_filter_params,
+        pagination_params=pagination_params,
     )
     return response
 
@@ -1097,6 +2544,8 @@ def get_datapoint_schedule_history(
     request,
     datapoint_filter_params: DatapointFilterParams = Query(...),
     schedule_filter_params: ScheduleMessageFilterParams = Query(...),
+    streaming_params: StreamingParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return one or more schedule messages for datapoints targeted by the filter.
@@ -1106,6 +2555,34 @@ def get_datapoint_schedule_history(
         request=request,
         datapoint_filter_params=datapoint_filter_params,
         related_filter_params=schedule_filter_params,
+        stream=streaming_params.stream,
+        pagination_params=pagination_params,
+    )
+    return response
+
+
+@api.get(
+    "/datapoint/schedule/history/columnar/",
+    response={400: HTTPError, 500: HTTPError},
+    tags=["Datapoint Schedule"],
+    summary=" ",  # Deactivate summary.
+)
+def get_datapoint_schedule_history_columnar(
+    request,
+    datapoint_filter_params: DatapointFilterParams = Query(...),
+    schedule_filter_params: ScheduleMessageFilterParams = Query(...),
+    columnar_params: ColumnarParams = Query(...),
+):
+    """
+    Return schedule messages for datapoints targeted by the filter as columnar
+    data, i.e. as Apache Arrow IPC stream or as Parquet file.
+    """
+
+    response = dp_schedule_view.list_history_columnar(
+        request=request,
+        datapoint_filter_params=datapoint_filter_params,
+        related_filter_params=schedule_filter_params,
+        columnar_params=columnar_params,
     )
     return response
 
@@ -1149,6 +2626,25 @@ def put_datapoint_schedule_history(
     return response
 
 
+@api.put(
+    "/datapoint/schedule/history/ndjson/",
+    response={200: PutSummary, 400: HTTPError, 500: HTTPError},
+    tags=["Datapoint Schedule"],
+    summary=" ",  # Deactivate summary.
+)
+def put_datapoint_schedule_history_ndjson(request):
+    """
+    Like `PUT /datapoint/schedule/history/` but for large uploads. The body
+    (content type `application/x-ndjson`) holds one schedule message per line
+    as JSON object with an additional `datapoint_id` field, e.g.:
+    `{"datapoint_id": 1, "time": "2022-01-01T00:00:00Z", ...}`. The messages
+    are validated and written in batches while the body is read.
+    """
+
+    response = dp_schedule_view.update_history_ndjson(request=request)
+    return response
+
+
 ##############################################################################
 # Datapoint Setpoint Messages -> /datapoint/setpoint/*
 ##############################################################################
@@ -1159,7 +2655,12 @@ class DatapointSetpointAPIView(GenericDatapointRelatedAPIView):
     RelatedDataHistoryModel = SetpointHistoryDb
     list_latest_response_model = SetpointMessageByDatapointId
     list_history_response_model = SetpointMessageListByDatapointId
-    channel_group_base_name = "datapoint.setpoint.latest."
+    latest_cache = LatestMessageCache("setpoint")
+    latest_change_counter = ChangeCounter("setpoint")
+    change_counters = [metadata_change_counter, latest_change_counter]
+    row_serializer = serializers.setpoint_message_serializer
+    channel_group_name = "datapoint.setpoint.latest"
+    columnar_history_columns = {"setpoint": ("setpoint", pa.string())}
 
 
 dp_setpoint_view = DatapointSetpointAPIView()
@@ -1179,6 +2680,7 @@ def get_datapoint_setpoint_latest(
     request,
     datapoint_filter_params: DatapointFilterParams = Query(...),
     setpoint_filter_params: SetpointFilterParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return the latest setpoints for datapoints targeted by the filter.
@@ -1188,6 +2690,7 @@ def get_datapoint_setpoint_latest(
         request=request,
         datapoint_filter_params=datapoint_filter_params,
         related_filter_params=setpoint_filter_params,
+        pagination_params=pagination_params,
     )
     return response
 
@@ -1206,6 +2709,8 @@ def get_datapoint_setpoint_history(
     request,
     datapoint_filter_params: DatapointFilterParams = Query(...),
     setpoint_filter_params: SetpointFilterParams = Query(...),
+    streaming_params: StreamingParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return one or more setpoint messages for datapoints targeted by the filter.
@@ -1215,6 +2720,34 @@ def get_datapoint_setpoint_history(
         request=request,
         datapoint_filter_params=datapoint_filter_params,
         related_filter_params=setpoint_filter_params,
+        stream=streaming_params.stream,
+        pagination_params=pagination_params,
+    )
+    return response
+
+
+@api.get(
+    "/datapoint/setpoint/history/columnar/",
+    response={400: HTTPError, 500: HTTPError},
+    tags=["Datapoint Setpoint"],
+    summary=" ",  # Deactivate summary.
+)
+def get_datapoint_setpoint_history_columnar(
+    request,
+    datapoint_filter_params: DatapointFilterParams = Query(...),
+    setpoint_filter_params: SetpointFilterParams = Query(...),
+    columnar_params: ColumnarParams = Query(...),
+):
+    """
+    Return setpoint messages for datapoints targeted by the filter as columnar
+    data, i.e. as Apache Arrow IPC stream or as Parquet file.
+    """
+
+    response = dp_setpoint_view.list_history_columnar(
+        request=request,
+        datapoint_filter_params=datapoint_filter_params,
+        related_filter_params=setpoint_filter_params,
+        columnar_params=columnar_params,
     )
     return response
 
@@ -1258,6 +2791,25 @@ def put_datapoint_setpoint_history(
     return response
 
 
+@api.put(
+    "/datapoint/setpoint/history/ndjson/",
+    response={200: PutSummary, 400: HTTPError, 500: HTTPError},
+    tags=["Datapoint Setpoint"],
+    summary=" ",  # Deactivate summary.
+)
+def put_datapoint_setpoint_history_ndjson(request):
+    """
+    Like `PUT /datapoint/setpoint/history/` but for large uploads. The body
+    (content type `application/x-ndjson`) holds one setpoint message per line
+    as JSON object with an additional `datapoint_id` field, e.g.:
+    `{"datapoint_id": 1, "time": "2022-01-01T00:00:00Z", ...}`. The messages
+    are validated and written in batches while the body is read.
+    """
+
+    response = dp_setpoint_view.update_history_ndjson(request=request)
+    return response
+
+
 ##############################################################################
 # Datapoint Forecast Messages -> /datapoint/forecasts/*
 ##############################################################################
@@ -1276,8 +2828,24 @@ class DatapointForecastAPIView(GenericDatapointRelatedAPIView):
 
     RelatedDataHistoryModel = ForecastMessageDb
     list_history_response_model = ForecastMessageListByDatapointId
+    row_serializer = serializers.forecast_message_serializer
     SecondRelatedModel = ProductRunDb
     second_related_field_name = "product_run"
+    unique_together_fields_history = ["datapoint", "time", "product_run"]
+    columnar_history_columns = {
+        field_name: (field_name, pa.float64())
+        for field_name in [
+            "mean",
+            "std",
+            "p05",
+            "p10",
+            "p25",
+            "p50",
+            "p75",
+            "p90",
+            "p95",
+        ]
+    }
 
     class ForecastFilterParams(Schema):
         time__gte: datetime = Field(
@@ -1316,6 +2884,8 @@ def get_datapoint_forecast_latest(
     product_run_filter_params: dp_forecast_view.PathParams = Path(...),
     datapoint_filter_params: DatapointFilterParams = Query(...),
     forecast_filter_params: dp_forecast_view.ForecastFilterParams = Query(...),
+    streaming_params: StreamingParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return the latest setpoints for datapoints targeted by the filter.
@@ -1326,6 +2896,36 @@ def get_datapoint_forecast_latest(
         datapoint_filter_params=datapoint_filter_params,
         related_filter_params=forecast_filter_params,
         second_related_filter_params=product_run_filter_params,
+        stream=streaming_params.stream,
+        pagination_params=pagination_params,
+    )
+    return response
+
+
+@api.get(
+    "/datapoint/forecast/latest/{id}/columnar/",
+    response={400: HTTPError, 404: HTTPError, 500: HTTPError},
+    tags=["Datapoint Forecast"],
+    summary=" ",  # Deactivate summary.
+)
+def get_datapoint_forecast_latest_columnar(
+    request,
+    product_run_filter_params: dp_forecast_view.PathParams = Path(...),
+    datapoint_filter_params: DatapointFilterParams = Query(...),
+    forecast_filter_params: dp_forecast_view.ForecastFilterParams = Query(...),
+    columnar_params: ColumnarParams = Query(...),
+):
+    """
+    Return the forecasts for datapoints targeted by the filter as columnar
+    data, i.e. as Apache Arrow IPC stream or as Parquet file.
+    """
+
+    response = dp_forecast_view.list_history_columnar(
+        request=request,
+        datapoint_filter_params=datapoint_filter_params,
+        related_filter_params=forecast_filter_params,
+        columnar_params=columnar_params,
+        second_related_filter_params=product_run_filter_params,
     )
     return response
 
@@ -1353,6 +2953,29 @@ def put_datapoint_forecast_latest(
     return response
 
 
+@api.put(
+    "/datapoint/forecast/latest/{id}/ndjson/",
+    response={200: PutSummary, 400: HTTPError, 404: HTTPError, 500: HTTPError},
+    tags=["Datapoint Forecast"],
+    summary=" ",  # Deactivate summary.
+)
+def put_datapoint_forecast_latest_ndjson(
+    request, product_run_filter_params: dp_forecast_view.PathParams = Path(...),
+):
+    """
+    Like `PUT /datapoint/forecast/latest/{id}/` but for large uploads. The
+    body (content type `application/x-ndjson`) holds one forecast message
+    per line as JSON object with an additional `datapoint_id` field. The
+    messages are validated and written in batches while the body is read.
+    """
+
+    response = dp_forecast_view.update_history_ndjson(
+        request=request,
+        second_related_filter_params=product_run_filter_params,
+    )
+    return response
+
+
 ##############################################################################
 # Product Messages -> /product/*
 ##############################################################################
@@ -1373,7 +2996,9 @@ product_view = ProductAPIView()
     summary=" ",  # Deactivate summary.
 )
 def get_product_latest(
-    request, filter_params: ProductFilterParams = Query(...),
+    request,
+    filter_params: ProductFilterParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return the latest state of the `Product` objects.
@@ -1383,7 +3008,9 @@ def get_product_latest(
     """
 
     response = product_view.list_latest(
-        request=request, filter_params=filter_params
+        request=request,
+        filter_params=filter_params,
+        pagination_params=pagination_params,
     )
     return response
 
@@ -1428,7 +3055,9 @@ product_run_view = ProductRunAPIView()
     summary=" ",  # Deactivate summary.
 )
 def get_product_run_latest(
-    request, filter_params: ProductRunFilterParams = Query(...),
+    request,
+    filter_params: ProductRunFilterParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return the latest state of the `Product` objects.
@@ -1438,7 +3067,9 @@ def get_product_run_latest(
     """
 
     response = product_run_view.list_latest(
-        request=request, filter_params=filter_params
+        request=request,
+        filter_params=filter_params,
+        pagination_params=pagination_params,
     )
     return response
 
@@ -1483,7 +3114,9 @@ plant_view = PlantAPIView()
     summary=" ",  # Deactivate summary.
 )
 def get_plant_latest(
-    request, filter_params: PlantFilterParams = Query(...),
+    request,
+    filter_params: PlantFilterParams = Query(...),
+    pagination_params: PaginationParams = Query(...),
 ):
     """
     Return the latest state of the Plant objects.
@@ -1493,7 +3126,9 @@ def get_plant_latest(
     """
 
     response = plant_view.list_latest(
-        request=request, filter_params=filter_params
+        request=request,
+        filter_params=filter_params,
+        pagination_params=pagination_params,
     )
     return response
 
@@ -1,12 +1,17 @@
 import logging
 from collections import OrderedDict
 from importlib import import_module
+import threading
 
 from django.contrib import auth
 from django.conf import settings
 from django.apps import AppConfig
+from django.core.cache import cache
+from django.db import connections
 from django.utils.text import slugify
 
+from .caches import ChangeCounter
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,6 +23,8 @@ class EmpMainConfig(AppConfig):
 
         import emp_main.signals
 
+        emp_main.signals.connect_invalidate_apps_cache_on_change()
+
 
 class EmpAppsCache:
     """
@@ -27,8 +34,17 @@ class EmpAppsCache:
     datapoints the respective user has permissions for. Computing these values
     is potentially expensive as it may result in multiple dynamic imports and
     database lookups. Hence we update these values only when triggered.
+
+    The computed objects are stored in Django's cache framework (see the
+    `CACHES` setting), i.e. all worker processes share them. The entries are
+    keyed by user ID and a permission version. The version is incremented
+    by `invalidate`, which `emp_main.signals` calls whenever permissions or
+    pages change, and thereby invalidates the entries of all users at once.
     """
 
+    key_prefix = "emp.apps."
+    update_batch_size = 500
+
     def __new__(cls, *args, **kwargs):
         """
         Ensure singleton, i.e. only one instance is created.
@@ -65,14 +81,47 @@ class EmpAppsCache:
         """
         logger.info("Starting EMPAppsCache.")
 
-        # These store the user specific objects. apps_nav_content stores the
-        # data required to populate the user specific nav bar. allowed_urls is
-        # used to check whether the user has the right to open a page.
-        # allowed_datapoint_ids is used to check whether the user is allowed to
-        # receive the values of a specific datapoint.
-        self.apps_nav_content = {}
-        self.allowed_urls = {}
-        self.allowed_datapoint_ids = {}
+        # The version is shared by all workers too. It restarts with a new
+        # value if it expires, which also expires all entries.
+        self.permission_version = ChangeCounter(
+            "permissions", timeout_setting="APPS_CACHE_TIMEOUT"
+        )
+
+        # The `apps` modules of the EMP apps, imported on first use.
+        self.app_modules = None
+
+        # Held while the objects of all users are updated in background.
+        self.update_all_lock = threading.Lock()
+
+    def get_app_modules(self):
+        """
+        Returns the `apps` modules of all EMP apps, which define the hooks
+        to compute the user specific objects.
+
+        Returns
+        -------
+        list
+            of (emp_app, app_config) tuples, in the order of `EMP_APPS`.
+        """
+        if self.app_modules is None:
+            self.app_modules = [
+                (emp_app, import_module(emp_app + ".apps"))
+                for emp_app in settings.EMP_APPS
+            ]
+        return self.app_modules
+
+    def get_cache_key(self, user, version):
+        """
+        Return the key of the entry of the user for a permission version.
+        """
+        return "{}{}.{}".format(self.key_prefix, version, user.pk)
+
+    def invalidate(self):
+        """
+        Invalidate the entries of all users, e.g. after permissions changed.
+        """
+        logger.debug("Invalidating EMPAppsCache.")
+        self.permission_version.bump()
 
     def update_for_user(self, user=None):
         """
@@ -82,34 +131,81 @@ class EmpAppsCache:
         ----------
         user : django.contrib.auth.model.User, optional
             The user for which the updates will be computed. Will compute
-            for all users if None.
+            for all users in background if None, see
+            `start_update_for_all_users`.
 
         Returns
         -------
-        None.
+        user_objects : dict or None
+            The computed objects stored in the cache, as
+            {"apps_nav_content": ..., "allowed_urls": ...,
+            "allowed_datapoint_ids": ...}. None if computed for all users.
         """
         # Update for all known users if no user is specfied.
         if user is None:
-            user_model = auth.get_user_model()
-            users = list(user_model.objects.all())
-            for user in users:
-                self.update_for_user(user)
+            self.start_update_for_all_users()
             return
 
-        # Erase all previous user specific objects.
-        self.apps_nav_content[user] = OrderedDict()
-        self.allowed_urls[user] = set()
-        self.allowed_datapoint_ids[user] = set()
+        return self.update_for_users([user])[user.pk]
+
+    def update_for_users(self, users):
+        """
+        Update all user specifc objects per EMP app for several users.
+
+        Apps may define `get_app_nav_content_for_users` and
+        `get_permitted_datapoint_ids_for_users`, which compute the objects
+        for all users with a few grouped queries. The variants for single
+        users are called once per user for apps that don't.
+
+        Parameters
+        ----------
+        users : list of django.contrib.auth.model.User
+            The users for which the updates will be computed.
+
+        Returns
+        -------
+        objects_by_user_pk : dict
+            The computed objects (see `update_for_user`) with the primary
+            keys of the users as keys.
+        """
+        # Fetch the version before computing. If the permissions change
+        # while we compute, the result is stored for the outdated version
+        # and is hence never used.
+        version, _ = self.permission_version.get()
+
+        # These store the user specific objects. apps_nav_content stores the
+        # data required to populate the user specific nav bar. allowed_urls is
+        # used to check whether the user has the right to open a page.
+        # allowed_datapoint_ids is used to check whether the user is allowed to
+        # receive the values of a specific datapoint.
+        objects_by_user_pk = {}
+        for user in users:
+            objects_by_user_pk[user.pk] = {
+                "apps_nav_content": OrderedDict(),
+                "allowed_urls": set(),
+                "allowed_datapoint_ids": set(),
+            }
 
         # Iterate over all UI apps of the EMP to compute all required data.
-        for emp_app in settings.EMP_APPS:
-            app_config = import_module(emp_app + ".apps")
+        for emp_app, app_config in self.get_app_modules():
 
             # Some apps may have no pages and thus no nav_content, skip these.
-            if hasattr(app_config, "get_app_nav_content_for_user"):
-                # Compute the nav group name, pages and urls for this user.
-                # Extend with an id that is used for collapsing the subnav.
-                app_nav_content = app_config.get_app_nav_content_for_user(user)
+            # Compute the nav group name, pages and urls for the users.
+            if hasattr(app_config, "get_app_nav_content_for_users"):
+                nav_content_by_user_pk = (
+                    app_config.get_app_nav_content_for_users(users)
+                )
+            elif hasattr(app_config, "get_app_nav_content_for_user"):
+                nav_content_by_user_pk = {
+                    user.pk: app_config.get_app_nav_content_for_user(user)
+                    for user in users
+                }
+            else:
+                nav_content_by_user_pk = {}
+
+            # Extend with an id that is used for collapsing the subnav.
+            for user_pk, app_nav_content in nav_content_by_user_pk.items():
+                user_objects = objects_by_user_pk[user_pk]
                 for app_nav_name, app_nav_pages in app_nav_content.items():
                     # Add the emp_app string to ensure the id is unique.
                     app_nav_id = slugify(emp_app + app_nav_name)
@@ -117,17 +213,115 @@ class EmpAppsCache:
                         "app_nav_id": app_nav_id,
                         "app_nav_pages": app_nav_pages,
                     }
-                    self.apps_nav_content[user][app_nav_name] = user_app_nav
+                    user_objects["apps_nav_content"][app_nav_name] = (
+                        user_app_nav
+                    )
 
                     # Also store all allowed urls for this user, by assuming
                     # he/she is only permitted to access those urls that are
                     # part of the navbar.
-                    self.allowed_urls[user].update(app_nav_pages.values())
+                    user_objects["allowed_urls"].update(app_nav_pages.values())
 
             # Similar to above, now collect the permitted datapoint ids.
-            if hasattr(app_config, "get_permitted_datapoint_ids_for_user"):
-                dp_ids = app_config.get_permitted_datapoint_ids_for_user(user)
-                self.allowed_datapoint_ids[user].update(dp_ids)
+            if hasattr(app_config, "get_permitted_datapoint_ids_for_users"):
+                dp_ids_by_user_pk = (
+                    app_config.get_permitted_datapoint_ids_for_users(users)
+                )
+            elif hasattr(app_config, "get_permitted_datapoint_ids_for_user"):
+                dp_ids_by_user_pk = {
+                    user.pk: app_config.get_permitted_datapoint_ids_for_user(
+                        user
+                    )
+                    for user in users
+                }
+            else:
+                dp_ids_by_user_pk = {}
+
+            for user_pk, dp_ids in dp_ids_by_user_pk.items():
+                user_objects = objects_by_user_pk[user_pk]
+                user_objects["allowed_datapoint_ids"].update(dp_ids)
+
+        objects_by_key = {}
+        for user in users:
+            key = self.get_cache_key(user, version)
+            objects_by_key[key] = objects_by_user_pk[user.pk]
+        cache.set_many(objects_by_key, timeout=settings.APPS_CACHE_TIMEOUT)
+        return objects_by_user_pk
+
+    def update_for_all_users(self):
+        """
+        Update all user specifc objects for all users.
+
+        The users are processed in batches of `update_batch_size`, each batch
+        is stored in the cache once it is computed. Hence the cache is filled
+        incrementally and memory usage is bounded.
+        """
+        user_model = auth.get_user_model()
+        users_all = user_model.objects.order_by("pk")
+
+        last_user_pk = None
+        while True:
+            users = users_all
+            if last_user_pk is not None:
+                users = users.filter(pk__gt=last_user_pk)
+            users = list(users[: self.update_batch_size])
+            if not users:
+                break
+            self.update_for_users(users)
+            last_user_pk = users[-1].pk
+
+    def start_update_for_all_users(self):
+        """
+        Run `update_for_all_users` in a background thread, i.e. without
+        blocking the request that triggered the update.
+
+        Returns
+        -------
+        thread : threading.Thread or None
+            The thread running the update. None if an update is running
+            already, a second one would yield the same result.
+        """
+        if not self.update_all_lock.acquire(blocking=False):
+            logger.debug("EMPAppsCache is updating all users already.")
+            return None
+
+        thread = threading.Thread(
+            target=self._update_for_all_users_in_thread, daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _update_for_all_users_in_thread(self):
+        try:
+            self.update_for_all_users()
+        except Exception:
+            logger.exception("Updating EMPAppsCache for all users failed.")
+        finally:
+            # Django opens one DB connection per thread.
+            connections.close_all()
+            self.update_all_lock.release()
+
+    def get_objects_for_user(self, user):
+        """
+        Returns all cached objects for this user.
+
+        Will take it from cache or trigger recomputation if not in cache.
+
+        Parameters
+        ----------
+        user : django.contrib.auth.model.User
+            The user for which the objects should be returned.
+
+        Returns
+        -------
+        user_objects : dict
+            See `update_for_user`.
+        """
+        version, _ = self.permission_version.get()
+        user_objects = cache.get(self.get_cache_key(user, version))
+        if user_objects is None:
+            user_objects = self.update_for_user(user)
+        return user_objects
 
     def get_apps_nav_content_for_user(self, user):
         """
@@ -153,9 +347,7 @@ class EmpAppsCache:
                     }
                 }}
         """
-        if not user in self.apps_nav_content:
-            self.update_for_user(user)
-        return self.apps_nav_content[user]
+        return self.get_objects_for_user(user)["apps_nav_content"]
 
     def get_allowed_urls_for_user(self, user):
         """
@@ -175,9 +367,7 @@ class EmpAppsCache:
             Of all urls (relative parts only) the user has permissions to
             access.
         """
-        if not user in self.allowed_urls:
-            self.update_for_user(user)
-        return self.allowed_urls[user]
+        return self.get_objects_for_user(user)["allowed_urls"]
 
     def get_allowed_datapoint_ids_for_user(self, user):
         """
@@ -196,6 +386,4 @@ class EmpAppsCache:
         Set
             Of all Datapoints the user has permissions to access.
         """
-        if not user in self.allowed_datapoint_ids:
-            self.update_for_user(user)
-        return self.allowed_datapoint_ids[user]
+        return self.get_objects_for_user(user)["allowed_datapoint_ids"]
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Caches shared by all workers, based on Django's cache framework.
+
+See the `CACHES` setting for the used backend.
+"""
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from prometheus_client import Counter
+
+prom_latest_cache_requests = Counter(
+    "emp_api_latest_cache_requests_total",
+    "Number of datapoints requested from the cache of latest messages.",
+    ["cache_name", "result"],
+)
+
+
+class LatestMessageCache:
+    """
+    Holds the latest message per datapoint of one message type.
+
+    The messages are stored in the converted format of
+    `emp_main.serializers.RowSerializer`, i.e. ready to be encoded to JSON.
+
+    Arguments:
+    ----------
+    cache_name: str
+        Distinguishes the message types, e.g. `value`.
+    """
+
+    def __init__(self, cache_name):
+        self.cache_name = cache_name
+        self.key_prefix = "emp.latest.{}.".format(cache_name)
+
+    @property
+    def enabled(self):
+        return settings.API_LATEST_CACHE_TIMEOUT > 0
+
+    def get_many(self, datapoint_ids):
+        """
+        Return the cached messages of the datapoints.
+
+        Arguments:
+        ----------
+        datapoint_ids: list of int
+            The IDs of the requested datapoints.
+
+        Returns:
+        --------
+        messages_by_dp_id: dict
+            The cached messages with the datapoint IDs (as int) as keys.
+            Datapoints not in the cache are missing.
+        """
+        keys = [self.key_prefix + str(dp_id) for dp_id in datapoint_ids]
+        messages_by_key = cache.get_many(keys)
+
+        messages_by_dp_id = {}
+        for dp_id, key in zip(datapoint_ids, keys):
+            if key in messages_by_key:
+                messages_by_dp_id[dp_id] = messages_by_key[key]
+
+        n_hits = len(messages_by_dp_id)
+        n_misses = len(datapoint_ids) - n_hits
+        prom_latest_cache_requests.labels(
+            cache_name=self.cache_name, result="hit"
+        ).inc(n_hits)
+        prom_latest_cache_requests.labels(
+            cache_name=self.cache_name, result="miss"
+        ).inc(n_misses)
+
+        return messages_by_dp_id
+
+    def set_many(self, messages_by_dp_id):
+        """
+        Store messages in the cache.
+
+        Arguments:
+        ----------
+        messages_by_dp_id: dict
+            The messages with the datapoint IDs as keys.
+        """
+        if not messages_by_dp_id:
+            return
+        messages_by_key = {
+            self.key_prefix + str(dp_id): message
+            for dp_id, message in messages_by_dp_id.items()
+        }
+        cache.set_many(
+            messages_by_key, timeout=settings.API_LATEST_CACHE_TIMEOUT
+        )
+
+    def set_many_if_not_older(self, messages_by_dp_id):
+        """
+        Like `set_many` but doesn't replace cached messages with older ones,
+        i.e. with a smaller `time`, like the latest tables in DB.
+
+        Concurrent updates of the same datapoint are not synchronized, the
+        cached message expires after `API_LATEST_CACHE_TIMEOUT` anyway.
+
+        Arguments:
+        ----------
+        messages_by_dp_id: dict
+            The messages with the datapoint IDs as keys.
+        """
+        if not messages_by_dp_id:
+            return
+        keys = [self.key_prefix + str(dp_id) for dp_id in messages_by_dp_id]
+        cached_messages_by_key = cache.get_many(keys)
+        newer_messages_by_dp_id = {}
+        for key, (dp_id, message) in zip(keys, messages_by_dp_id.items()):
+            cached_message = cached_messages_by_key.get(key)
+            if cached_message is not None and (
+                cached_message["time"] > message["time"]
+            ):
+                continue
+            newer_messages_by_dp_id[dp_id] = message
+        self.set_many(newer_messages_by_dp_id)
+
+
+class ChangeCounter:
+    """
+    A version number of a table that changes on every write.
+
+    This allows clients to check if anything has changed since their last
+    request (via ETags) without querying the DB. The counter expires after
+    a timeout and restarts at the current time in milliseconds, which bounds
+    how long changes that bypass the counter (e.g. in the admin) remain
+    unnoticed.
+
+    Arguments:
+    ----------
+    counter_name: str
+        Distinguishes the counters, e.g. `value`.
+    timeout_setting: str
+        The name of the setting that holds the timeout in seconds.
+    """
+
+    def __init__(
+        self, counter_name, timeout_setting="API_LATEST_CACHE_TIMEOUT"
+    ):
+        self.counter_name = counter_name
+        self.timeout_setting = timeout_setting
+        self.key = "emp.version.{}".format(counter_name)
+        self.last_modified_key = self.key + ".last_modified"
+
+    @property
+    def timeout(self):
+        return getattr(settings, self.timeout_setting)
+
+    @property
+    def enabled(self):
+        return self.timeout > 0
+
+    def _init(self):
+        """
+        Start the counter, if it doesn't exist (anymore).
+        """
+        now = time()
+        cache.add(
+            self.key,
+            int(now * 1000),
+            timeout=self.timeout,
+        )
+        cache.set(
+            self.last_modified_key,
+            now,
+            timeout=self.timeout,
+        )
+
+    def get(self):
+        """
+        Return the current version.
+
+        Returns:
+        --------
+        version: int
+            The version number.
+        last_modified: float
+            The time of the last change as unix timestamp.
+        """
+        values = cache.get_many([self.key, self.last_modified_key])
+        if self.key not in values or self.last_modified_key not in values:
+            self._init()
+            values = cache.get_many([self.key, self.last_modified_key])
+        return values.get(self.key), values.get(self.last_modified_key)
+
+    def bump(self):
+        """
+        Increment the version after the table has changed.
+        """
+        try:
+            cache.incr(self.key)
+            cache.set(
+                self.last_modified_key,
+                time(),
+                timeout=self.timeout,
+            )
+        except ValueError:
+            # The counter doesn't exist, starting it yields a new version
+            # too, as it starts at the current time.
+            self._init()
@@ -1,9 +1,12 @@
 from asgiref.sync import async_to_sync
 
+import asyncio
 import json
 import logging
 from urllib import parse as urlparse
 
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.generic.websocket import WebsocketConsumer
 from django.contrib.auth import get_user_model
 from esg.django_models.filter import DatapointFilterParams
@@ -12,6 +15,7 @@ from .api import dpm_view
 from .api import dp_value_view
 from .api import dp_schedule_view
 from .api import dp_setpoint_view
+from .subscriptions import SubscriptionRouter
 from .urls import API_ROOT_PATH
 
 logger = logging.getLogger(__name__)
@@ -157,16 +161,15 @@ logger = logging.getLogger(__name__)
 #         )
 
 
-class DatapointRelatedLatestConsumer(WebsocketConsumer):
+class DatapointRelatedLatestConsumerMixin:
     """
-    Consumer that publishes updates to datapoints or datapoint related
-    objects on websocket.
-
-    Test this websocket interactively with:
-        ws = new WebSocket("ws://localhost:8080/ws/api/datapoint/value/latest/?datapoint-ids=[1,2]");
-        ws.onmessage = function(msg){console.log(JSON.parse(msg.data))}
+    Logic shared by the sync and async versions of the consumer that
+    publishes updates to datapoints or datapoint related objects.
 
-    TODO: Secure data access here!
+    After connect clients can change the datapoints they receive updates
+    for by sending messages like `{"subscribe": [3, 4], "unsubscribe": [1]}`.
+    The latest messages of newly subscribed datapoints are pushed
+    immediately, like on connect.
     """
 
     dp_msg_views = {
@@ -176,27 +179,39 @@ class DatapointRelatedLatestConsumer(WebsocketConsumer):
         "datapoint.schedule.latest": dp_schedule_view,
     }
 
-    def connect(self):
+    def get_user(self):
+        """
+        Return the user of the connection.
+        """
         if "user" in self.scope:
-            self.user = self.scope["user"]
+            user = self.scope["user"]
         else:
             logger.warning(
                 "No user in scope. Be alerted if this is not a "
                 "call from emp_main/tests/test_consumer.py!"
             )
-            self.user = get_user_model().get_anonymous()
+            user = get_user_model().get_anonymous()
+        return user
 
-        # Compute the requested channel layer groups.
+    def get_group_name(self):
+        """
+        Compute the channel layer group the requested messages are published
+        on from the path.
+        """
         if "datapoint-update" in self.scope["path"]:
             # Support the legacy Websocket URL.
-            group_base_name = "datapoint.value.latest."
+            group_name = "datapoint.value.latest."
         else:
-            group_base_name = self.scope["path"].split(API_ROOT_PATH)[1]
+            group_name = self.scope["path"].split(API_ROOT_PATH)[1]
         # Remove trailing `/` and replace slashes with dots
         # no slashes allowed in group names
-        group_base_name = group_base_name[:-1].replace("/", ".")
+        group_name = group_name[:-1].replace("/", ".")
+        return group_name
 
-        # Parse the set of requested datapoints from the query string.
+    def get_requested_dp_ids(self):
+        """
+        Parse the set of requested datapoints from the query string.
+        """
         try:
             query_string = self.scope["query_string"].decode("utf8")
             query_string_parsed = urlparse.parse_qs(query_string)
@@ -212,42 +227,312 @@ class DatapointRelatedLatestConsumer(WebsocketConsumer):
                 self.user,
             )
             raise
+        return requested_dp_ids
 
-        # TODO take over code that checks which IDs are actually allowed.
+    def get_max_rate(self):
+        """
+        Parse the optional maximum rate of messages from the query string.
 
-        self.groups = []
-        for datapoint_id in requested_dp_ids:
-            group = "{}.{}".format(group_base_name, datapoint_id)
+        The rate is given in Hz, e.g. `?max-rate=2hz` or `?max-rate=0.5`.
 
-            # Adding to group will automatically remove these on disconnect.
-            self.groups.append(group)
+        Returns:
+        --------
+        max_rate: float or None
+            The maximum number of messages per second. None if the client
+            requested no limit.
+        """
+        query_string = self.scope["query_string"].decode("utf8")
+        query_string_parsed = urlparse.parse_qs(query_string)
+        if "max-rate" not in query_string_parsed:
+            return None
+        try:
+            max_rate_str = query_string_parsed["max-rate"][0].lower()
+            max_rate = float(max_rate_str.replace("hz", ""))
+            if max_rate <= 0:
+                raise ValueError("max-rate must be positive.")
+        except:
+            logging.exception(
+                "DatapointUpdate consumer received invalid max-rate "
+                "by user=%s.",
+                self.user,
+            )
+            raise
+        return max_rate
+
+    def merge_msgs_json(self, json_strs):
+        """
+        Merge the JSON messages of several datapoints into one message.
+
+        The merged message has the same format as the latest messages that
+        are pushed on connect. That is a list of datapoints for metadata
+        and an object with the datapoint IDs as keys for everything else.
+        """
+        if self.group_name == "datapoint.metadata.latest":
+            return "[" + ", ".join(json_strs) + "]"
+
+        # Each message is an object holding a single datapoint, like
+        # `{"1": {...}}`, hence we can just concatenate the content.
+        contents = [json_str.strip()[1:-1] for json_str in json_strs]
+        return "{" + ", ".join(contents) + "}"
+
+    def parse_subscription_change(self, text_data):
+        """
+        Parse a message of the client that changes the subscriptions.
 
-            async_to_sync(self.channel_layer.group_add)(
-                group, self.channel_name
+        Returns:
+        --------
+        subscribe_dp_ids: set
+            The ids of datapoints that should be added.
+        unsubscribe_dp_ids: set
+            The ids of datapoints that should be removed.
+        """
+        try:
+            subscription_change = json.loads(text_data)
+            subscribe_dp_ids = set(subscription_change.get("subscribe", []))
+            unsubscribe_dp_ids = set(
+                subscription_change.get("unsubscribe", [])
+            )
+        except Exception:
+            logger.warning(
+                "DatapointUpdate consumer received invalid subscription "
+                "change from user=%s: %s",
+                self.user,
+                text_data[:60],
             )
+            return set(), set()
+        return subscribe_dp_ids, unsubscribe_dp_ids
+
+    def get_latest_msgs_json(self, group_name, requested_dp_ids):
+        """
+        Load the latest messages of the requested datapoints from DB, these
+        are pushed as initial values after connect.
+        """
+        datapoint_filter_params = DatapointFilterParams(
+            id__in=requested_dp_ids,
+        )
+        dp_msg_view = self.dp_msg_views[group_name]
+        latest_msgs_as_http_response = dp_msg_view.list_latest(
+            request=None, datapoint_filter_params=datapoint_filter_params,
+        )
+        return latest_msgs_as_http_response.content.decode()
+
+
+class DatapointRelatedLatestConsumer(
+    DatapointRelatedLatestConsumerMixin, WebsocketConsumer
+):
+    """
+    Consumer that publishes updates to datapoints or datapoint related
+    objects on websocket.
+
+    Test this websocket interactively with:
+        ws = new WebSocket("ws://localhost:8080/ws/api/datapoint/value/latest/?datapoint-ids=[1,2]");
+        ws.onmessage = function(msg){console.log(JSON.parse(msg.data))}
+
+    Every connection is added to the group of the message type and drops
+    the messages of datapoints which have not been requested. See
+    `AsyncDatapointRelatedLatestConsumer` for the version that is used
+    in `routing.py`.
+
+    TODO: Secure data access here!
+    """
+
+    def connect(self):
+        self.user = self.get_user()
+        self.group_name = self.get_group_name()
+        requested_dp_ids = self.get_requested_dp_ids()
+
+        # TODO take over code that checks which IDs are actually allowed.
+
+        # The published messages carry the datapoint IDs as strings.
+        self.subscribed_dp_ids = {str(i) for i in requested_dp_ids}
+
+        # Adding to group will automatically remove these on disconnect.
+        self.groups = [self.group_name]
+        async_to_sync(self.channel_layer.group_add)(
+            self.group_name, self.channel_name
+        )
 
         self.accept()
         logger.info(
             "DatapointUpdate consumer accepted connection from user=%s",
             self.user,
         )
-
-        groups_truncated = str(self.groups)[:60]
-        logger.info("Connected to channel groups %s...", groups_truncated)
+        logger.info("Connected to channel group %s", self.group_name)
 
         # Push the latest messages as initial values too.
-        datapoint_filter_params = DatapointFilterParams(
-            id__in=requested_dp_ids,
+        latest_msgs_json = self.get_latest_msgs_json(
+            group_name=self.group_name, requested_dp_ids=requested_dp_ids
         )
-        dp_msg_view = self.dp_msg_views[group_base_name]
-        latest_msgs_as_http_response = dp_msg_view.list_latest(
-            request=None, datapoint_filter_params=datapoint_filter_params,
+        self.send(latest_msgs_json)
+
+    def receive(self, text_data=None, bytes_data=None):
+        """
+        Handle subscription changes sent by the client.
+        """
+        subscribe_dp_ids, unsubscribe_dp_ids = self.parse_subscription_change(
+            text_data or ""
         )
-        self.send(latest_msgs_as_http_response.content.decode())
+        self.subscribed_dp_ids -= {str(i) for i in unsubscribe_dp_ids}
+        if subscribe_dp_ids:
+            self.subscribed_dp_ids |= {str(i) for i in subscribe_dp_ids}
+            latest_msgs_json = self.get_latest_msgs_json(
+                group_name=self.group_name, requested_dp_ids=subscribe_dp_ids
+            )
+            self.send(latest_msgs_json)
 
-    def datapoint_related(self, message):
+    def datapoint_related_batch(self, message):
         """
-        Publishes group message on Websocket.
+        Publishes the requested datapoints of a group message on Websocket.
         Whatever you push here should already be in JSON.
         """
-        self.send(message["json"])
+        for dp_id, json_str in message["json_by_dp_id"].items():
+            if dp_id in self.subscribed_dp_ids:
+                self.send(json_str)
+
+
+class AsyncDatapointRelatedLatestConsumer(
+    DatapointRelatedLatestConsumerMixin, AsyncWebsocketConsumer
+):
+    """
+    Async version of `DatapointRelatedLatestConsumer`.
+
+    The sync version needs a thread of the worker for every call, i.e. for
+    every message forwarded to the client. This version touches a thread
+    only to load the latest messages from DB. Furthermore, the connection
+    is not added to any channel layer group, instead the process wide
+    `SubscriptionRouter` forwards the messages of the requested
+    datapoints.
+
+    Every connection sends its updates in its own task, i.e. a slow client
+    doesn't delay the updates of the other ones. If the client can't keep
+    up, older updates of a datapoint not sent yet are dropped instead of
+    queued, hence at most one update per datapoint is pending.
+
+    Clients may limit the rate of messages with the `max-rate` query
+    parameter, e.g. `?datapoint-ids=[1,2]&max-rate=2hz`. Updates are then
+    collected and sent as one merged message per period, which contains
+    only the newest update per datapoint.
+
+    TODO: Secure data access here!
+    """
+
+    async def connect(self):
+        self.user = self.get_user()
+        self.group_name = self.get_group_name()
+        requested_dp_ids = self.get_requested_dp_ids()
+
+        # TODO take over code that checks which IDs are actually allowed.
+
+        self.subscribed_dp_ids = set(requested_dp_ids)
+
+        # The newest update per datapoint that has not been sent yet.
+        self.max_rate = self.get_max_rate()
+        self.pending_updates = {}
+        self.updates_pending = asyncio.Event()
+        if self.max_rate is None:
+            self.send_task = asyncio.create_task(self.send_pending_updates())
+        else:
+            self.send_task = asyncio.create_task(self.flush_pending_updates())
+
+        self.router = SubscriptionRouter.get_instance()
+        await self.router.subscribe(
+            consumer=self,
+            group_name=self.group_name,
+            datapoint_ids=self.subscribed_dp_ids,
+        )
+
+        await self.accept()
+        logger.info(
+            "DatapointUpdate consumer accepted connection from user=%s",
+            self.user,
+        )
+
+        # Push the latest messages as initial values too.
+        await self.send_latest_msgs(requested_dp_ids)
+
+    async def disconnect(self, code):
+        if hasattr(self, "router"):
+            self.router.unsubscribe(
+                consumer=self,
+                group_name=self.group_name,
+                datapoint_ids=self.subscribed_dp_ids,
+            )
+        if hasattr(self, "send_task"):
+            self.send_task.cancel()
+
+    def push_update(self, dp_id, json_str):
+        """
+        Forward an update of a datapoint to the client, called by the
+        `SubscriptionRouter`. Returns without waiting for the client, the
+        update is sent by `send_task`.
+        Whatever you push here should already be in JSON.
+        """
+        # Overwrites any older update that has not been sent yet.
+        self.pending_updates[dp_id] = json_str
+        self.updates_pending.set()
+
+    async def send_pending_updates(self):
+        """
+        Send the pending updates one by one as soon as these arrive.
+        """
+        while True:
+            await self.updates_pending.wait()
+            self.updates_pending.clear()
+            while self.pending_updates:
+                dp_id = next(iter(self.pending_updates))
+                json_str = self.pending_updates.pop(dp_id)
+                try:
+                    await self.send(json_str)
+                except Exception as e:
+                    # Don't stop sending because of a single failure.
+                    logger.warning("Failed to send update to client: %s", e)
+
+    async def flush_pending_updates(self):
+        """
+        Send the pending updates as one message every `1 / max_rate` seconds.
+
+        Updates arriving while a message is sent are collected for the next
+        one. Hence a slow client receives fewer messages, but not older ones.
+        """
+        period = 1 / self.max_rate
+        while True:
+            await asyncio.sleep(period)
+            if not self.pending_updates:
+                continue
+            pending_updates = self.pending_updates
+            self.pending_updates = {}
+            await self.send(self.merge_msgs_json(pending_updates.values()))
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """
+        Handle subscription changes sent by the client.
+        """
+        subscribe_dp_ids, unsubscribe_dp_ids = self.parse_subscription_change(
+            text_data or ""
+        )
+        if unsubscribe_dp_ids:
+            self.router.unsubscribe(
+                consumer=self,
+                group_name=self.group_name,
+                datapoint_ids=unsubscribe_dp_ids,
+            )
+            self.subscribed_dp_ids -= unsubscribe_dp_ids
+            for dp_id in unsubscribe_dp_ids:
+                self.pending_updates.pop(str(dp_id), None)
+        if subscribe_dp_ids:
+            await self.router.subscribe(
+                consumer=self,
+                group_name=self.group_name,
+                datapoint_ids=subscribe_dp_ids,
+            )
+            self.subscribed_dp_ids |= subscribe_dp_ids
+            await self.send_latest_msgs(subscribe_dp_ids)
+
+    async def send_latest_msgs(self, requested_dp_ids):
+        """
+        Push the latest messages of datapoints to the client.
+        """
+        latest_msgs_json = await database_sync_to_async(
+            self.get_latest_msgs_json
+        )(group_name=self.group_name, requested_dp_ids=requested_dp_ids)
+        await self.send(latest_msgs_json)
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Retention and compression of the history tables.
+
+The history of values, schedules, setpoints and forecasts is stored in
+TimescaleDB hypertables, which otherwise grow forever. Depending on the
+settings (see `HISTORY_RETENTION_DAYS`, `HISTORY_RETENTION_DAYS_BY_ORIGIN`
+and `HISTORY_COMPRESS_AFTER_DAYS`):
+
+* TimescaleDB drops chunks older than the retention period of a table in
+  background (retention policy).
+* TimescaleDB compresses chunks older than the compression period in
+  background (compression policy). The compressed rows are segmented by
+  datapoint and ordered by time, which matches the queries of the REST API.
+  Reads are transparent, i.e. need no changes.
+* The messages of datapoints with an origin with a shorter retention period
+  are deleted by the `history_policies` management command, which must be
+  run periodically for that purpose, as chunks contain all datapoints.
+
+The policies are applied by `history_policies --apply`, which is run on
+container start and must be run after the settings have been changed.
+Compression requires TimescaleDB 2.11 or newer, as older versions can't
+write to compressed chunks, which e.g. a late history upload would do.
+"""
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+import logging
+
+from django.conf import settings
+from django.db import connection
+
+from .models import Datapoint
+from .models import ForecastMessage
+from .models import ScheduleMessage
+from .models import SetpointMessage
+from .models import ValueMessage
+from .rollups import VALUE_ROLLUPS
+
+logger = logging.getLogger(__name__)
+
+# The first version of TimescaleDB that supports inserts and updates of rows
+# in compressed chunks, including `INSERT ... ON CONFLICT`.
+COMPRESSION_MIN_TIMESCALEDB_VERSION = (2, 11)
+
+
+class HistoryTable:
+    """
+    The policies of one history hypertable.
+
+    Arguments:
+    ----------
+    name: str
+        The name of the table in the settings, e.g. `value`.
+    model: django.db.models.Model
+        The model of the history messages.
+    compress_segmentby: list of str
+        The columns by which the compressed rows are grouped. Must include
+        all columns of unique constraints apart from `time`.
+    """
+
+    def __init__(self, name, model, compress_segmentby):
+        self.name = name
+        self.model = model
+        self.compress_segmentby = compress_segmentby
+
+    @property
+    def table_name(self):
+        return self.model._meta.db_table
+
+    def get_compression_sql(self, compress_after_days, compression_enabled):
+        """
+        Return the statements that set the compression policy.
+
+        Arguments:
+        ----------
+        compress_after_days: int
+            Compress chunks older than this. Removes the policy if `0`,
+            already compressed chunks stay compressed.
+        compression_enabled: bool
+            Whether compression has been enabled for the table before. The
+            compression settings can't be changed once chunks are
+            compressed, hence these are only set once.
+
+        Returns:
+        --------
+        statements: list of str
+        """
+        statements = [
+            "SELECT remove_compression_policy('{}', if_exists => true)".format(
+                self.table_name
+            )
+        ]
+        if not compress_after_days:
+            return statements
+        if not compression_enabled:
+            statements.insert(
+                0,
+                (
+                    "ALTER TABLE {table_name} SET ("
+                    "timescaledb.compress, "
+                    "timescaledb.compress_segmentby = '{segmentby}', "
+                    "timescaledb.compress_orderby = 'time DESC')"
+                ).format(
+                    table_name=self.table_name,
+                    segmentby=", ".join(self.compress_segmentby),
+                ),
+            )
+        statements.append(
+            "SELECT add_compression_policy('{}', INTERVAL '{} days')".format(
+                self.table_name, int(compress_after_days)
+            )
+        )
+        return statements
+
+    def get_retention_sql(self, retention_days):
+        """
+        Return the statements that set the retention policy.
+
+        Arguments:
+        ----------
+        retention_days: int or None
+            Drop chunks older than this. Removes the policy if None or `0`.
+
+        Returns:
+        --------
+        statements: list of str
+        """
+        statements = [
+            "SELECT remove_retention_policy('{}', if_exists => true)".format(
+                self.table_name
+            )
+        ]
+        if retention_days:
+            statements.append(
+                "SELECT add_retention_policy('{}', INTERVAL '{} days')".format(
+                    self.table_name, int(retention_days)
+                )
+            )
+        return statements
+
+    def delete_for_origin(self, origin, retention_days):
+        """
+        Delete the messages of the datapoints of one origin that are older
+        than the retention period. Works on all DBs.
+
+        Returns:
+        --------
+        n_deleted: int
+            The number of deleted messages.
+        """
+        older_than = datetime.now(tz=timezone.utc) - timedelta(
+            days=retention_days
+        )
+        sql = (
+            "DELETE FROM {table_name} WHERE time < %s AND datapoint_id IN "
+            "(SELECT id FROM {datapoint_table_name} WHERE origin = %s)"
+        ).format(
+            table_name=self.table_name,
+            datapoint_table_name=Datapoint._meta.db_table,
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [older_than, origin])
+            return cursor.rowcount
+
+
+HISTORY_TABLES = {
+    "value": HistoryTable(
+        name="value",
+        model=ValueMessage,
+        compress_segmentby=["datapoint_id"],
+    ),
+    "schedule": HistoryTable(
+        name="schedule",
+        model=ScheduleMessage,
+        compress_segmentby=["datapoint_id"],
+    ),
+    "setpoint": HistoryTable(
+        name="setpoint",
+        model=SetpointMessage,
+        compress_segmentby=["datapoint_id"],
+    ),
+    "forecast": HistoryTable(
+        name="forecast",
+        model=ForecastMessage,
+        compress_segmentby=["datapoint_id", "product_run_id"],
+    ),
+}
+
+
+def check_settings():
+    """
+    Verify that the settings only refer to known history tables.
+
+    Raises:
+    -------
+    ValueError
+        If the settings are invalid.
+    """
+    retention_days_by_origin = settings.HISTORY_RETENTION_DAYS_BY_ORIGIN
+    all_retention_days = [settings.HISTORY_RETENTION_DAYS]
+    all_retention_days += list(retention_days_by_origin.values())
+    for retention_days in all_retention_days:
+        for table_name in retention_days:
+            if table_name not in HISTORY_TABLES:
+                raise ValueError(
+                    "Unknown history table `{}` in retention settings. "
+                    "Expected one of: {}".format(
+                        table_name, ", ".join(HISTORY_TABLES)
+                    )
+                )
+
+    # The rollups would lose the buckets of dropped values on refresh.
+    value_retention_days = settings.HISTORY_RETENTION_DAYS.get("value")
+    if value_retention_days:
+        rollup_start_offset = max(r.policy_start_offset for r in VALUE_ROLLUPS)
+        if timedelta(days=value_retention_days) <= rollup_start_offset:
+            raise ValueError(
+                "The retention period of the value history must be longer "
+                "than {} days, the refresh window of the rollups.".format(
+                    rollup_start_offset.days
+                )
+            )
+
+
+def timescaledb_available(db_connection=connection):
+    """
+    Check if the DB supports the policies, i.e. is TimescaleDB.
+    """
+    if db_connection.vendor != "postgresql":
+        return False
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'"
+        )
+        return cursor.fetchone() is not None
+
+
+def get_timescaledb_version(db_connection=connection):
+    """
+    Return the version of the TimescaleDB extension, e.g. `(2, 11, 2)`.
+    """
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT extversion FROM pg_extension WHERE extname = 'timescaledb'"
+        )
+        extversion = cursor.fetchone()[0]
+    # Ignore suffixes of pre-releases like `2.11.0-rc1`.
+    return tuple(int(p.split("-")[0]) for p in extversion.split("."))
+
+
+def apply_policies(db_connection=connection):
+    """
+    Set the compression and retention policies of all history tables as
+    defined in the settings.
+
+    Returns:
+    --------
+    applied: bool
+        False if the DB is not TimescaleDB, i.e. nothing has been done.
+
+    Raises:
+    -------
+    ValueError
+        If the settings are invalid, or if compression is enabled but the
+        version of TimescaleDB can't write to compressed chunks.
+    """
+    check_settings()
+    if not timescaledb_available(db_connection):
+        return False
+
+    if settings.HISTORY_COMPRESS_AFTER_DAYS:
+        timescaledb_version = get_timescaledb_version(db_connection)
+        if timescaledb_version < COMPRESSION_MIN_TIMESCALEDB_VERSION:
+            raise ValueError(
+                "Compression of the history tables requires TimescaleDB {} "
+                "or newer, found {}. Set EMP_HISTORY_COMPRESS_AFTER_DAYS to 0 "
+                "or upgrade TimescaleDB.".format(
+                    ".".join(map(str, COMPRESSION_MIN_TIMESCALEDB_VERSION)),
+                    ".".join(map(str, timescaledb_version)),
+                )
+            )
+
+    with db_connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT hypertable_name FROM timescaledb_information.hypertables "
+            "WHERE compression_enabled"
+        )
+        compression_enabled_tables = {row[0] for row in cursor.fetchall()}
+
+        for history_table in HISTORY_TABLES.values():
+            statements = history_table.get_compression_sql(
+                compress_after_days=settings.HISTORY_COMPRESS_AFTER_DAYS,
+                compression_enabled=(
+                    history_table.table_name in compression_enabled_tables
+                ),
+            )
+            statements += history_table.get_retention_sql(
+                retention_days=settings.HISTORY_RETENTION_DAYS.get(
+                    history_table.name
+                )
+            )
+            for statement in statements:
+                logger.debug("Applying history policy: %s", statement)
+                cursor.execute(statement)
+    return True
+
+
+def delete_by_origin():
+    """
+    Delete messages older than the retention periods defined per origin.
+
+    Returns:
+    --------
+    n_deleted_by_table: dict
+        The number of deleted messages with the names of the tables as keys.
+    """
+    check_settings()
+    retention_days_by_origin = settings.HISTORY_RETENTION_DAYS_BY_ORIGIN
+    n_deleted_by_table = {}
+    for origin, retention_days_by_table in retention_days_by_origin.items():
+        for table_name, retention_days in retention_days_by_table.items():
+            history_table = HISTORY_TABLES[table_name]
+            n_deleted = history_table.delete_for_origin(
+                origin=origin, retention_days=retention_days
+            )
+            n_deleted_by_table.setdefault(table_name, 0)
+            n_deleted_by_table[table_name] += n_deleted
+    return n_deleted_by_table
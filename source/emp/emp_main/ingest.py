@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Fast bulk writes of messages on PostgreSQL/TimescaleDB.
+
+`bulk_update_or_create` of the esg models loads the existing rows to split
+the messages into created and updated ones, and writes these with one
+statement per batch of `bulk_create`/`bulk_update`, which limits large
+backfills to a few thousand rows per second. `copy_upsert` instead streams
+the rows into a temporary staging table with `COPY` and merges these into
+the target table with a single `INSERT ... ON CONFLICT DO UPDATE`.
+
+Similarly, `upsert_latest_and_history` writes the messages of a PUT to a
+latest endpoint into the latest and the history table with one statement,
+instead of two `bulk_update_or_create` calls with several queries each.
+"""
+import csv
+from datetime import datetime
+from io import StringIO
+import json
+
+from django.conf import settings
+from django.db import connection
+from django.db import models
+from django.db import transaction
+
+# Marks NULL values in the CSV data, as empty strings are valid values.
+COPY_NULL = "\\N"
+
+
+def copy_upsert_available(n_items):
+    """
+    Check if `copy_upsert` should be used to write `n_items` messages.
+
+    COPY is only available on PostgreSQL, and only pays off for larger
+    payloads due to the overhead of the staging table.
+    """
+    if connection.vendor != "postgresql":
+        return False
+    if settings.API_COPY_INGEST_MIN_ITEMS <= 0:
+        return False
+    return n_items >= settings.API_COPY_INGEST_MIN_ITEMS
+
+
+def single_statement_upsert_available():
+    """
+    Check if `upsert_latest_and_history` can be used, which requires the
+    data-modifying CTEs of PostgreSQL.
+    """
+    return connection.vendor == "postgresql"
+
+
+def encode_copy_value(field, value):
+    """
+    Encode a value as text in the format PostgreSQL expects for the column.
+    """
+    if value is None:
+        return COPY_NULL
+    if isinstance(field, models.JSONField):
+        return json.dumps(value, cls=field.encoder)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def iter_csv_lines(fields, rows):
+    """
+    Yield the rows as CSV lines, numbered in the order of `rows`.
+
+    Arguments:
+    ----------
+    fields: list of django.db.models.Field
+        The fields of the values of the rows.
+    rows: iterable of list
+        The rows, each holding the values of `fields` in that order.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    for row_number, row in enumerate(rows):
+        encoded_row = [
+            encode_copy_value(field, value) for field, value in zip(fields, row)
+        ]
+        encoded_row.append(row_number)
+        writer.writerow(encoded_row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class CopyStream:
+    """
+    A file like object that encodes the CSV lines on demand, which allows
+    `COPY` to consume arbitrary many rows with bounded memory.
+
+    Arguments:
+    ----------
+    lines: iterator of str
+        The lines to stream, e.g. from `iter_csv_lines`.
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.lines).encode()
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        chunk = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return chunk
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def copy_upsert(model, columns, rows, conflict_columns):
+    """
+    Create or update rows in one transaction, using `COPY`.
+
+    If several rows have the same values in `conflict_columns` the last one
+    wins, like it would if the rows were written one after the other.
+
+    Arguments:
+    ----------
+    model: django.db.models.Model
+        The model of the target table.
+    columns: list of str
+        The column names of the values of `rows`.
+    rows: iterable of list
+        The rows to write, each holding the values of `columns`.
+    conflict_columns: list of str
+        The columns of the unique constraint that identifies existing rows.
+
+    Returns:
+    --------
+    n_created: int
+        The number of inserted rows.
+    n_updated: int
+        The number of updated rows.
+    """
+    qn = connection.ops.quote_name
+    table_name = qn(model._meta.db_table)
+    staging_table_name = qn("emp_ingest_" + model._meta.db_table)
+    fields = [model._meta.get_field(column) for column in columns]
+
+    column_list = ", ".join(qn(c) for c in columns)
+    conflict_list = ", ".join(qn(c) for c in conflict_columns)
+    update_list = ", ".join(
+        "{0} = EXCLUDED.{0}".format(qn(c))
+        for c in columns
+        if c not in conflict_columns
+    )
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS {}".format(staging_table_name))
+            cursor.execute(
+                "CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS "
+                "SELECT {columns} FROM {table} WITH NO DATA".format(
+                    staging=staging_table_name,
+                    columns=column_list,
+                    table=table_name,
+                )
+            )
+            cursor.execute(
+                "ALTER TABLE {} ADD COLUMN emp_row_number bigint".format(
+                    staging_table_name
+                )
+            )
+            cursor.copy_expert(
+                "COPY {staging} ({columns}, emp_row_number) FROM STDIN "
+                "WITH (FORMAT csv, NULL '{null}')".format(
+                    staging=staging_table_name,
+                    columns=column_list,
+                    null=COPY_NULL,
+                ),
+                CopyStream(iter_csv_lines(fields, rows)),
+            )
+            # `xmax` is zero for inserted rows and the ID of the updating
+            # transaction for updated ones.
+            cursor.execute(
+                "WITH merged AS ("
+                "INSERT INTO {table} ({columns}) "
+                "SELECT DISTINCT ON ({conflict}) {columns} FROM {staging} "
+                "ORDER BY {conflict}, emp_row_number DESC "
+                "ON CONFLICT ({conflict}) DO UPDATE SET {update} "
+                "RETURNING xmax = 0 AS created"
+                ") "
+                "SELECT count(*) FILTER (WHERE created), "
+                "count(*) FILTER (WHERE NOT created) FROM merged".format(
+                    table=table_name,
+                    columns=column_list,
+                    conflict=conflict_list,
+                    staging=staging_table_name,
+                    update=update_list,
+                )
+            )
+            n_created, n_updated = cursor.fetchone()
+
+    return n_created, n_updated
+
+
+def get_upsert_columns(model):
+    """
+    Return the names of the columns `upsert_latest_and_history` writes.
+    """
+    return [
+        field.attname
+        for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+
+
+def upsert_latest_and_history(
+    latest_model,
+    history_model,
+    rows,
+    latest_conflict_columns,
+    history_conflict_columns,
+):
+    """
+    Write messages to the latest and the history table with one statement.
+
+    A message replaces the one in the latest table only if its `time` is
+    not older, while it is always created or updated in the history table.
+    The statement is a data-modifying CTE and hence requires PostgreSQL.
+
+    Arguments:
+    ----------
+    latest_model: django.db.models.Model
+        The model of the latest table.
+    history_model: django.db.models.Model or None
+        The model of the history table. Only the latest table is written if
+        None.
+    rows: list of dict
+        The messages with the column names as keys. Must contain all
+        columns of both models apart from the primary keys.
+    latest_conflict_columns: list of str
+        The columns of the unique constraint of the latest table.
+    history_conflict_columns: list of str
+        Like `latest_conflict_columns` but for the history table.
+
+    Returns:
+    --------
+    n_created: int
+        The number of messages inserted into the latest table.
+    n_updated: int
+        The number of messages that have replaced older ones in the latest
+        table.
+    written_datapoint_ids: set of int
+        The IDs of the datapoints which have a message in the latest table
+        that is one of `rows` now.
+    """
+    # `VALUES` without any row is not valid SQL.
+    if not rows:
+        return 0, 0, set()
+
+    qn = connection.ops.quote_name
+    latest_columns = get_upsert_columns(latest_model)
+    history_columns = []
+    if history_model is not None:
+        history_columns = get_upsert_columns(history_model)
+    # The columns of the CTE holding the rows are those of both tables, the
+    # values are cast to the types of the latest table, or of the history
+    # table for the columns only it has.
+    fields = [latest_model._meta.get_field(c) for c in latest_columns]
+    fields += [
+        history_model._meta.get_field(c)
+        for c in history_columns
+        if c not in latest_columns
+    ]
+    placeholder = "({})".format(
+        ", ".join(
+            "CAST(%s AS {})".format(field.db_type(connection))
+            for field in fields
+        )
+    )
+    params = []
+    for row in rows:
+        for field in fields:
+            value = row.get(field.attname)
+            if value is not None and isinstance(field, models.JSONField):
+                value = json.dumps(value, cls=field.encoder)
+            params.append(value)
+    values_sql = ", ".join([placeholder] * len(rows))
+
+    def insert_sql(model, conflict_columns, columns, where=""):
+        table_name = qn(model._meta.db_table)
+        column_list = ", ".join(qn(c) for c in columns)
+        update_list = ", ".join(
+            "{0} = EXCLUDED.{0}".format(qn(c))
+            for c in columns
+            if c not in conflict_columns
+        )
+        return (
+            "INSERT INTO {table} ({columns}) SELECT {columns} FROM data "
+            "ON CONFLICT ({conflict}) DO UPDATE SET {update}{where}"
+        ).format(
+            table=table_name,
+            columns=column_list,
+            conflict=", ".join(qn(c) for c in conflict_columns),
+            update=update_list,
+            where=where.format(table=table_name),
+        )
+
+    latest_sql = insert_sql(
+        model=latest_model,
+        conflict_columns=latest_conflict_columns,
+        columns=latest_columns,
+        where=" WHERE {table}.time <= EXCLUDED.time",
+    )
+    sql = (
+        "WITH data ({columns}) AS (VALUES {values}), "
+        "latest AS ({latest} RETURNING datapoint_id, xmax = 0 AS created)"
+    ).format(
+        columns=", ".join(qn(field.attname) for field in fields),
+        values=values_sql,
+        latest=latest_sql,
+    )
+    if history_model is not None:
+        # Executed although not referenced, as all data-modifying
+        # statements in WITH are.
+        sql += ", history AS ({})".format(
+            insert_sql(
+                model=history_model,
+                conflict_columns=history_conflict_columns,
+                columns=history_columns,
+            )
+        )
+    sql += " SELECT datapoint_id, created FROM latest"
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            written_rows = cursor.fetchall()
+
+    n_created = sum(1 for _, created in written_rows if created)
+    n_updated = len(written_rows) - n_created
+    written_datapoint_ids = {dp_id for dp_id, _ in written_rows}
+    return n_created, n_updated, written_datapoint_ids
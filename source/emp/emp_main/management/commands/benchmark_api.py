@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the endpoints of the EMP REST API.
+
+Run with e.g.:
+    python manage.py benchmark_api --datapoints 1000 --output bench.json
+
+The benchmark runs on a freshly created test database (like the tests do),
+seeds it through the API with the requested amount of data and then calls
+every endpoint registered on the Ninja `api` object several times. For each
+endpoint the timings, the number of DB queries and the peak memory
+allocated by Python are recorded and written as JSON, which allows comparing
+the results of different commits.
+"""
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+import json
+import platform
+from statistics import mean
+from statistics import median
+import subprocess
+from time import perf_counter
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import setup_test_environment
+from django.test.utils import teardown_test_environment
+
+from emp_main.api import api
+from emp_main.urls import API_ROOT_PATH
+
+# Query parameters required by some endpoints, the keys are the end of the
+# path of the endpoint.
+EXTRA_QUERY_PARAMS = {
+    "/datapoint/value/history/at_interval/": {
+        "interval": "1 hour",
+        "aggregation": "Avg",
+    },
+    "/datapoint/value/history/columnar/": {"format": "arrow"},
+    "/datapoint/schedule/history/columnar/": {"format": "arrow"},
+    "/datapoint/setpoint/history/columnar/": {"format": "arrow"},
+    "/datapoint/forecast/latest/{id}/columnar/": {"format": "arrow"},
+}
+
+
+class Command(BaseCommand):
+    help = "Benchmark the endpoints of the EMP REST API."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--datapoints",
+            type=int,
+            default=100,
+            help="Number of datapoints created in the benchmark DB.",
+        )
+        parser.add_argument(
+            "--messages",
+            type=int,
+            default=100,
+            help=(
+                "Number of history messages (values, schedules, setpoints "
+                "and forecasts) created per datapoint."
+            ),
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of timed calls per endpoint.",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="File to write the results to. Defaults to stdout.",
+        )
+        parser.add_argument(
+            "--keepdb",
+            action="store_true",
+            help="Keep the benchmark DB between runs, like `test --keepdb`.",
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_db_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options["keepdb"]
+        )
+        try:
+            self.client = Client()
+            self.seed_db(
+                n_datapoints=options["datapoints"],
+                n_messages=options["messages"],
+            )
+            results = self.benchmark_endpoints(repeat=options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(
+                old_db_name, verbosity=0, keepdb=options["keepdb"]
+            )
+            teardown_test_environment()
+
+        output = {
+            "meta": self.get_meta(options),
+            "results": results,
+        }
+        output_json = json.dumps(output, indent=4)
+        if options["output"] is None:
+            self.stdout.write(output_json)
+        else:
+            with open(options["output"], "w") as f:
+                f.write(output_json)
+
+    def get_meta(self, options):
+        """
+        Collect information about the environment of the benchmark run.
+        """
+        try:
+            git_commit = subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+        except Exception:
+            git_commit = None
+
+        meta = {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit,
+            "python_version": platform.python_version(),
+            "django_version": django.get_version(),
+            "db_vendor": connection.vendor,
+            "datapoints": options["datapoints"],
+            "messages": options["messages"],
+            "repeat": options["repeat"],
+        }
+        return meta
+
+    def put(self, path, data):
+        """
+        PUT JSON to the API and fail loudly if that doesn't work.
+        """
+        response = self.client.put(
+            self.api_root + path, content_type="application/json", data=data,
+        )
+        if response.status_code != 200:
+            raise CommandError(
+                "Seeding DB failed for PUT {} with status {}: {}".format(
+                    path, response.status_code, response.content[:500]
+                )
+            )
+        return json.loads(response.content)
+
+    def seed_db(self, n_datapoints, n_messages):
+        """
+        Create test data through the API, this ensures the data is stored
+        in the same way as in production.
+        """
+        self.api_root = "/" + settings.ROOT_PATH + API_ROOT_PATH.rstrip("/")
+
+        datapoints = []
+        for i in range(n_datapoints):
+            datapoints.append(
+                {
+                    "origin": "benchmark",
+                    "origin_id": str(i),
+                    "type": "Sensor",
+                    "data_format": "Continuous Numeric",
+                }
+            )
+        datapoints = self.put("/datapoint/metadata/latest/", datapoints)
+        dp_ids = [str(datapoint["id"]) for datapoint in datapoints]
+
+        start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        times = [start + timedelta(minutes=15 * i) for i in range(n_messages)]
+
+        value_msgs = [
+            {"value": json.dumps(float(i)), "time": t.isoformat()}
+            for i, t in enumerate(times)
+        ]
+        schedule_msgs = [
+            {
+                "schedule": [
+                    {
+                        "from_timestamp": t.isoformat(),
+                        "to_timestamp": (t + timedelta(hours=1)).isoformat(),
+                        "value": json.dumps(21.0),
+                    }
+                ],
+                "time": t.isoformat(),
+            }
+            for t in times
+        ]
+        setpoint_msgs = [
+            {
+                "setpoint": [
+                    {
+                        "from_timestamp": t.isoformat(),
+                        "to_timestamp": (t + timedelta(hours=1)).isoformat(),
+                        "preferred_value": json.dumps(21.0),
+                        "acceptable_values": None,
+                        "min_value": 17.0,
+                        "max_value": 23.0,
+                    }
+                ],
+                "time": t.isoformat(),
+            }
+            for t in times
+        ]
+        forecast_msgs = [
+            {"mean": float(i), "time": t.isoformat()}
+            for i, t in enumerate(times)
+        ]
+
+        for msg_type, msgs in [
+            ("value", value_msgs),
+            ("schedule", schedule_msgs),
+            ("setpoint", setpoint_msgs),
+        ]:
+            self.put(
+                "/datapoint/{}/history/".format(msg_type),
+                {dp_id: msgs for dp_id in dp_ids},
+            )
+            if msgs:
+                self.put(
+                    "/datapoint/{}/latest/".format(msg_type),
+                    {dp_id: msgs[-1] for dp_id in dp_ids},
+                )
+
+        products = self.put(
+            "/product/latest/",
+            [
+                {
+                    "name": "Benchmark Product",
+                    "service_url": "http://example.com/product_service/v1/",
+                    "coverage_from": 0.0,
+                    "coverage_to": 86400.0,
+                }
+            ],
+        )
+        plants = self.put(
+            "/plant/latest/",
+            [{"name": "Benchmark Plant", "product_ids": [products[0]["id"]]}],
+        )
+        product_runs = self.put(
+            "/product_run/latest/",
+            [
+                {
+                    "product_id": products[0]["id"],
+                    "plant_ids": [plants[0]["id"]],
+                    "available_at": start.isoformat(),
+                    "coverage_from": start.isoformat(),
+                    "coverage_to": (start + timedelta(days=1)).isoformat(),
+                }
+            ],
+        )
+        self.product_run_id = str(product_runs[0]["id"])
+        self.put(
+            "/datapoint/forecast/latest/{}/".format(self.product_run_id),
+            {dp_id: forecast_msgs for dp_id in dp_ids},
+        )
+
+    def call_endpoint(self, method, path, query_params, body):
+        """
+        Call an endpoint once and read the full response.
+        """
+        if method == "get":
+            response = self.client.get(path, query_params)
+        else:
+            response = self.client.generic(
+                method.upper(),
+                path,
+                data=body,
+                content_type="application/json",
+            )
+        if response.streaming:
+            content = b"".join(response.streaming_content)
+        else:
+            content = response.content
+        return response.status_code, content
+
+    def benchmark_endpoints(self, repeat):
+        """
+        Call every GET and PUT endpoint of the API and record timings,
+        number of queries and peak memory.
+
+        PUT endpoints are called with the response of the GET endpoint with
+        the same path, i.e. the calls update the existing data.
+        """
+        results = []
+        schema_paths = api.get_openapi_schema()["paths"]
+        for schema_path, path_methods in schema_paths.items():
+            path = schema_path.replace("{id}", self.product_run_id)
+            query_params = {}
+            for path_end, extra_params in EXTRA_QUERY_PARAMS.items():
+                if schema_path.endswith(path_end):
+                    query_params = extra_params
+
+            body = None
+            if "put" in path_methods:
+                _, body = self.call_endpoint("get", path, {}, None)
+
+            for method in ["get", "put"]:
+                if method not in path_methods:
+                    continue
+
+                durations = []
+                status_codes = set()
+                for _ in range(repeat):
+                    start = perf_counter()
+                    status_code, content = self.call_endpoint(
+                        method, path, query_params, body
+                    )
+                    durations.append(perf_counter() - start)
+                    status_codes.add(status_code)
+
+                # Measure queries and memory in an extra call, as both
+                # slow down the request.
+                tracemalloc.start()
+                with CaptureQueriesContext(connection) as queries:
+                    self.call_endpoint(method, path, query_params, body)
+                _, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+                results.append(
+                    {
+                        "method": method.upper(),
+                        "path": schema_path,
+                        "status_codes": sorted(status_codes),
+                        "response_bytes": len(content),
+                        "duration_seconds": {
+                            "min": min(durations),
+                            "median": median(durations),
+                            "mean": mean(durations),
+                            "max": max(durations),
+                        },
+                        "queries": len(queries),
+                        "peak_memory_bytes": peak_memory,
+                    }
+                )
+                self.stderr.write(
+                    "{:4} {:60} {:8.4f} s {:5} queries".format(
+                        method.upper(),
+                        schema_path,
+                        median(durations),
+                        len(queries),
+                    )
+                )
+        return results
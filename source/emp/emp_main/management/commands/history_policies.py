@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Manage retention and compression of the history tables.
+
+Run with e.g.:
+    python manage.py history_policies --apply
+
+`--apply` sets the compression and retention policies of TimescaleDB as
+defined by the settings and must be run after these have been changed.
+`--delete-by-origin` deletes the messages of origins with a shorter retention
+period and should be run periodically, e.g. daily by cron. See
+`emp_main.history_policies` for details.
+"""
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from emp_main.history_policies import apply_policies
+from emp_main.history_policies import delete_by_origin
+
+
+class Command(BaseCommand):
+    help = "Apply retention and compression settings to the history tables."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--apply",
+            action="store_true",
+            help="Set the compression and retention policies of TimescaleDB.",
+        )
+        parser.add_argument(
+            "--delete-by-origin",
+            action="store_true",
+            help="Delete the messages older than the retention per origin.",
+        )
+
+    def handle(self, *args, **options):
+        if not (options["apply"] or options["delete_by_origin"]):
+            raise CommandError("Specify --apply or --delete-by-origin.")
+
+        try:
+            if options["apply"]:
+                if apply_policies():
+                    self.stdout.write("Applied history policies.")
+                else:
+                    self.stdout.write(
+                        "DB is not TimescaleDB, no policies applied."
+                    )
+            if options["delete_by_origin"]:
+                n_deleted_by_table = delete_by_origin()
+                for table_name, n_deleted in n_deleted_by_table.items():
+                    self.stdout.write(
+                        "Deleted {} {} messages.".format(n_deleted, table_name)
+                    )
+        except ValueError as e:
+            raise CommandError(str(e))
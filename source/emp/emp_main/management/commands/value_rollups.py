@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Manage the rollups (continuous aggregates) of the value history.
+
+Run with e.g.:
+    python manage.py value_rollups --create --refresh
+
+The rollups are created by the migrations already. Use `--refresh` to
+materialize the existing history at once after the rollups have been
+created, instead of waiting for the background policies of TimescaleDB.
+See `emp_main.rollups` for details.
+"""
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+
+from emp_main.rollups import VALUE_ROLLUPS
+from emp_main.rollups import get_retention_start
+from emp_main.rollups import reset_available_view_names
+
+
+class Command(BaseCommand):
+    help = "Create, refresh or drop the rollups of the value history."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--create",
+            action="store_true",
+            help="Create the rollups and their refresh policies if missing.",
+        )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            help=(
+                "Materialize the value history within the retention period "
+                "in all rollups."
+            ),
+        )
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Remove the rollups, requests use the raw values then.",
+        )
+
+    def handle(self, *args, **options):
+        if not (options["create"] or options["refresh"] or options["drop"]):
+            raise CommandError("Specify --create, --refresh or --drop.")
+        if options["drop"] and (options["create"] or options["refresh"]):
+            raise CommandError("--drop can't be combined with other actions.")
+        if connection.vendor != "postgresql":
+            raise CommandError("Rollups require TimescaleDB.")
+
+        # Refreshing buckets of which the raw values have been dropped by
+        # the retention policy would remove these buckets.
+        refresh_start = get_retention_start()
+
+        # Runs in autocommit mode, i.e. outside a transaction, which the
+        # statements of TimescaleDB require.
+        with connection.cursor() as cursor:
+            for rollup in VALUE_ROLLUPS:
+                if options["create"]:
+                    for sql in rollup.get_create_sql():
+                        cursor.execute(sql)
+                    self.stdout.write("Created {}".format(rollup.view_name))
+                if options["refresh"]:
+                    cursor.execute(rollup.get_refresh_sql(start=refresh_start))
+                    self.stdout.write("Refreshed {}".format(rollup.view_name))
+                if options["drop"]:
+                    cursor.execute(rollup.get_drop_sql())
+                    self.stdout.write("Dropped {}".format(rollup.view_name))
+        reset_available_view_names()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Write the messages of the write-behind queue to DB.
+
+Run with e.g.:
+    python manage.py write_behind_worker
+
+Required if `API_WRITE_BEHIND` is enabled, see `emp_main.write_behind`.
+The entrypoint starts one worker per container in that case.
+"""
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from emp_main.write_behind import WriteBehindWorker
+from emp_main.write_behind import is_enabled
+
+
+class Command(BaseCommand):
+    help = "Write the messages of the write-behind queue to DB."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum number of queued requests written at once.",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Write one batch and exit, e.g. to drain the queue.",
+        )
+
+    def handle(self, *args, **options):
+        if not is_enabled():
+            raise CommandError("Write-behind mode is not enabled.")
+
+        worker = WriteBehindWorker(batch_size=options["batch_size"])
+        if options["once"]:
+            n_entries = worker.run_once(block_ms=0)
+            self.stdout.write("Wrote {} queued requests.".format(n_entries))
+        else:
+            worker.run_forever()
@@ -0,0 +1,132 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def timescaledb_available(schema_editor):
+    """
+    The rollups are continuous aggregates, which require TimescaleDB.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return False
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'"
+        )
+        return cursor.fetchone() is not None
+
+
+# The statements of `emp_main.rollups.ValueRollup` at the time of this
+# migration, copied as later changes of the rollups must not change what
+# this migration does.
+ROLLUPS = [
+    # (view name, bucket width, policy schedule interval) in seconds.
+    ('emp_main_valuemessage_rollup_minute', 60, 60),
+    ('emp_main_valuemessage_rollup_hour', 3600, 600),
+    ('emp_main_valuemessage_rollup_day', 86400, 3600),
+]
+
+CREATE_VIEW_SQL = (
+    "CREATE MATERIALIZED VIEW IF NOT EXISTS {view_name} "
+    "WITH (timescaledb.continuous, "
+    "timescaledb.materialized_only = false) AS "
+    "SELECT time_bucket(INTERVAL '{bucket_width} seconds', time) "
+    "AS bucket, "
+    "datapoint_id, "
+    "sum(_value_float) AS sum_value, "
+    "count(_value_float) AS count_value, "
+    "min(_value_float) AS min_value, "
+    "max(_value_float) AS max_value "
+    "FROM emp_main_valuemessage "
+    "GROUP BY bucket, datapoint_id "
+    "WITH NO DATA"
+)
+
+ADD_POLICY_SQL = (
+    "SELECT add_continuous_aggregate_policy('{view_name}', "
+    "start_offset => INTERVAL '604800 seconds', "
+    "end_offset => INTERVAL '{bucket_width} seconds', "
+    "schedule_interval => INTERVAL '{schedule_interval} seconds', "
+    "if_not_exists => true)"
+)
+
+DROP_VIEW_SQL = "DROP MATERIALIZED VIEW IF EXISTS {view_name}"
+
+
+def create_rollups(apps, schema_editor):
+    if not timescaledb_available(schema_editor):
+        return
+    for view_name, bucket_width, schedule_interval in ROLLUPS:
+        for sql in [CREATE_VIEW_SQL, ADD_POLICY_SQL]:
+            schema_editor.execute(
+                sql.format(
+                    view_name=view_name,
+                    bucket_width=bucket_width,
+                    schedule_interval=schedule_interval,
+                )
+            )
+
+
+def drop_rollups(apps, schema_editor):
+    if not timescaledb_available(schema_editor):
+        return
+    for view_name, _, _ in ROLLUPS:
+        schema_editor.execute(DROP_VIEW_SQL.format(view_name=view_name))
+
+
+class Migration(migrations.Migration):
+
+    # Continuous aggregates can't be created inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('emp_main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValueMessageRollupDay',
+            fields=[
+                ('bucket', models.DateTimeField(help_text='The start of the time bucket.', primary_key=True, serialize=False)),
+                ('sum_value', models.FloatField(help_text='The sum of the values in the bucket.', null=True)),
+                ('count_value', models.BigIntegerField(help_text='The number of (not null) values in the bucket.')),
+                ('min_value', models.FloatField(help_text='The smallest value in the bucket.', null=True)),
+                ('max_value', models.FloatField(help_text='The largest value in the bucket.', null=True)),
+                ('datapoint', models.ForeignKey(db_constraint=False, help_text='The datapoint that the aggregated values belong to.', on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='emp_main.datapoint')),
+            ],
+            options={
+                'db_table': 'emp_main_valuemessage_rollup_day',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ValueMessageRollupHour',
+            fields=[
+                ('bucket', models.DateTimeField(help_text='The start of the time bucket.', primary_key=True, serialize=False)),
+                ('sum_value', models.FloatField(help_text='The sum of the values in the bucket.', null=True)),
+                ('count_value', models.BigIntegerField(help_text='The number of (not null) values in the bucket.')),
+                ('min_value', models.FloatField(help_text='The smallest value in the bucket.', null=True)),
+                ('max_value', models.FloatField(help_text='The largest value in the bucket.', null=True)),
+                ('datapoint', models.ForeignKey(db_constraint=False, help_text='The datapoint that the aggregated values belong to.', on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='emp_main.datapoint')),
+            ],
+            options={
+                'db_table': 'emp_main_valuemessage_rollup_hour',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ValueMessageRollupMinute',
+            fields=[
+                ('bucket', models.DateTimeField(help_text='The start of the time bucket.', primary_key=True, serialize=False)),
+                ('sum_value', models.FloatField(help_text='The sum of the values in the bucket.', null=True)),
+                ('count_value', models.BigIntegerField(help_text='The number of (not null) values in the bucket.')),
+                ('min_value', models.FloatField(help_text='The smallest value in the bucket.', null=True)),
+                ('max_value', models.FloatField(help_text='The largest value in the bucket.', null=True)),
+                ('datapoint', models.ForeignKey(db_constraint=False, help_text='The datapoint that the aggregated values belong to.', on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='emp_main.datapoint')),
+            ],
+            options={
+                'db_table': 'emp_main_valuemessage_rollup_minute',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_rollups, drop_rollups),
+    ]
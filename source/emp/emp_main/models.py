@@ -260,3 +260,69 @@ class ForecastMessage(ForecastMessageTemplate):
         related_name="forecast_messages",
         help_text=("The product run that has generated the forecast message."),
     )
+
+
+class ValueMessageRollupTemplate(models.Model):
+    """
+    Aggregates of the numeric values of `ValueMessage` per datapoint and time
+    bucket. The rows are maintained by TimescaleDB as continuous aggregate,
+    see `emp_main.rollups`, hence the subclasses are not managed by Django.
+    """
+
+    class Meta:
+        abstract = True
+
+    # Not unique, but Django needs a primary key. The views are only read
+    # with `values()`.
+    bucket = models.DateTimeField(
+        primary_key=True, help_text=("The start of the time bucket."),
+    )
+    datapoint = models.ForeignKey(
+        Datapoint,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="+",
+        help_text=("The datapoint that the aggregated values belong to."),
+    )
+    sum_value = models.FloatField(
+        null=True, help_text=("The sum of the values in the bucket."),
+    )
+    count_value = models.BigIntegerField(
+        help_text=("The number of (not null) values in the bucket."),
+    )
+    min_value = models.FloatField(
+        null=True, help_text=("The smallest value in the bucket."),
+    )
+    max_value = models.FloatField(
+        null=True, help_text=("The largest value in the bucket."),
+    )
+
+
+class ValueMessageRollupMinute(ValueMessageRollupTemplate):
+    """
+    `ValueMessage` aggregated in buckets of one minute.
+    """
+
+    class Meta:
+        managed = False
+        db_table = "emp_main_valuemessage_rollup_minute"
+
+
+class ValueMessageRollupHour(ValueMessageRollupTemplate):
+    """
+    `ValueMessage` aggregated in buckets of one hour.
+    """
+
+    class Meta:
+        managed = False
+        db_table = "emp_main_valuemessage_rollup_hour"
+
+
+class ValueMessageRollupDay(ValueMessageRollupTemplate):
+    """
+    `ValueMessage` aggregated in buckets of one day.
+    """
+
+    class Meta:
+        managed = False
+        db_table = "emp_main_valuemessage_rollup_day"
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Bulk variants of the permission checks of guardian.
+
+guardian's `get_objects_for_user` issues several queries per call, which adds
+up if the permitted objects are computed for every user, as `EmpAppsCache`
+does. The functions here answer the same question for many users at once
+with a constant number of grouped queries.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.db.models import Q
+from guardian.utils import get_group_obj_perms_model
+from guardian.utils import get_user_obj_perms_model
+
+
+def get_objects_for_users(users, perm, queryset):
+    """
+    Like `guardian.shortcuts.get_objects_for_user` but for many users.
+
+    A user is granted access to an object if the user is a superuser, if the
+    user is active and has the global permission (directly or by group), or
+    if the user has the object permission (directly or by group).
+
+    Arguments:
+    ----------
+    users: list of django.contrib.auth.models.User
+        The users to compute the objects for.
+    perm: str
+        The permission as `app_label.codename`, e.g.
+        `emp_demo_ui_app.view_demoapppage`.
+    queryset: django.db.models.QuerySet
+        All objects that should be considered, the returned objects keep the
+        order of the queryset.
+
+    Returns:
+    --------
+    objects_by_user_pk: dict
+        The list of permitted objects with the primary key of the users
+        as keys.
+    """
+    app_label, codename = perm.split(".")
+    permission = Permission.objects.get(
+        content_type__app_label=app_label, codename=codename
+    )
+    user_pks = [user.pk for user in users]
+
+    # Users that have access to every object.
+    all_objects_user_pks = {user.pk for user in users if user.is_superuser}
+    global_perm_user_pks = (
+        get_user_model()
+        .objects.filter(pk__in=user_pks, is_active=True)
+        .filter(
+            Q(user_permissions=permission) | Q(groups__permissions=permission)
+        )
+        .values_list("pk", flat=True)
+    )
+    all_objects_user_pks.update(global_perm_user_pks)
+
+    # The object permissions, note that object_pk is stored as string.
+    object_pks_by_user_pk = {user_pk: set() for user_pk in user_pks}
+    user_obj_perms = (
+        get_user_obj_perms_model()
+        .objects.filter(permission=permission, user__in=user_pks)
+        .values_list("user", "object_pk")
+    )
+    group_obj_perms = (
+        get_group_obj_perms_model()
+        .objects.filter(permission=permission, group__user__in=user_pks)
+        .values_list("group__user", "object_pk")
+    )
+    for user_pk, object_pk in list(user_obj_perms) + list(group_obj_perms):
+        object_pks_by_user_pk[user_pk].add(object_pk)
+
+    objects = list(queryset)
+    objects_by_user_pk = {}
+    for user_pk in user_pks:
+        if user_pk in all_objects_user_pks:
+            objects_by_user_pk[user_pk] = list(objects)
+            continue
+        object_pks = object_pks_by_user_pk[user_pk]
+        objects_by_user_pk[user_pk] = [
+            obj for obj in objects if str(obj.pk) in object_pks
+        ]
+    return objects_by_user_pk
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""
+Rollups, i.e. TimescaleDB continuous aggregates, of the value history.
+
+Requests for aggregated values (like `/datapoint/value/history/at_interval/`
+or the charts of the evaluation system) would otherwise scan all raw rows of
+`ValueMessage` in the requested time range. The rollups store the sum, count,
+min and max of the numeric values per datapoint and bucket, from which the
+aggregates of any coarser bucket can be computed. TimescaleDB refreshes the
+rollups in background (see `ValueRollup.policy_schedule_interval`) and
+combines the materialized rows with the latest raw rows on read
+(real-time aggregation).
+
+The refresh policies only cover the recent past. Values written for older
+times (e.g. by a history upload) trigger a refresh of the affected buckets
+after the commit, see `refresh_after_commit`.
+
+The rollups are created by a migration if the DB is TimescaleDB, use the
+`value_rollups` management command to create, refresh or drop them manually.
+"""
+import logging
+import re
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from time import monotonic
+
+from django.conf import settings
+from django.db import connection
+from django.db import transaction
+from django.db.models import F
+from django.db.models import FloatField
+from django.db.models import Max
+from django.db.models import Min
+from django.db.models import Sum
+from django.db.models import Value
+from django.db.models.functions import Cast
+from django.db.models.functions import NullIf
+from timescale.db.models.expressions import TimeBucket
+
+from .models import ValueMessage
+from .models import ValueMessageRollupMinute
+from .models import ValueMessageRollupHour
+from .models import ValueMessageRollupDay
+
+logger = logging.getLogger(__name__)
+
+
+class ValueRollup:
+    """
+    The definition of one continuous aggregate over `ValueMessage`.
+
+    Arguments:
+    ----------
+    model: ValueMessageRollupTemplate subclass
+        The unmanaged model to read the continuous aggregate.
+    bucket_width: datetime.timedelta
+        The width of the buckets of the continuous aggregate.
+    policy_schedule_interval: datetime.timedelta
+        How often TimescaleDB refreshes the continuous aggregate.
+    policy_start_offset: datetime.timedelta
+        How far back TimescaleDB refreshes the continuous aggregate. Must be
+        shorter than the retention period of the value history.
+    """
+
+    def __init__(
+        self, model, bucket_width, policy_schedule_interval, policy_start_offset
+    ):
+        self.model = model
+        self.bucket_width = bucket_width
+        self.policy_schedule_interval = policy_schedule_interval
+        self.policy_start_offset = policy_start_offset
+
+    @property
+    def view_name(self):
+        return self.model._meta.db_table
+
+    def get_create_sql(self):
+        """
+        Return the statements that create the continuous aggregate and its
+        refresh policy, if these don't exist yet.
+
+        The refresh policy covers the last `policy_start_offset`. This is
+        cheap as TimescaleDB only recomputes buckets in which raw rows have
+        changed. The window is bounded as refreshing buckets of which the
+        raw rows have been dropped by the retention policy (see
+        `emp_main.history_policies`) would remove these buckets too. Values
+        written for older times are handled by `refresh_after_commit`.
+        """
+        create_view_sql = (
+            "CREATE MATERIALIZED VIEW IF NOT EXISTS {view_name} "
+            "WITH (timescaledb.continuous, "
+            "timescaledb.materialized_only = false) AS "
+            "SELECT time_bucket(INTERVAL '{bucket_width} seconds', time) "
+            "AS bucket, "
+            "datapoint_id, "
+            "sum(_value_float) AS sum_value, "
+            "count(_value_float) AS count_value, "
+            "min(_value_float) AS min_value, "
+            "max(_value_float) AS max_value "
+            "FROM {hypertable} "
+            "GROUP BY bucket, datapoint_id "
+            "WITH NO DATA"
+        ).format(
+            view_name=self.view_name,
+            bucket_width=int(self.bucket_width.total_seconds()),
+            hypertable=ValueMessage._meta.db_table,
+        )
+        add_policy_sql = (
+            "SELECT add_continuous_aggregate_policy('{view_name}', "
+            "start_offset => INTERVAL '{start_offset} seconds', "
+            "end_offset => INTERVAL '{bucket_width} seconds', "
+            "schedule_interval => INTERVAL '{schedule_interval} seconds', "
+            "if_not_exists => true)"
+        ).format(
+            view_name=self.view_name,
+            start_offset=int(self.policy_start_offset.total_seconds()),
+            bucket_width=int(self.bucket_width.total_seconds()),
+            schedule_interval=int(
+                self.policy_schedule_interval.total_seconds()
+            ),
+        )
+        return [create_view_sql, add_policy_sql]
+
+    def get_refresh_sql(self, start=None, end=None):
+        """
+        Return the statement that refreshes the continuous aggregate.
+        Must not be executed inside a transaction.
+
+        Arguments:
+        ----------
+        start: datetime.datetime or None
+            Refresh the buckets from this time on, which must be within the
+            retention period of the value history. Refreshes from the first
+            value on if None.
+        end: datetime.datetime or None
+            Refresh the buckets before this time. Refreshes up to the last
+            value if None.
+        """
+
+        def to_sql(time):
+            if time is None:
+                return "NULL"
+            return "'{}'::timestamptz".format(time.isoformat())
+
+        return "CALL refresh_continuous_aggregate('{}', {}, {})".format(
+            self.view_name, to_sql(start), to_sql(end)
+        )
+
+    def get_bucket_start(self, time):
+        """
+        Return the start of the bucket that contains `time`.
+        """
+        since_epoch = time - datetime(1970, 1, 1, tzinfo=timezone.utc)
+        return time - since_epoch % self.bucket_width
+
+    def get_drop_sql(self):
+        """
+        Return the statement that removes the continuous aggregate and its
+        policy.
+        """
+        return "DROP MATERIALIZED VIEW IF EXISTS {}".format(self.view_name)
+
+
+# Finest first.
+VALUE_ROLLUPS = [
+    ValueRollup(
+        model=ValueMessageRollupMinute,
+        bucket_width=timedelta(minutes=1),
+        policy_schedule_interval=timedelta(minutes=1),
+        policy_start_offset=timedelta(days=7),
+    ),
+    ValueRollup(
+        model=ValueMessageRollupHour,
+        bucket_width=timedelta(hours=1),
+        policy_schedule_interval=timedelta(minutes=10),
+        policy_start_offset=timedelta(days=7),
+    ),
+    ValueRollup(
+        model=ValueMessageRollupDay,
+        bucket_width=timedelta(days=1),
+        policy_schedule_interval=timedelta(hours=1),
+        policy_start_offset=timedelta(days=7),
+    ),
+]
+
+# How to compute the aggregations of `TimeBucketParams` from the rollups.
+ROLLUP_AGGREGATIONS = {
+    # Like `Avg`, yields null for buckets without numeric values.
+    "Avg": lambda: (
+        Sum("sum_value")
+        / NullIf(Cast(Sum("count_value"), FloatField()), Value(0.0))
+    ),
+    "Sum": lambda: Sum("sum_value"),
+    "Count": lambda: Sum("count_value"),
+    "Min": lambda: Min("min_value"),
+    "Max": lambda: Max("max_value"),
+}
+
+# The name of the requested buckets computed from the rollups, which differs
+# from `bucket` of the raw rows as the rollups have a `bucket` field already.
+ROLLUP_BUCKET_NAME = "rollup_bucket"
+
+# The filters of the raw rows that can be applied to the buckets, if the
+# filter value is aligned to the bucket width.
+ROLLUP_FILTERS = {"time__gte": "bucket__gte", "time__lt": "bucket__lt"}
+
+# Lengths of the units PostgreSQL accepts in intervals. Months and years
+# have no fixed length but start at a full day, like the buckets of
+# `time_bucket`, which are aligned to midnight for all widths up to a day.
+INTERVAL_UNIT_SECONDS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+    "week": 7 * 86400,
+}
+INTERVAL_UNITS_DAY_ALIGNED = {"month", "year"}
+INTERVAL_PATTERN = re.compile(r"^\s*(\d+)\s*([a-z]+?)s?\s*$")
+
+# Checking the DB for rollups on every request would cost one query.
+AVAILABLE_ROLLUPS_CHECK_INTERVAL = 300
+_available_view_names = None
+_available_view_names_checked_at = None
+
+
+def get_available_view_names():
+    """
+    Return the names of the rollups that exist in the DB.
+
+    Returns:
+    --------
+    view_names: set of str
+        Empty if the DB is not TimescaleDB.
+    """
+    global _available_view_names
+    global _available_view_names_checked_at
+
+    now = monotonic()
+    if (
+        _available_view_names_checked_at is not None
+        and now - _available_view_names_checked_at
+        < AVAILABLE_ROLLUPS_CHECK_INTERVAL
+    ):
+        return _available_view_names
+
+    view_names = set()
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'"
+            )
+            if cursor.fetchone() is not None:
+                cursor.execute(
+                    "SELECT view_name FROM "
+                    "timescaledb_information.continuous_aggregates"
+                )
+                view_names = {row[0] for row in cursor.fetchall()}
+
+    _available_view_names = view_names
+    _available_view_names_checked_at = now
+    return view_names
+
+
+def reset_available_view_names():
+    """
+    Force `get_available_view_names` to check the DB again.
+    """
+    global _available_view_names_checked_at
+    _available_view_names_checked_at = None
+
+
+def get_retention_start():
+    """
+    Return the time before which the value history is dropped by the
+    retention policy, None if the history is kept forever.
+    """
+    retention_days = settings.HISTORY_RETENTION_DAYS.get("value")
+    if not retention_days:
+        return None
+    return datetime.now(tz=timezone.utc) - timedelta(days=retention_days)
+
+
+def refresh_rollups(rollups_to_refresh, start, end):
+    """
+    Refresh the buckets of the rollups that contain the times from `start`
+    to `end` (inclusive). Must not be executed inside a transaction.
+    """
+    # Buckets before the retention start would be removed, see
+    # `ValueRollup.get_create_sql`.
+    retention_start = get_retention_start()
+    with connection.cursor() as cursor:
+        for rollup in rollups_to_refresh:
+            window_start = rollup.get_bucket_start(start)
+            window_end = rollup.get_bucket_start(end) + rollup.bucket_width
+            if retention_start is not None:
+                retention_bucket_start = rollup.get_bucket_start(
+                    retention_start
+                )
+                window_start = max(
+                    window_start, retention_bucket_start + rollup.bucket_width
+                )
+            if window_start >= window_end:
+                continue
+            cursor.execute(
+                rollup.get_refresh_sql(start=window_start, end=window_end)
+            )
+
+
+def refresh_after_commit(times):
+    """
+    Refresh the rollups for values written to the history, after the
+    current transaction has been committed.
+
+    Only rollups are refreshed for which any of the times is older than the
+    window of their refresh policy, TimescaleDB refreshes the others.
+
+    Arguments:
+    ----------
+    times: iterable of datetime.datetime
+        The times of the written values.
+    """
+    times = list(times)
+    if not times:
+        return
+    available_view_names = get_available_view_names()
+    if not available_view_names:
+        return
+
+    start = min(times)
+    end = max(times)
+    now = datetime.now(tz=timezone.utc)
+    rollups_to_refresh = [
+        rollup
+        for rollup in VALUE_ROLLUPS
+        if rollup.view_name in available_view_names
+        and start < now - rollup.policy_start_offset
+    ]
+    if not rollups_to_refresh:
+        return
+
+    def refresh():
+        try:
+            refresh_rollups(rollups_to_refresh, start=start, end=end)
+        except Exception:
+            # The values have been written anyway. The rollups are fixed by
+            # running the `value_rollups --refresh` command.
+            logger.exception(
+                "Failed to refresh the rollups from %s to %s.", start, end
+            )
+
+    transaction.on_commit(refresh)
+
+
+def parse_interval(interval):
+    """
+    Parse simple PostgreSQL intervals like `15 minutes` or `1 month`.
+
+    Returns:
+    --------
+    count: int or None
+        The number of units, e.g. `15`. None if the interval is not simple.
+    unit: str or None
+        The singular unit, e.g. `minute`.
+    """
+    match = INTERVAL_PATTERN.match(str(interval).lower())
+    if match is None:
+        return None, None
+    count, unit = match.groups()
+    if unit not in INTERVAL_UNIT_SECONDS and (
+        unit not in INTERVAL_UNITS_DAY_ALIGNED
+    ):
+        return None, None
+    return int(count), unit
+
+
+def is_aligned(value, bucket_width):
+    """
+    Check if a filter value is at the start of a bucket.
+    """
+    if not isinstance(value, datetime) or value.tzinfo is None:
+        return False
+    since_epoch = value - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return since_epoch % bucket_width == timedelta(0)
+
+
+def get_rollup(interval, aggregation, active_filters):
+    """
+    Return the coarsest rollup that yields the same result as aggregating
+    the raw rows.
+
+    That is the case if the requested interval is a multiple of the bucket
+    width of the rollup and if all filters can be applied to the buckets.
+
+    Arguments:
+    ----------
+    interval: str
+        The interval of the requested buckets, e.g. `1 hour`.
+    aggregation: str
+        The requested aggregation, e.g. `Avg`.
+    active_filters: dict
+        The filters for the raw rows, as returned by
+        `GenericAPIView.build_active_filter_dict`.
+
+    Returns:
+    --------
+    rollup: ValueRollup or None
+        None if the raw rows must be used.
+    """
+    if aggregation not in ROLLUP_AGGREGATIONS:
+        return None
+    if any(f not in ROLLUP_FILTERS for f in active_filters):
+        return None
+    count, unit = parse_interval(interval)
+    if count is None:
+        return None
+
+    available_view_names = get_available_view_names()
+    for rollup in reversed(VALUE_ROLLUPS):
+        if rollup.view_name not in available_view_names:
+            continue
+        if unit in INTERVAL_UNITS_DAY_ALIGNED:
+            if rollup.bucket_width > timedelta(days=1):
+                continue
+        else:
+            interval_width = timedelta(
+                seconds=count * INTERVAL_UNIT_SECONDS[unit]
+            )
+            if interval_width % rollup.bucket_width != timedelta(0):
+                continue
+        if not all(
+            is_aligned(v, rollup.bucket_width) for v in active_filters.values()
+        ):
+            continue
+        return rollup
+    return None
+
+
+def get_rollup_queryset(rollup, datapoints, interval, filters):
+    """
+    Return the aggregated values from a rollup in the same format as
+    `TimescaleQuerySet.time_bucket` followed by the aggregation would
+    return these from the raw rows.
+
+    Arguments:
+    ----------
+    rollup: ValueRollup
+        As returned by `get_rollup`.
+    datapoints: django.db.models.QuerySet
+        The datapoints to return values for.
+    interval: str
+        The interval of the requested buckets, e.g. `1 hour`.
+    filters: dict
+        The filters for the raw rows, see `get_rollup`.
+
+    Returns:
+    --------
+    bucketed: django.db.models.QuerySet
+        Of dicts with `rollup_bucket` (see `ROLLUP_BUCKET_NAME`) instead of
+        `bucket` and, after `annotate_rollup_value`, `value` and
+        `datapoint_id`.
+    """
+    rollup_filters = {ROLLUP_FILTERS[f]: v for f, v in filters.items()}
+    rows = rollup.model.objects.filter(datapoint__in=datapoints)
+    rows = rows.filter(**rollup_filters)
+    return rows.values(**{ROLLUP_BUCKET_NAME: TimeBucket("bucket", interval)})
+
+
+def annotate_rollup_value(bucketed, aggregation):
+    """
+    Add the aggregated `value` and the `datapoint_id` to the rows of
+    `get_rollup_queryset`.
+    """
+    return bucketed.annotate(
+        value=ROLLUP_AGGREGATIONS[aggregation](),
+        datapoint_id=F("datapoint__id"),
+    )
@@ -2,7 +2,7 @@ from django.conf import settings
 from django.urls import path
 
 from .urls import API_ROOT_PATH
-from .consumers import DatapointRelatedLatestConsumer
+from .consumers import AsyncDatapointRelatedLatestConsumer
 
 WS_ROOT_PATH = settings.ROOT_PATH
 
@@ -10,10 +10,10 @@ WS_ROOT_PATH = settings.ROOT_PATH
 websocket_urlpatterns = [
     path(
         WS_ROOT_PATH + "ws/datapoint-update/",
-        DatapointRelatedLatestConsumer.as_asgi(),
+        AsyncDatapointRelatedLatestConsumer.as_asgi(),
     ),
     path(
         WS_ROOT_PATH + "ws/" + API_ROOT_PATH + "datapoint/<msg_type>/latest/",
-        DatapointRelatedLatestConsumer.as_asgi(),
+        AsyncDatapointRelatedLatestConsumer.as_asgi(),
     ),
 ]
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Fast JSON serialization for the responses of the REST API.
+
+The pydantic models of esg define the format of the API, but converting DB
+rows to pydantic objects (with `construct_recursive`) and these to JSON
+(with `.json()`) is slow for large responses. The serializers here take the
+rows as loaded from DB (i.e. the dicts returned by `QuerySet.values()`),
+apply the few conversions the pydantic models would apply, and encode the
+result to bytes with orjson.
+
+The generated JSON is equivalent to the pydantic output, i.e. it contains
+the same items in the same order. It only differs in whitespace, as orjson
+generates compact JSON and doesn't escape non ASCII characters, and in the
+exponent of floats, which orjson writes without `+` and leading zeros
+(e.g. `1e16` and `1e-7` instead of `1e+16` and `1e-07`).
+"""
+from datetime import timedelta
+import json
+
+import orjson
+
+
+def _default(obj):
+    """
+    Encode types unknown to orjson like pydantic does.
+    """
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    raise TypeError
+
+
+def dumps(obj):
+    """
+    Encode an object, which has been prepared with `RowSerializer.convert`,
+    to JSON bytes.
+    """
+    return orjson.dumps(obj, default=_default)
+
+
+def json_field(value):
+    """
+    Convert the value of a pydantic `Json` field, which is a JSON encoded
+    string on the wire.
+    """
+    return json.dumps(value)
+
+
+def json_list_field(values):
+    """
+    Like `json_field` but for an optional list of `Json` items.
+    """
+    if values is None:
+        return None
+    return [json.dumps(value) for value in values]
+
+
+def schedule_field(schedule):
+    """
+    Convert the items of a schedule.
+    """
+    schedule_converted = []
+    for item in schedule:
+        schedule_converted.append(
+            {
+                "from_timestamp": item.get("from_timestamp"),
+                "to_timestamp": item.get("to_timestamp"),
+                "value": json_field(item.get("value")),
+            }
+        )
+    return schedule_converted
+
+
+def setpoint_field(setpoint):
+    """
+    Convert the items of a setpoint.
+    """
+    setpoint_converted = []
+    for item in setpoint:
+        setpoint_converted.append(
+            {
+                "from_timestamp": item.get("from_timestamp"),
+                "to_timestamp": item.get("to_timestamp"),
+                "preferred_value": json_field(item.get("preferred_value")),
+                "acceptable_values": json_list_field(
+                    item.get("acceptable_values")
+                ),
+                "min_value": item.get("min_value"),
+                "max_value": item.get("max_value"),
+            }
+        )
+    return setpoint_converted
+
+
+class RowSerializer:
+    """
+    Converts the rows of one model into the format of the pydantic model.
+
+    Arguments:
+    ----------
+    field_converters: dict
+        Maps field names to functions that convert the value loaded from DB
+        to a value orjson can encode in the format of the pydantic model.
+        Fields not listed here are encoded as they are.
+    """
+
+    def __init__(self, field_converters=None):
+        self.field_converters = field_converters or {}
+
+    def convert(self, row):
+        """
+        Convert a single row in place and return it.
+        """
+        for field_name, field_converter in self.field_converters.items():
+            if field_name in row:
+                row[field_name] = field_converter(row[field_name])
+        return row
+
+    def dumps(self, row):
+        """
+        Convert a single row and encode it to JSON bytes.
+        """
+        return dumps(self.convert(row))
+
+
+datapoint_serializer = RowSerializer({"allowed_values": json_list_field})
+value_message_serializer = RowSerializer({"value": json_field})
+schedule_message_serializer = RowSerializer({"schedule": schedule_field})
+setpoint_message_serializer = RowSerializer({"setpoint": setpoint_field})
+forecast_message_serializer = RowSerializer()
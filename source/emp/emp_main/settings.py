@@ -164,6 +164,27 @@ else:
         "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}
     }
 
+# Configure the cache, which is used e.g. for the latest messages of the
+# datapoints. As with the channel layer, Redis must be used in production
+# as the cache must be shared by all workers.
+if os.getenv("CHANNELS_REDIS_HOST"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": "redis://{}:{}/{}".format(
+                os.getenv("CHANNELS_REDIS_HOST"),
+                int(os.getenv("CHANNELS_REDIS_PORT") or 6379),
+                int(os.getenv("EMP_CACHE_REDIS_DB") or 1),
+            ),
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache"
+        }
+    }
+
 # This is just here to silence some warnings and make explicit what
 # django < 3.2 has always done. See:
 # https://docs.djangoproject.com/en/3.2/ref/settings/#std:setting-DEFAULT_AUTO_FIELD
@@ -333,5 +354,82 @@ LOGOUT_PAGE_URL = (
     or "/" + ROOT_PATH + "auth/logout/?next=%s" % HOME_PAGE_URL
 )
 
+# The maximum number of items returned by a single call to one of the list
+# endpoints of the REST API. Clients must fetch larger results in several
+# pages, see the `cursor` query parameter of these endpoints.
+API_MAX_PAGE_SIZE = int(os.getenv("EMP_API_MAX_PAGE_SIZE") or 100000)
+
+# Seconds the latest messages of datapoints are kept in the cache. The
+# cache is updated on every write, the timeout only limits how long stale
+# entries may survive changes that bypass the REST API (e.g. in the admin).
+# Set to 0 to disable the cache.
+API_LATEST_CACHE_TIMEOUT = int(
+    os.getenv("EMP_API_LATEST_CACHE_TIMEOUT") or 300
+)
+
+# PUTs of at least this many history messages are written with `COPY`
+# through a staging table if the DB is PostgreSQL, which is much faster for
+# large backfills (see `emp_main.ingest`). Set to 0 to disable.
+API_COPY_INGEST_MIN_ITEMS = int(
+    os.getenv("EMP_API_COPY_INGEST_MIN_ITEMS") or 1000
+)
+
+# If true, PUTs to the latest endpoints (values, schedules and setpoints)
+# append the messages to a queue in Redis and return without writing to DB,
+# which is done by the `write_behind_worker` management command in batches.
+# Requires Redis as cache, see `emp_main.write_behind`.
+API_WRITE_BEHIND = (
+    os.getenv("EMP_API_WRITE_BEHIND") or "FALSE"
+).lower() == "true"
+
+# When PUTs respond in write-behind mode. `enqueued`: once the messages are
+# stored in the queue. `persisted`: once the messages have been written to
+# DB, but at most after `API_WRITE_BEHIND_ACK_TIMEOUT` seconds.
+API_WRITE_BEHIND_ACK = os.getenv("EMP_API_WRITE_BEHIND_ACK") or "enqueued"
+if API_WRITE_BEHIND_ACK not in ["enqueued", "persisted"]:
+    raise ValueError(
+        "EMP_API_WRITE_BEHIND_ACK must be `enqueued` or `persisted`."
+    )
+API_WRITE_BEHIND_ACK_TIMEOUT = float(
+    os.getenv("EMP_API_WRITE_BEHIND_ACK_TIMEOUT") or 10
+)
+
+# Seconds after which queue entries delivered to a write-behind worker but
+# not acknowledged are taken over by another worker. Must be longer than
+# writing a batch to DB takes.
+API_WRITE_BEHIND_CLAIM_AFTER = float(
+    os.getenv("EMP_API_WRITE_BEHIND_CLAIM_AFTER") or 60
+)
+
+# Seconds the user specific objects of `emp_main.apps.EmpAppsCache` (nav
+# content, allowed URLs and datapoints) are kept in the cache. Changes of
+# object permissions, group memberships and pages invalidate the cache
+# immediately, the timeout only limits how long other changes (e.g. of the
+# superuser status) may remain unnoticed.
+APPS_CACHE_TIMEOUT = int(os.getenv("EMP_APPS_CACHE_TIMEOUT") or 3600)
+
+# Days after which the messages of the history tables are deleted, with the
+# table names (`value`, `schedule`, `setpoint`, `forecast`) as keys, e.g.
+# `{"value": 730}`. Tables not listed are kept forever. Requires TimescaleDB.
+# Run `manage.py history_policies --apply` after changing this setting.
+HISTORY_RETENTION_DAYS = json.loads(
+    os.getenv("EMP_HISTORY_RETENTION_DAYS") or "{}"
+)
+
+# Like `HISTORY_RETENTION_DAYS` but only for the datapoints of one origin,
+# e.g. `{"bemcom": {"value": 90}}`. These messages are deleted by
+# `manage.py history_policies --delete-by-origin`, which must be run
+# periodically.
+HISTORY_RETENTION_DAYS_BY_ORIGIN = json.loads(
+    os.getenv("EMP_HISTORY_RETENTION_DAYS_BY_ORIGIN") or "{}"
+)
+
+# Days after which the chunks of all history tables are compressed by
+# TimescaleDB. Set to 0 to disable compression. Run
+# `manage.py history_policies --apply` after changing this setting.
+HISTORY_COMPRESS_AFTER_DAYS = int(
+    os.getenv("EMP_HISTORY_COMPRESS_AFTER_DAYS") or 0
+)
+
 # EPM evaluation page update interval in milliseconds
 # EMP_EVALUATION_PAGE_UPDATE_INTERVAL = 60000
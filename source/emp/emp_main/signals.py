@@ -1,7 +1,15 @@
 import logging
+from django.apps import apps
+from django.conf import settings
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
 from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from guardian.utils import get_group_obj_perms_model
+from guardian.utils import get_user_obj_perms_model
 
 from .apps import EmpAppsCache
 
@@ -31,3 +39,63 @@ def update_user_permissions(sender, **kwargs):
     apps_cache = EmpAppsCache.get_instance()
     apps_cache.update_for_user(user=anon)
     apps_cache.update_for_user(user=user)
+
+
+def invalidate_apps_cache_on_change(sender, **kwargs):
+    """
+    Invalidate EmpAppsCache for all users after object permissions or
+    models of the EMP apps (like pages or the widgets of the pages) changed.
+
+    The receiver is connected to these models by
+    `connect_invalidate_apps_cache_on_change`.
+
+    NOTE: Guardian's `assign_perm` creates the object permissions with
+          `bulk_create` if called with a queryset of objects or a list of
+          users or groups, which doesn't send `post_save`. Code granting
+          permissions in bulk must hence call
+          `EmpAppsCache.get_instance().invalidate()` afterwards. The same
+          applies to `QuerySet.update` and `QuerySet.delete` of the object
+          permission models, which bypass the signals too.
+    """
+    logger.debug("Signal invalidate_apps_cache_on_change called by %s", sender)
+
+    EmpAppsCache.get_instance().invalidate()
+
+
+def connect_invalidate_apps_cache_on_change():
+    """
+    Connect `invalidate_apps_cache_on_change` to the object permission
+    models of guardian and the models of the EMP apps.
+
+    This must be called once the apps are loaded (see `EmpMainConfig.ready`)
+    and connects the receiver per model, as a receiver for all models would
+    be called on every save, e.g. of every value message.
+    """
+    senders = [get_user_obj_perms_model(), get_group_obj_perms_model()]
+    for app_config in apps.get_app_configs():
+        if app_config.label in settings.EMP_APPS:
+            senders.extend(app_config.get_models(include_auto_created=True))
+
+    for sender in senders:
+        for signal in (post_save, post_delete):
+            signal.connect(
+                invalidate_apps_cache_on_change,
+                sender=sender,
+                dispatch_uid="invalidate_apps_cache_on_change",
+            )
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through)
+@receiver(m2m_changed, sender=get_user_model().user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_apps_cache_on_m2m_change(sender, action, **kwargs):
+    """
+    Invalidate EmpAppsCache for all users after a user has joined or left a
+    group, as the group permissions apply to the user, or after the model
+    level permissions of a user or group changed.
+    """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    logger.debug("Signal invalidate_apps_cache_on_m2m_change called.")
+
+    EmpAppsCache.get_instance().invalidate()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+In process routing of datapoint updates to websocket consumers.
+
+Updates are published by the API on one channel layer group per message
+type, e.g. `datapoint.value.latest`, see
+`GenericDatapointAPIView.publish_on_channel_layer`. Every message carries
+the JSON of one or more datapoints. Instead of adding every websocket
+connection to one group per datapoint, the `SubscriptionRouter` joins each
+group once per process and forwards the messages to the consumers that
+have subscribed to the datapoints. The work in the channel layer is hence
+independent of the number of connections and subscribed datapoints.
+
+The router hands the messages to the consumers without waiting for the
+clients, each consumer sends them in its own task. A slow client hence
+doesn't stall the delivery to the other consumers, nor lets the router
+channel fill up, which would make the channel layer drop messages.
+"""
+import asyncio
+import logging
+
+from channels.layers import get_channel_layer
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionRouter:
+    """
+    Forwards messages received on channel layer groups to the consumers
+    subscribed to the contained datapoints.
+
+    Use `get_instance` to retrieve the object, there should only be one
+    router per process.
+
+    Attributes:
+    -----------
+    channel_layer: channels.layers.BaseChannelLayer
+        The channel layer the updates are published on.
+    channel_name: str
+        The channel of the router, which is added to the groups.
+    consumers_by_dp: dict
+        Maps `(group_name, datapoint_id)` to the set of consumers
+        subscribed to that datapoint. The datapoint ID is stored as str,
+        like in the published messages.
+    group_names: set of str
+        The groups the router channel has been added to.
+    group_renew_interval: float
+        Seconds between renewals of the group memberships, which expire
+        otherwise (after one day for channels_redis) also while websockets
+        are connected.
+    receive_retry_interval: float
+        Seconds to wait before receiving again after the channel layer
+        failed, doubled on every consecutive failure up to
+        `receive_retry_interval_max`.
+    """
+
+    _instance = None
+    group_renew_interval = 3600
+    receive_retry_interval = 1
+    receive_retry_interval_max = 60
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Return the router, create it on first call.
+        """
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.channel_layer = get_channel_layer()
+        self._reset()
+
+    def _reset(self):
+        """
+        Forget all subscriptions and the channel.
+        """
+        self.event_loop = None
+        self.channel_name = None
+        self.receive_task = None
+        self.renew_task = None
+        self.consumers_by_dp = {}
+        self.group_names = set()
+
+    async def _ensure_running(self):
+        """
+        Create the channel and start receiving messages if not done yet.
+
+        The receiving task is bound to an event loop. If that loop is
+        not the current one anymore (which happens in the tests, as these
+        use a new loop per test case), the router starts over.
+        """
+        event_loop = asyncio.get_running_loop()
+        if self.event_loop is event_loop:
+            return
+
+        if self.receive_task is not None and not self.event_loop.is_closed():
+            self.receive_task.cancel()
+            self.renew_task.cancel()
+        self._reset()
+
+        self.event_loop = event_loop
+        self.channel_name = await self.channel_layer.new_channel()
+        self.receive_task = event_loop.create_task(self._receive_messages())
+        self.renew_task = event_loop.create_task(self._renew_groups())
+
+    async def subscribe(self, consumer, group_name, datapoint_ids):
+        """
+        Forward updates of datapoints to a consumer.
+
+        Arguments:
+        ----------
+        consumer: channels.generic.websocket.AsyncWebsocketConsumer
+            The consumer the messages are passed to with
+            `push_update(dp_id, json_str)`, which must not block.
+        group_name: str
+            The channel layer group the updates are published on.
+        datapoint_ids: iterable
+            The ids of the datapoints the consumer should receive updates
+            for.
+        """
+        await self._ensure_running()
+
+        # Adding the router channel again is cheap and renews the membership,
+        # see also `_renew_groups`.
+        await self.channel_layer.group_add(group_name, self.channel_name)
+        self.group_names.add(group_name)
+
+        for datapoint_id in datapoint_ids:
+            key = (group_name, str(datapoint_id))
+            self.consumers_by_dp.setdefault(key, set()).add(consumer)
+
+    def unsubscribe(self, consumer, group_name, datapoint_ids):
+        """
+        Stop forwarding updates of datapoints to a consumer.
+
+        The router stays member of the group, the messages of the group are
+        just dropped if no consumer has subscribed to the datapoints.
+
+        Arguments:
+        ----------
+        See `subscribe`.
+        """
+        for datapoint_id in datapoint_ids:
+            key = (group_name, str(datapoint_id))
+            consumers = self.consumers_by_dp.get(key)
+            if consumers is None:
+                continue
+            consumers.discard(consumer)
+            if not consumers:
+                del self.consumers_by_dp[key]
+
+    def route(self, message):
+        """
+        Pass the datapoints contained in a message to the subscribed
+        consumers.
+
+        Arguments:
+        ----------
+        message: dict
+            As sent by `GenericDatapointAPIView.publish_on_channel_layer`,
+            i.e. with the keys `group` and `json_by_dp_id`.
+        """
+        group_name = message["group"]
+        for dp_id, json_str in message["json_by_dp_id"].items():
+            consumers = self.consumers_by_dp.get((group_name, dp_id), ())
+            for consumer in list(consumers):
+                # A failing consumer must not prevent delivery to the others.
+                try:
+                    consumer.push_update(dp_id, json_str)
+                except Exception as e:
+                    logger.warning(
+                        "SubscriptionRouter failed to pass update to "
+                        "consumer: %s",
+                        e,
+                    )
+
+    async def _add_to_groups(self):
+        """
+        Add the router channel to all groups again, which renews the
+        memberships.
+        """
+        for group_name in list(self.group_names):
+            await self.channel_layer.group_add(group_name, self.channel_name)
+
+    async def _renew_groups(self):
+        """
+        Renew the group memberships periodically until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.group_renew_interval)
+            try:
+                await self._add_to_groups()
+            except Exception:
+                logger.exception("SubscriptionRouter failed to renew groups.")
+
+    async def _receive_messages(self):
+        """
+        Receive messages of the router channel until cancelled.
+
+        Failures of the channel layer (e.g. while Redis reconnects) are
+        retried with increasing intervals, as this task ending would stop
+        all updates of the websockets of this process.
+        """
+        retry_interval = self.receive_retry_interval
+        while True:
+            try:
+                message = await self.channel_layer.receive(self.channel_name)
+            except Exception:
+                logger.exception(
+                    "SubscriptionRouter failed to receive, retrying in %s s.",
+                    retry_interval,
+                )
+                await asyncio.sleep(retry_interval)
+                retry_interval = min(
+                    retry_interval * 2, self.receive_retry_interval_max
+                )
+                try:
+                    # The memberships may have been lost with the connection.
+                    await self._add_to_groups()
+                except Exception:
+                    # Reported by the next failing `receive` anyway.
+                    pass
+                continue
+            retry_interval = self.receive_retry_interval
+
+            try:
+                self.route(message)
+            except Exception:
+                logger.exception(
+                    "SubscriptionRouter failed to route message of group %s.",
+                    message.get("group"),
+                )
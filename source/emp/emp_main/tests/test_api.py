@@ -10,17 +10,29 @@ from datetime import timezone
 import json
 from pprint import pformat
 
+from channels.layers import InMemoryChannelLayer
 from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.db import connection
+from django.db import models
 from django.http import HttpResponse
 from django.http import Http404
 from django.test import Client
 from django.test import TransactionTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from esg.models.datapoint import DatapointList
 from esg.models.metadata import GeographicPosition
 from esg.services.base import RequestInducedException
+from esg.utils.pandas import value_dataframe_from_dataframe
 
+from emp_main import rollups
 from emp_main.api import GenericAPIView
+from emp_main.api import GenericDatapointAPIView
 from emp_main.consumers import DatapointRelatedLatestConsumer
 from emp_main.models import Datapoint as DatapointDb
 from emp_main.models import ValueMessage as ValueHistoryDb
@@ -1041,6 +1053,48 @@ class TestGenericAPIViewHandleException:
         assert b"Rare Exception" not in response.content
 
 
+class TestGenericDatapointAPIViewPublish:
+    """
+    Tests for emp_main.api.GenericDatapointAPIView.publish_on_channel_layer
+    """
+
+    def test_all_messages_are_published(self):
+        """
+        Check that every datapoint is contained in the published messages,
+        also if there are more batches than `publish_concurrency`.
+        """
+        view = GenericDatapointAPIView()
+        view.channel_layer = InMemoryChannelLayer()
+        view.publish_concurrency = 2
+        view.publish_batch_size = 2
+
+        json_by_dp_id = {str(i): '{"n": %s}' % i for i in range(5)}
+
+        event_loop = asyncio.get_event_loop()
+        channel_name = event_loop.run_until_complete(
+            view.channel_layer.new_channel()
+        )
+        event_loop.run_until_complete(
+            view.channel_layer.group_add("test", channel_name)
+        )
+
+        view.publish_on_channel_layer(
+            group_name="test", json_by_dp_id=json_by_dp_id
+        )
+
+        actual_json_by_dp_id = {}
+        for _ in range(3):
+            message = event_loop.run_until_complete(
+                view.channel_layer.receive(channel_name)
+            )
+            assert message["type"] == "datapoint.related.batch"
+            assert message["group"] == "test"
+            assert len(message["json_by_dp_id"]) <= 2
+            actual_json_by_dp_id.update(message["json_by_dp_id"])
+
+        assert actual_json_by_dp_id == json_by_dp_id
+
+
 class GenericAPIViewTests(TransactionTestCase):
     """
     Similar to how `GenericAPIView` holds generic code for derived APIView
@@ -1298,6 +1352,37 @@ class TestDatapointMetadataAPIView(TransactionTestCase):
 
         assert expected_jsonable == actual_jsonable
 
+    def test_get_datapoint_latest_conditional(self):
+        """
+        Verify that GET /datapoint/metadata/latest/ answers with 304 and
+        without querying the DB if the ETag matches, but not anymore after
+        the metadata has been updated.
+        """
+        response = self._put_test_datapoints(test_datapoints=TEST_DATAPOINTS)
+        assert response.status_code == 200
+
+        url = "/" + API_ROOT_PATH + "datapoint/metadata/latest/"
+        response = self.client.get(url)
+        assert response.status_code == 200
+        etag = response["ETag"]
+        assert response.has_header("Last-Modified")
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response["ETag"] == etag
+
+        # Other query parameters yield other content and hence another ETag.
+        response = self.client.get(url, {"limit": 1}, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+
+        response = self._put_test_datapoints(test_datapoints=TEST_DATAPOINTS)
+        assert response.status_code == 200
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+
     def _put_test_datapoints(self, test_datapoints):
         """
         Again a utility to prevent redundant code.
@@ -1346,6 +1431,13 @@ class TestDatapointMetadataAPIView(TransactionTestCase):
             id = ids[actual_content.index(expected_datapoint)]
             test_datapoint["Python"]["id"] = id
 
+        # The IDs of the created datapoints must be returned, also on DBs
+        # on which `bulk_create` doesn't set the primary keys.
+        assert None not in ids
+        assert sorted(ids) == sorted(
+            DatapointDb.objects.values_list("id", flat=True)
+        )
+
         # Check the datapoints have reached the DB.
         self._check_test_datapoints_in_db(test_datapoints=test_datapoints)
 
@@ -1389,6 +1481,61 @@ class TestDatapointMetadataAPIView(TransactionTestCase):
         assert DatapointDb.objects.count() == len(TEST_DATAPOINTS_MIN)
         self._check_test_datapoints_in_db(test_datapoints=TEST_DATAPOINTS_MIN)
 
+    def test_put_datapoint_latest_query_count_is_constant(self):
+        """
+        Verify that creating and updating datapoints does not issue
+        queries per datapoint.
+        """
+        query_counts = []
+        for number_of_datapoints in [3, 30]:
+            test_datapoints = []
+            for i in range(number_of_datapoints):
+                test_datapoints.append(
+                    {
+                        "Python": {
+                            "id": None,
+                            "origin": "test_" + str(number_of_datapoints),
+                            "origin_id": str(i),
+                            "type": "Sensor",
+                        }
+                    }
+                )
+
+            # First call creates, second call updates.
+            for _ in range(2):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self._put_test_datapoints(
+                        test_datapoints=test_datapoints
+                    )
+                assert response.status_code == 200
+                query_counts.append(len(queries))
+
+        assert DatapointDb.objects.count() == 33
+        assert query_counts[:2] == query_counts[2:]
+
+    def test_put_datapoint_latest_returns_ids_of_created(self):
+        """
+        Verify that the returned IDs of created datapoints (with and without
+        origin) are those in DB.
+        """
+        test_datapoints = [
+            {"Python": {"id": None, "origin": "test", "origin_id": "1"}},
+            {"Python": {"id": None, "origin": "test", "origin_id": "2"}},
+            {"Python": {"id": None, "origin": None, "origin_id": None}},
+        ]
+        for test_datapoint in test_datapoints:
+            test_datapoint["Python"]["type"] = "Sensor"
+
+        response = self._put_test_datapoints(test_datapoints=test_datapoints)
+
+        assert response.status_code == 200
+        actual_datapoints = json.loads(response.content)
+        for actual_datapoint in actual_datapoints:
+            assert actual_datapoint["id"] is not None
+            datapoint_db = DatapointDb.objects.get(id=actual_datapoint["id"])
+            assert datapoint_db.origin == actual_datapoint["origin"]
+            assert datapoint_db.origin_id == actual_datapoint["origin_id"]
+
     def test_put_datapoint_latest_works_for_all_fail(self):
         """
         Test that all non existing datapoints are reported.
@@ -1523,6 +1670,8 @@ class GenericDatapointRelatedAPIViewTests(TransactionTestCase):
             self.RelatedDataLatestModel.objects.all().delete()
         if self.RelatedDataLatestModel is not None:
             self.RelatedDataHistoryModel.objects.all().delete()
+        # The cache would else serve the latest items of the deleted objects.
+        cache.clear()
 
     def _create_test_data_in_db(self, test_data, db_model):
         """
@@ -1595,6 +1744,80 @@ class GenericDatapointRelatedAPIViewTests(TransactionTestCase):
             actual_jsonable = response.json()
             assert expected_jsonable == actual_jsonable
 
+    def test_list_latest_by_ids_served_from_cache(self):
+        """
+        Verify that requests for explicit datapoint IDs are served from the
+        cache after the first request and after updates, and that the
+        content is the same as without cache.
+        """
+        for test_dataset in self.test_datasets_latest:
+            query_params = {
+                "id__in": [int(i) for i in test_dataset["JSONable"]]
+            }
+            expected_jsonable = test_dataset["JSONable"]
+
+            response = self.client.put(
+                self.endpoint_url_latest,
+                content_type="application/json",
+                data=expected_jsonable,
+            )
+            assert response.status_code == 200
+
+            # Written through on update.
+            with self.assertNumQueries(0):
+                response = self.client.get(
+                    self.endpoint_url_latest, query_params
+                )
+            assert response.status_code == 200
+            assert response.json() == expected_jsonable
+
+            # Misses are loaded from DB and added to cache.
+            cache.clear()
+            response = self.client.get(self.endpoint_url_latest, query_params)
+            assert response.json() == expected_jsonable
+            with self.assertNumQueries(0):
+                response = self.client.get(
+                    self.endpoint_url_latest, query_params
+                )
+            assert response.json() == expected_jsonable
+
+    def test_list_latest_conditional(self):
+        """
+        Verify that the latest endpoint answers with 304 and without querying
+        the DB if the ETag matches, but not anymore after an update.
+        """
+        for test_dataset in self.test_datasets_latest:
+            response = self.client.put(
+                self.endpoint_url_latest,
+                content_type="application/json",
+                data=test_dataset["JSONable"],
+            )
+            assert response.status_code == 200
+
+            response = self.client.get(self.endpoint_url_latest)
+            assert response.status_code == 200
+            etag = response["ETag"]
+            assert response.has_header("Last-Modified")
+
+            with self.assertNumQueries(0):
+                response = self.client.get(
+                    self.endpoint_url_latest, HTTP_IF_NONE_MATCH=etag
+                )
+            assert response.status_code == 304
+
+            response = self.client.put(
+                self.endpoint_url_latest,
+                content_type="application/json",
+                data=test_dataset["JSONable"],
+            )
+            assert response.status_code == 200
+            response = self.client.get(
+                self.endpoint_url_latest, HTTP_IF_NONE_MATCH=etag
+            )
+            assert response.status_code == 200
+            assert response.json() == test_dataset["JSONable"]
+            assert response["ETag"] != etag
+
     def test_list_history(self):
         """
         Verify the it is possible to retrieve data from the latest endpoint.
@@ -1619,6 +1842,159 @@ class GenericDatapointRelatedAPIViewTests(TransactionTestCase):
             actual_jsonable = response.json()
             assert expected_jsonable == actual_jsonable
 
+    def test_list_latest_and_history_use_single_query(self):
+        """
+        Verify that the number of DB queries does not grow with the number
+        of returned messages, i.e. that the datapoint is not loaded per row.
+        """
+        for test_dataset in self.test_datasets_latest:
+            self._create_test_data_in_db(
+                test_data=test_dataset["Python"],
+                db_model=self.RelatedDataLatestModel,
+            )
+            with self.assertNumQueries(1):
+                response = self.client.get(self.endpoint_url_latest)
+            assert response.status_code == 200
+            assert response.json() == test_dataset["JSONable"]
+
+        for test_dataset in self.test_datasets_history:
+            self._create_test_data_in_db(
+                test_data=test_dataset["Python"],
+                db_model=self.RelatedDataHistoryModel,
+            )
+            with self.assertNumQueries(1):
+                response = self.client.get(self.endpoint_url_history)
+            assert response.status_code == 200
+            assert response.json() == test_dataset["JSONable"]
+
+            self.RelatedDataHistoryModel.objects.all().delete()
+
+    def test_list_history_streamed(self):
+        """
+        Verify that the streamed version of the history endpoint returns
+        the same content as the normal one.
+        """
+        for test_dataset in self.test_datasets_history:
+
+            self._create_test_data_in_db(
+                test_data=test_dataset["Python"],
+                db_model=self.RelatedDataHistoryModel,
+            )
+
+            response = self.client.get(
+                self.endpoint_url_history, {"stream": "true"}
+            )
+            assert response.status_code == 200
+            assert response.streaming
+
+            expected_jsonable = test_dataset["JSONable"]
+            actual_jsonable = json.loads(b"".join(response.streaming_content))
+            assert expected_jsonable == actual_jsonable
+
+    def test_list_history_paginated(self):
+        """
+        Verify that fetching the history page by page, by following the
+        cursors, yields the same content as fetching it in one go. This
+        must also hold for the streamed responses.
+        """
+        for test_dataset in self.test_datasets_history:
+
+            self._create_test_data_in_db(
+                test_data=test_dataset["Python"],
+                db_model=self.RelatedDataHistoryModel,
+            )
+
+            for stream in ["false", "true"]:
+                actual_jsonable = {}
+                query_params = {"limit": 1, "stream": stream}
+                while True:
+                    response = self.client.get(
+                        self.endpoint_url_history, query_params
+                    )
+                    assert response.status_code == 200
+
+                    if response.streaming:
+                        content = b"".join(response.streaming_content)
+                    else:
+                        content = response.content
+                    for dp_id, messages in json.loads(content).items():
+                        assert len(messages) == 1
+                        actual_jsonable.setdefault(dp_id, []).extend(messages)
+
+                    if "X-Next-Cursor" not in response:
+                        break
+                    query_params["cursor"] = response["X-Next-Cursor"]
+
+                expected_jsonable = test_dataset["JSONable"]
+                assert expected_jsonable == actual_jsonable
+
+            self.RelatedDataHistoryModel.objects.all().delete()
+
+    def test_list_history_too_large_without_pagination_yields_400(self):
+        """
+        Check that results larger than one page are not truncated silently
+        if the client hasn't requested pagination.
+        """
+        test_dataset = self.test_datasets_history[0]
+        self._create_test_data_in_db(
+            test_data=test_dataset["Python"],
+            db_model=self.RelatedDataHistoryModel,
+        )
+        with override_settings(API_MAX_PAGE_SIZE=1):
+            response = self.client.get(self.endpoint_url_history)
+            assert response.status_code == 400
+            assert "cursor" in response.json()["detail"]
+
+            response = self.client.get(self.endpoint_url_history, {"limit": 1})
+            assert response.status_code == 200
+
+    def test_list_history_invalid_cursor_yields_400(self):
+        """
+        Check that a broken pagination cursor is reported back to the client.
+        """
+        response = self.client.get(
+            self.endpoint_url_history, {"cursor": "not-a-cursor"}
+        )
+        assert response.status_code == 400
+
+    def test_list_history_columnar(self):
+        """
+        Verify that the columnar history endpoint returns one row per message
+        in both supported formats.
+        """
+        for test_dataset in self.test_datasets_history:
+
+            self._create_test_data_in_db(
+                test_data=test_dataset["Python"],
+                db_model=self.RelatedDataHistoryModel,
+            )
+
+            expected_rows = set()
+            for test_data_item in test_dataset["Python"]:
+                expected_rows.add(
+                    (test_data_item["datapoint__id"], test_data_item["time"])
+                )
+
+            for columnar_format in ["arrow", "parquet"]:
+                response = self.client.get(
+                    self.endpoint_url_history + "columnar/",
+                    {"format": columnar_format},
+                )
+                assert response.status_code == 200
+
+                content = b"".join(response.streaming_content)
+                if columnar_format == "parquet":
+                    table = pq.read_table(pa.BufferReader(content))
+                else:
+                    table = pa.ipc.open_stream(content).read_all()
+
+                actual_rows = set()
+                for row in table.to_pylist():
+                    actual_rows.add((row["datapoint_id"], row["time"]))
+                assert actual_rows == expected_rows
+
+            self.RelatedDataHistoryModel.objects.all().delete()
+
     def test_update_latest_creates_and_updates(self):
         """
         Check that calling PUT on the latest endpoint overwrites and/or
@@ -1662,6 +2038,20 @@ class GenericDatapointRelatedAPIViewTests(TransactionTestCase):
             actual_put_summary = response.json()
             assert actual_put_summary == expected_put_summary
 
+    def test_update_latest_without_items(self):
+        """
+        An empty update is valid and yields an empty summary.
+        """
+        if self.endpoint_url_latest is None:
+            return
+
+        response = self.client.put(
+            self.endpoint_url_latest, content_type="application/json", data={},
+        )
+
+        assert response.status_code == 200
+        assert response.json() == {"objects_created": 0, "objects_updated": 0}
+
     def test_update_latest_publishes_on_channel_group(self):
         """
         Verify that an update send over the channels group is received on
@@ -1782,6 +2172,69 @@ class GenericDatapointRelatedAPIViewTests(TransactionTestCase):
             actual_put_summary = response.json()
             assert actual_put_summary == expected_put_summary
 
+    def _history_as_ndjson(self, jsonable):
+        """
+        Convert the JSONable test data of the history endpoint to NDJSON.
+        """
+        lines = []
+        for datapoint_id, messages in jsonable.items():
+            for message in messages:
+                line_item = {"datapoint_id": datapoint_id}
+                line_item.update(message)
+                lines.append(json.dumps(line_item))
+        return "\n".join(lines) + "\n"
+
+    def test_update_history_ndjson_creates_and_updates(self):
+        """
+        Like `test_update_history_creates_and_updates` but with a NDJSON
+        body, which must yield the same result.
+        """
+        for test_dataset in self.test_datasets_history:
+
+            self._create_test_data_in_db(
+                test_data=test_dataset["Python_pre_update"],
+                db_model=self.RelatedDataHistoryModel,
+            )
+
+            response = self.client.put(
+                self.endpoint_url_history + "ndjson/",
+                content_type="application/x-ndjson",
+                data=self._history_as_ndjson(test_dataset["JSONable"]),
+            )
+
+            assert response.status_code == 200
+
+            self._check_test_data_exists_in_db(
+                test_data=test_dataset["Python"],
+                db_model=self.RelatedDataHistoryModel,
+                unique_together_fields=self.unique_together_fields_history,
+            )
+
+            expected_put_summary = test_dataset["PutSummary"]
+            actual_put_summary = response.json()
+            assert actual_put_summary == expected_put_summary
+
+    def test_invalid_ndjson_line_fails_gracefully_for_history(self):
+        """
+        An invalid line must yield a 400 that names the line, and nothing
+        must be written, not even the valid lines before it.
+        """
+        for test_dataset in self.test_datasets_history:
+
+            body = self._history_as_ndjson(test_dataset["JSONable"])
+            body += '{"time": "2022-04-24T23:21:00+00:00"}\n'
+
+            response = self.client.put(
+                self.endpoint_url_history + "ndjson/",
+                content_type="application/x-ndjson",
+                data=body,
+            )
+
+            assert response.status_code == 400
+            n_lines = len(body.splitlines())
+            assert "Line {}".format(n_lines) in response.json()["detail"]
+            assert self.RelatedDataHistoryModel.objects.count() == 0
+
     def test_invalid_updates_fail_gracefully_for_history(self):
         """
         This tests that invalid requests return the expected error messages.
@@ -1827,6 +2280,117 @@ class TestDatapointValueAPIView(GenericDatapointRelatedAPIViewTests):
     endpoint_url_history = "/" + API_ROOT_PATH + "datapoint/value/history/"
 
 
+class TestDatapointValueHistoryAtInterval(TransactionTestCase):
+    endpoint_url = "/" + API_ROOT_PATH + "datapoint/value/history/at_interval/"
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'"
+                )
+            if connection.vendor != "postgresql" or cursor.fetchone() is None:
+                self.skipTest("time_bucket requires TimescaleDB.")
+
+        self.datapoints = [
+            DatapointDb.objects.create(type="Sensor") for _ in range(3)
+        ]
+        # Datapoints without values in some buckets, overlapping buckets and
+        # non numeric values, the last datapoint has no values at all.
+        times_and_values_by_dp = {
+            self.datapoints[0]: [
+                ("2022-01-01T00:10:00+00:00", 1.0),
+                ("2022-01-01T00:20:00+00:00", 2.0),
+                ("2022-01-01T02:10:00+00:00", 3.0),
+            ],
+            self.datapoints[1]: [
+                ("2022-01-01T00:30:00+00:00", 10.0),
+                ("2022-01-01T01:05:00+00:00", "not a number"),
+                ("2022-01-01T03:05:00+00:00", 30.0),
+            ],
+        }
+        for datapoint, times_and_values in times_and_values_by_dp.items():
+            for time, value in times_and_values:
+                ValueHistoryDb.objects.create(
+                    datapoint=datapoint,
+                    time=datetime.fromisoformat(time),
+                    value=value,
+                )
+
+    def get_expected_jsonable(self, query_params):
+        """
+        Compute the response like the API did before streaming, i.e. by
+        pivoting the aggregated rows with pandas.
+        """
+        related_objects = ValueHistoryDb.timescale.filter(
+            datapoint__in=self.datapoints
+        )
+        if "time__gte" in query_params:
+            related_objects = related_objects.filter(
+                time__gte=query_params["time__gte"]
+            )
+        related_objects = related_objects.time_bucket(
+            "time", query_params["interval"]
+        )
+        aggregation_func = getattr(models, query_params["aggregation"])
+        related_objects = related_objects.annotate(
+            value=aggregation_func("_value_float"),
+            datapoint_id=models.F("datapoint__id"),
+        )
+        related_objects = related_objects.order_by("bucket")
+        if not related_objects:
+            return {"values": {}, "times": []}
+
+        related_objects_as_df = pd.DataFrame.from_records(
+            related_objects, index="bucket"
+        )
+        related_objects_as_df = related_objects_as_df.pivot(
+            columns="datapoint_id", values="value"
+        )
+        related_objects_as_df.columns = related_objects_as_df.columns.astype(
+            str
+        )
+        related_objects_as_pydantic = value_dataframe_from_dataframe(
+            pandas_dataframe=related_objects_as_df
+        )
+        return json.loads(related_objects_as_pydantic.json())
+
+    def test_same_as_pandas_pivot(self):
+        """
+        Verify the streamed response equals the pivoted DataFrame the API
+        returned before, including the buckets in which only some
+        datapoints have values.
+        """
+        query_params_list = [
+            {"interval": "1 hour", "aggregation": "Avg"},
+            {"interval": "30 minutes", "aggregation": "Count"},
+            {"interval": "1 day", "aggregation": "Max"},
+            {
+                "interval": "1 hour",
+                "aggregation": "Sum",
+                "time__gte": "2022-01-01T01:00:00+00:00",
+            },
+            {
+                "interval": "1 hour",
+                "aggregation": "Avg",
+                "time__gte": "2023-01-01T00:00:00+00:00",
+            },
+        ]
+        # Checking the DB for rollups is cached and not part of the request.
+        rollups.get_available_view_names()
+        for query_params in query_params_list:
+            expected_jsonable = self.get_expected_jsonable(query_params)
+
+            # The buckets are derived from the values, not queried apart.
+            with self.assertNumQueries(1):
+                response = self.client.get(self.endpoint_url, query_params)
+                actual_content = b"".join(response.streaming_content)
+            assert response.status_code == 200
+
+            actual_jsonable = json.loads(actual_content)
+            assert actual_jsonable == expected_jsonable, query_params
+
+
 class TestDatapointScheduleAPIView(GenericDatapointRelatedAPIViewTests):
 
     RelatedDataLatestModel = ScheduleLatestDb
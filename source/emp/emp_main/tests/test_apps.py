@@ -1,3 +1,6 @@
+from unittest.mock import MagicMock
+
+from django.core.cache import cache
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 
@@ -19,14 +22,73 @@ class TestEmpAppsCache(TestCase):
         """
         Reset the apps cache before every test.
         """
+        cache.clear()
         del EmpAppsCache._instance
         self.apps_cache = EmpAppsCache()
 
+    def tearDown(self):
+        """
+        Ensure no mocked instance survives the test.
+        """
+        del EmpAppsCache._instance
+        EmpAppsCache()
+
     def test_empty_apps_cache_for_tests(self):
         """
         Some of the tests below might rely on an empty cache, confirm that the
         empty mechanism works.
         """
-        self.assertFalse(self.apps_cache.apps_nav_content)
-        self.assertFalse(self.apps_cache.allowed_urls)
-        self.assertFalse(self.apps_cache.allowed_datapoint_ids)
+        version, _ = self.apps_cache.permission_version.get()
+        for user in [self.user, self.anon]:
+            key = self.apps_cache.get_cache_key(user, version)
+            self.assertIsNone(cache.get(key))
+
+    def test_objects_shared_between_instances(self):
+        """
+        The computed objects must be available to all workers, i.e. an
+        other instance should not recompute them.
+        """
+        expected_objects = self.apps_cache.update_for_user(self.user)
+
+        del EmpAppsCache._instance
+        other_apps_cache = EmpAppsCache()
+        other_apps_cache.update_for_user = MagicMock()
+
+        actual_objects = other_apps_cache.get_objects_for_user(self.user)
+
+        self.assertEqual(actual_objects, expected_objects)
+        other_apps_cache.update_for_user.assert_not_called()
+
+    def test_invalidate_triggers_recomputation(self):
+        """
+        Objects computed before `invalidate` must not be used anymore.
+        """
+        self.apps_cache.update_for_user(self.user)
+        self.apps_cache.invalidate()
+        self.apps_cache.update_for_user = MagicMock(return_value={})
+
+        self.apps_cache.get_objects_for_user(self.user)
+
+        self.apps_cache.update_for_user.assert_called_once_with(self.user)
+
+    def test_update_for_all_users_fills_cache(self):
+        """
+        After updating all users every user must be served from cache, with
+        the same objects as computed for the single user.
+        """
+        self.apps_cache.update_for_all_users()
+        version, _ = self.apps_cache.permission_version.get()
+
+        for user in [self.user, self.anon]:
+            key = self.apps_cache.get_cache_key(user, version)
+            actual_objects = cache.get(key)
+            expected_objects = self.apps_cache.update_for_user(user)
+            self.assertEqual(actual_objects, expected_objects)
+
+    def test_update_for_all_users_in_background(self):
+        """
+        Updating all users must not block the caller.
+        """
+        self.apps_cache.start_update_for_all_users = MagicMock()
+        self.apps_cache.update_for_user(None)
+        self.apps_cache.start_update_for_all_users.assert_called_once()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Tests for the caches shared by all workers in `emp_main.caches`.
+"""
+from datetime import datetime
+from datetime import timezone
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.test import override_settings
+
+from emp_main.caches import LatestMessageCache
+
+
+@override_settings(API_LATEST_CACHE_TIMEOUT=300)
+class TestLatestMessageCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.latest_cache = LatestMessageCache("test")
+        self.time_1 = datetime(2022, 1, 1, 12, tzinfo=timezone.utc)
+        self.time_2 = datetime(2022, 1, 1, 13, tzinfo=timezone.utc)
+
+    def test_older_messages_not_set(self):
+        self.latest_cache.set_many(
+            {
+                1: {"value": 1.0, "time": self.time_2},
+                2: {"value": 2.0, "time": self.time_1},
+            }
+        )
+
+        self.latest_cache.set_many_if_not_older(
+            {
+                1: {"value": 3.0, "time": self.time_1},
+                2: {"value": 4.0, "time": self.time_1},
+                3: {"value": 5.0, "time": self.time_1},
+            }
+        )
+
+        messages_by_dp_id = self.latest_cache.get_many([1, 2, 3])
+        assert messages_by_dp_id == {
+            1: {"value": 1.0, "time": self.time_2},
+            2: {"value": 4.0, "time": self.time_1},
+            3: {"value": 5.0, "time": self.time_1},
+        }
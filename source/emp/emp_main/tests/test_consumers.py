@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 """
+Tests for the websocket consumers of the latest endpoints.
 """
+import asyncio
+import json
+
 from django.test import TestCase
 from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
 
+from emp_main.consumers import AsyncDatapointRelatedLatestConsumer
 from emp_main.consumers import DatapointRelatedLatestConsumer
 
 
@@ -14,6 +19,7 @@ class TestDatapointRelatedLatestConsumer(TestCase):
     """
 
     ws_url = "/ws/api/datapoint/metadata/latest/?datapoint-ids=[1,2]"
+    consumer = DatapointRelatedLatestConsumer
 
     async def test_update_received(self):
         """
@@ -21,7 +27,7 @@ class TestDatapointRelatedLatestConsumer(TestCase):
         websocket.
         """
         communicator = WebsocketCommunicator(
-            DatapointRelatedLatestConsumer.as_asgi(), self.ws_url
+            self.consumer.as_asgi(), self.ws_url
         )
 
         connected, _ = await communicator.connect()
@@ -34,10 +40,126 @@ class TestDatapointRelatedLatestConsumer(TestCase):
 
         channel_layer = get_channel_layer()
         await channel_layer.group_send(
-            "datapoint.metadata.latest.1",
-            {"type": "datapoint.related", "json": "test"},
+            "datapoint.metadata.latest",
+            {
+                "type": "datapoint.related.batch",
+                "group": "datapoint.metadata.latest",
+                "json_by_dp_id": {"1": "test", "3": "not requested"},
+            },
+        )
+
+        response = await communicator.receive_from()
+
+        assert response == "test"
+        assert await communicator.receive_nothing()
+
+    async def test_subscriptions_can_be_changed(self):
+        """
+        Verify that clients can add and remove datapoints after connect.
+        """
+        communicator = WebsocketCommunicator(
+            self.consumer.as_asgi(), self.ws_url
+        )
+
+        connected, _ = await communicator.connect()
+        assert connected
+        response = await communicator.receive_from()
+        assert response == "[]"
+
+        await communicator.send_to(
+            json.dumps({"subscribe": [3], "unsubscribe": [1]})
+        )
+
+        # The latest messages of the new datapoints are pushed immediately.
+        response = await communicator.receive_from()
+        assert response == "[]"
+
+        channel_layer = get_channel_layer()
+        await channel_layer.group_send(
+            "datapoint.metadata.latest",
+            {
+                "type": "datapoint.related.batch",
+                "group": "datapoint.metadata.latest",
+                "json_by_dp_id": {"1": "unsubscribed", "3": "test"},
+            },
         )
 
         response = await communicator.receive_from()
 
         assert response == "test"
+        assert await communicator.receive_nothing()
+
+
+class TestAsyncDatapointRelatedLatestConsumer(
+    TestDatapointRelatedLatestConsumer
+):
+    """
+    Tests for `emp_main.consumers.AsyncDatapointRelatedLatestConsumer`
+    """
+
+    consumer = AsyncDatapointRelatedLatestConsumer
+
+    async def test_updates_coalesced_with_max_rate(self):
+        """
+        Verify that with `max-rate` the updates are merged into a single
+        message holding only the newest update per datapoint.
+        """
+        communicator = WebsocketCommunicator(
+            self.consumer.as_asgi(), self.ws_url + "&max-rate=5hz"
+        )
+
+        connected, _ = await communicator.connect()
+        assert connected
+        response = await communicator.receive_from()
+        assert response == "[]"
+
+        channel_layer = get_channel_layer()
+        for json_by_dp_id in [
+            {"1": '{"v": 1}'},
+            {"1": '{"v": 2}', "2": '{"v": 3}'},
+        ]:
+            await channel_layer.group_send(
+                "datapoint.metadata.latest",
+                {
+                    "type": "datapoint.related.batch",
+                    "group": "datapoint.metadata.latest",
+                    "json_by_dp_id": json_by_dp_id,
+                },
+            )
+
+        response = await communicator.receive_from()
+
+        assert json.loads(response) == [{"v": 2}, {"v": 3}]
+        assert await communicator.receive_nothing()
+
+        await communicator.disconnect()
+
+    async def test_slow_client_receives_newest_updates(self):
+        """
+        Verify that updates for a client that can't keep up are collected
+        without waiting, keeping only the newest one per datapoint.
+        """
+        consumer = self.consumer()
+        consumer.pending_updates = {}
+        consumer.updates_pending = asyncio.Event()
+        sent = []
+        send_released = asyncio.Event()
+
+        async def send(json_str):
+            sent.append(json_str)
+            await send_released.wait()
+
+        consumer.send = send
+        send_task = asyncio.create_task(consumer.send_pending_updates())
+
+        consumer.push_update("1", "msg 1")
+        await asyncio.sleep(0.01)
+        # The client is still busy with the first update.
+        consumer.push_update("1", "msg 2")
+        consumer.push_update("2", "msg 3")
+        consumer.push_update("1", "msg 4")
+        send_released.set()
+        await asyncio.sleep(0.01)
+
+        assert sent == ["msg 1", "msg 4", "msg 3"]
+        send_task.cancel()
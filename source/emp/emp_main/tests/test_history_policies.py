@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for the retention and compression policies of the history tables.
+"""
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from unittest.mock import patch
+
+import pytest
+from django.test import TestCase
+from django.test import override_settings
+
+from emp_main import history_policies
+from emp_main.models import Datapoint
+from emp_main.models import ValueMessage
+
+
+class TestHistoryTable:
+    def test_compression_enabled_once(self):
+        history_table = history_policies.HISTORY_TABLES["forecast"]
+
+        statements = history_table.get_compression_sql(
+            compress_after_days=7, compression_enabled=False
+        )
+        assert "timescaledb.compress," in statements[0]
+        assert "'datapoint_id, product_run_id'" in statements[0]
+        assert "INTERVAL '7 days'" in statements[-1]
+
+        statements = history_table.get_compression_sql(
+            compress_after_days=7, compression_enabled=True
+        )
+        assert not any("ALTER TABLE" in s for s in statements)
+
+    def test_policies_removed_if_disabled(self):
+        history_table = history_policies.HISTORY_TABLES["value"]
+
+        statements = history_table.get_compression_sql(
+            compress_after_days=0, compression_enabled=True
+        )
+        assert len(statements) == 1
+        assert "remove_compression_policy" in statements[0]
+
+        statements = history_table.get_retention_sql(retention_days=None)
+        assert len(statements) == 1
+        assert "remove_retention_policy" in statements[0]
+
+
+class TestCheckSettings:
+    @override_settings(HISTORY_RETENTION_DAYS={"values": 30})
+    def test_unknown_table_raises(self):
+        with pytest.raises(ValueError):
+            history_policies.check_settings()
+
+    @override_settings(
+        HISTORY_RETENTION_DAYS={"value": 30},
+        HISTORY_RETENTION_DAYS_BY_ORIGIN={"bemcom": {"forecasts": 3}},
+    )
+    def test_unknown_table_by_origin_raises(self):
+        with pytest.raises(ValueError):
+            history_policies.check_settings()
+
+    @override_settings(HISTORY_RETENTION_DAYS={"value": 7})
+    def test_value_retention_shorter_than_rollup_refresh_raises(self):
+        with pytest.raises(ValueError):
+            history_policies.check_settings()
+
+
+class TestApplyPolicies:
+    @override_settings(HISTORY_COMPRESS_AFTER_DAYS=7)
+    def test_compression_refused_for_old_timescaledb(self):
+        """
+        TimescaleDB before 2.11 can't write to compressed chunks.
+        """
+        with patch.object(
+            history_policies, "timescaledb_available", return_value=True
+        ), patch.object(
+            history_policies, "get_timescaledb_version", return_value=(2, 4, 1)
+        ):
+            with pytest.raises(ValueError):
+                history_policies.apply_policies()
+
+
+class TestDeleteByOrigin(TestCase):
+    @override_settings(HISTORY_RETENTION_DAYS_BY_ORIGIN={"a": {"value": 10}})
+    def test_only_old_messages_of_origin_deleted(self):
+        dp_a = Datapoint.objects.create(
+            origin="a", origin_id="1", type="Sensor"
+        )
+        dp_b = Datapoint.objects.create(
+            origin="b", origin_id="1", type="Sensor"
+        )
+        now = datetime.now(tz=timezone.utc)
+        for datapoint in [dp_a, dp_b]:
+            for days in [1, 20]:
+                ValueMessage.objects.create(
+                    datapoint=datapoint,
+                    time=now - timedelta(days=days),
+                    value=days,
+                )
+
+        n_deleted_by_table = history_policies.delete_by_origin()
+
+        assert n_deleted_by_table == {"value": 1}
+        assert ValueMessage.objects.filter(datapoint=dp_a).count() == 1
+        assert ValueMessage.objects.filter(datapoint=dp_b).count() == 2
+        remaining = ValueMessage.objects.get(datapoint=dp_a)
+        assert remaining.time > now - timedelta(days=10)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Tests for the bulk writes of messages in `emp_main.ingest`.
+"""
+import csv
+from datetime import datetime
+from datetime import timezone
+
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test import override_settings
+
+from emp_main import ingest
+from emp_main.models import Datapoint
+from emp_main.models import ForecastMessage
+from emp_main.models import LastValueMessage
+from emp_main.models import ProductRun
+from emp_main.models import ValueMessage
+
+
+class TestCopyEncoding:
+    def test_values_encoded(self):
+        json_field = ValueMessage._meta.get_field("value")
+        float_field = ValueMessage._meta.get_field("_value_float")
+        bool_field = ValueMessage._meta.get_field("_value_bool")
+        time_field = ValueMessage._meta.get_field("time")
+        time = datetime(2022, 1, 1, 12, tzinfo=timezone.utc)
+
+        assert ingest.encode_copy_value(json_field, "on") == '"on"'
+        assert ingest.encode_copy_value(json_field, None) == ingest.COPY_NULL
+        assert ingest.encode_copy_value(float_field, 21.5) == "21.5"
+        assert ingest.encode_copy_value(bool_field, True) == "true"
+        assert ingest.encode_copy_value(time_field, time) == time.isoformat()
+
+    def test_csv_lines_numbered_and_quoted(self):
+        fields = [
+            ValueMessage._meta.get_field("value"),
+            ValueMessage._meta.get_field("_value_float"),
+        ]
+        rows = [["a,b", None], [1.5, 1.5]]
+
+        lines = list(ingest.iter_csv_lines(fields, rows))
+
+        assert len(lines) == 2
+        parsed = list(csv.reader(lines))
+        assert parsed[0] == ['"a,b"', ingest.COPY_NULL, "0"]
+        assert parsed[1] == ["1.5", "1.5", "1"]
+
+    def test_copy_stream_reads_in_chunks(self):
+        lines = ["line {}\n".format(i) for i in range(100)]
+        stream = ingest.CopyStream(lines)
+
+        chunks = []
+        while True:
+            chunk = stream.read(64)
+            if not chunk:
+                break
+            assert len(chunk) <= 64
+            chunks.append(chunk)
+
+        assert b"".join(chunks) == "".join(lines).encode()
+
+
+class TestCopyUpsert(TransactionTestCase):
+    @override_settings(API_COPY_INGEST_MIN_ITEMS=10)
+    def test_copy_upsert_available(self):
+        expected = connection.vendor == "postgresql"
+        assert ingest.copy_upsert_available(10) == expected
+        assert ingest.copy_upsert_available(9) is False
+        with override_settings(API_COPY_INGEST_MIN_ITEMS=0):
+            assert ingest.copy_upsert_available(10) is False
+
+    def test_created_and_updated_counted(self):
+        if connection.vendor != "postgresql":
+            self.skipTest("COPY requires PostgreSQL.")
+        datapoint = Datapoint.objects.create(type="Sensor")
+        time_1 = datetime(2022, 1, 1, 12, tzinfo=timezone.utc)
+        time_2 = datetime(2022, 1, 1, 13, tzinfo=timezone.utc)
+        ValueMessage.objects.create(datapoint=datapoint, time=time_1, value=1)
+        columns = ["time", "value", "_value_float", "_value_bool"]
+        columns.append("datapoint_id")
+        rows = [
+            [time_1, 2.0, 2.0, None, datapoint.id],
+            [time_2, 3.0, 3.0, None, datapoint.id],
+            # The last message for the same time wins.
+            [time_2, 4.0, 4.0, None, datapoint.id],
+        ]
+
+        n_created, n_updated = ingest.copy_upsert(
+            model=ValueMessage,
+            columns=columns,
+            rows=rows,
+            conflict_columns=["datapoint_id", "time"],
+        )
+
+        assert (n_created, n_updated) == (1, 1)
+        values = ValueMessage.objects.order_by("time")
+        values = list(values.values_list("_value_float", flat=True))
+        assert values == [2.0, 4.0]
+
+
+class TestUpsertLatestAndHistory(TransactionTestCase):
+    def setUp(self):
+        if not ingest.single_statement_upsert_available():
+            self.skipTest("Data-modifying CTEs require PostgreSQL.")
+        self.datapoint_1 = Datapoint.objects.create(type="Sensor")
+        self.datapoint_2 = Datapoint.objects.create(type="Sensor")
+        self.time_1 = datetime(2022, 1, 1, 12, tzinfo=timezone.utc)
+        self.time_2 = datetime(2022, 1, 1, 13, tzinfo=timezone.utc)
+
+    def upsert(self, rows, history_model=ValueMessage):
+        return ingest.upsert_latest_and_history(
+            latest_model=LastValueMessage,
+            history_model=history_model,
+            rows=rows,
+            latest_conflict_columns=["datapoint_id"],
+            history_conflict_columns=["datapoint_id", "time"],
+        )
+
+    def make_row(self, datapoint, time, value):
+        return {
+            "datapoint_id": datapoint.id,
+            "time": time,
+            "value": value,
+            "_value_float": value,
+            "_value_bool": None,
+        }
+
+    def test_created_and_updated_counted(self):
+        LastValueMessage.objects.create(
+            datapoint=self.datapoint_1, time=self.time_1, value=1.0
+        )
+        rows = [
+            self.make_row(self.datapoint_1, self.time_2, 2.0),
+            self.make_row(self.datapoint_2, self.time_2, 3.0),
+        ]
+
+        n_created, n_updated, written_datapoint_ids = self.upsert(rows)
+
+        assert (n_created, n_updated) == (1, 1)
+        assert written_datapoint_ids == {
+            self.datapoint_1.id,
+            self.datapoint_2.id,
+        }
+        latest = LastValueMessage.objects.order_by("datapoint_id")
+        assert list(latest.values_list("value", flat=True)) == [2.0, 3.0]
+        assert ValueMessage.objects.count() == 2
+
+    def test_empty_rows_not_written(self):
+        with self.assertNumQueries(0):
+            n_created, n_updated, written_datapoint_ids = self.upsert([])
+
+        assert (n_created, n_updated) == (0, 0)
+        assert written_datapoint_ids == set()
+
+    def test_older_message_not_written_to_latest(self):
+        LastValueMessage.objects.create(
+            datapoint=self.datapoint_1, time=self.time_2, value=2.0
+        )
+        rows = [self.make_row(self.datapoint_1, self.time_1, 1.0)]
+
+        n_created, n_updated, written_datapoint_ids = self.upsert(rows)
+
+        assert (n_created, n_updated) == (0, 0)
+        assert written_datapoint_ids == set()
+        latest = LastValueMessage.objects.get(datapoint=self.datapoint_1)
+        assert latest.value == 2.0
+        # The message belongs to the history nevertheless.
+        history = ValueMessage.objects.get(datapoint=self.datapoint_1)
+        assert history.time == self.time_1
+        assert history.value == 1.0
+
+    def test_columns_only_in_history_written(self):
+        """
+        The history table may have columns the latest table doesn't have,
+        forecasts serve as such a table here.
+        """
+        product_run = ProductRun.objects.create(
+            available_at=self.time_1,
+            coverage_from=self.time_1,
+            coverage_to=self.time_2,
+        )
+        row = self.make_row(self.datapoint_1, self.time_1, 1.0)
+        row.update({"product_run_id": product_run.id, "mean": 2.0})
+
+        ingest.upsert_latest_and_history(
+            latest_model=LastValueMessage,
+            history_model=ForecastMessage,
+            rows=[row],
+            latest_conflict_columns=["datapoint_id"],
+            history_conflict_columns=["datapoint_id", "time", "product_run_id"],
+        )
+
+        latest = LastValueMessage.objects.get(datapoint=self.datapoint_1)
+        assert latest.value == 1.0
+        forecast = ForecastMessage.objects.get(datapoint=self.datapoint_1)
+        assert forecast.product_run_id == product_run.id
+        assert forecast.mean == 2.0
+        assert forecast.time == self.time_1
+
+    def test_history_skipped_if_model_is_none(self):
+        rows = [self.make_row(self.datapoint_1, self.time_1, 1.0)]
+
+        self.upsert(rows, history_model=None)
+
+        assert LastValueMessage.objects.count() == 1
+        assert ValueMessage.objects.count() == 0
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Tests for the bulk permission lookups in `emp_main.permissions`.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.contrib.auth.models import Permission
+from django.test import TestCase
+from guardian.shortcuts import assign_perm
+from guardian.shortcuts import get_objects_for_user
+
+from emp_demo_ui_app.models import DemoAppPage
+from emp_main.permissions import get_objects_for_users
+
+PERM = "emp_demo_ui_app.view_demoapppage"
+
+
+class TestGetObjectsForUsers(TestCase):
+    """
+    Tests for `emp_main.permissions.get_objects_for_users`.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.anon = User.get_anonymous()
+        cls.user_direct = User.objects.create_user(username="u1")
+        cls.user_group = User.objects.create_user(username="u2")
+        cls.user_global = User.objects.create_user(username="u3")
+        cls.user_super = User.objects.create_superuser(username="u4")
+        cls.user_none = User.objects.create_user(username="u5")
+
+        cls.pages = []
+        for i in range(3):
+            cls.pages.append(
+                DemoAppPage.objects.create(
+                    page_name="Page {}".format(i),
+                    page_slug="page-{}".format(i),
+                    page_content="",
+                )
+            )
+
+        assign_perm(PERM, cls.anon, cls.pages[0])
+        assign_perm(PERM, cls.user_direct, cls.pages[1])
+        group = Group.objects.create(name="g1")
+        group.user_set.add(cls.user_group)
+        assign_perm(PERM, group, cls.pages[2])
+        cls.user_global.user_permissions.add(
+            Permission.objects.get(codename="view_demoapppage")
+        )
+
+        cls.users = [
+            cls.anon,
+            cls.user_direct,
+            cls.user_group,
+            cls.user_global,
+            cls.user_super,
+            cls.user_none,
+        ]
+
+    def test_same_objects_as_guardian(self):
+        """
+        The result must match `get_objects_for_user` for every user.
+        """
+        queryset = DemoAppPage.objects.order_by("id")
+        objects_by_user_pk = get_objects_for_users(self.users, PERM, queryset)
+
+        for user in self.users:
+            expected_objects = list(
+                get_objects_for_user(user, PERM).order_by("id")
+            )
+            actual_objects = objects_by_user_pk[user.pk]
+            self.assertEqual(actual_objects, expected_objects, user)
+
+    def test_query_count_is_constant(self):
+        """
+        The number of queries must not depend on the number of users.
+        """
+        queryset = DemoAppPage.objects.order_by("id")
+        with self.assertNumQueries(5):
+            get_objects_for_users(self.users[:1], PERM, queryset)
+        with self.assertNumQueries(5):
+            get_objects_for_users(self.users, PERM, queryset)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Tests for the rollups of the value history in `emp_main.rollups`.
+"""
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from time import monotonic
+from unittest.mock import patch
+
+from django.db import connection
+from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+
+from emp_main import rollups
+from emp_main.models import Datapoint
+from emp_main.models import ValueMessage
+
+
+class TestParseInterval:
+    def test_simple_intervals_parsed(self):
+        assert rollups.parse_interval("15 minutes") == (15, "minute")
+        assert rollups.parse_interval("1 hour") == (1, "hour")
+        assert rollups.parse_interval(" 2 Days ") == (2, "day")
+        assert rollups.parse_interval("1 month") == (1, "month")
+
+    def test_other_intervals_not_parsed(self):
+        assert rollups.parse_interval("1 hour 30 minutes") == (None, None)
+        assert rollups.parse_interval("01:00:00") == (None, None)
+        assert rollups.parse_interval("1 fortnight") == (None, None)
+
+
+class TestValueRollup:
+    def test_refresh_policy_bounded(self):
+        """
+        Refreshing buckets of which the raw values have been dropped would
+        remove these, hence the policy must not cover the full time range.
+        """
+        for rollup in rollups.VALUE_ROLLUPS:
+            _, add_policy_sql = rollup.get_create_sql()
+            assert "start_offset => NULL" not in add_policy_sql
+            assert "start_offset => INTERVAL '604800 seconds'" in add_policy_sql
+
+    def test_refresh_from_start(self):
+        rollup = rollups.VALUE_ROLLUPS[0]
+        start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+
+        assert "NULL, NULL" in rollup.get_refresh_sql()
+        refresh_sql = rollup.get_refresh_sql(start=start)
+        assert "'2022-01-01T00:00:00+00:00'::timestamptz, NULL" in refresh_sql
+
+    def test_refresh_window(self):
+        rollup = rollups.VALUE_ROLLUPS[0]
+        start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2022, 1, 2, tzinfo=timezone.utc)
+
+        refresh_sql = rollup.get_refresh_sql(start=start, end=end)
+        assert (
+            "'2022-01-01T00:00:00+00:00'::timestamptz, "
+            "'2022-01-02T00:00:00+00:00'::timestamptz)"
+        ) in refresh_sql
+
+    def test_bucket_start(self):
+        rollup = rollups.VALUE_ROLLUPS[1]
+        time = datetime(2022, 1, 1, 12, 30, 15, tzinfo=timezone.utc)
+
+        bucket_start = rollup.get_bucket_start(time)
+
+        assert bucket_start == datetime(2022, 1, 1, 12, tzinfo=timezone.utc)
+
+
+class TestGetRollup:
+    def setup_method(self):
+        # Simulate a DB in which all rollups exist.
+        rollups._available_view_names = {
+            r.view_name for r in rollups.VALUE_ROLLUPS
+        }
+        rollups._available_view_names_checked_at = monotonic()
+
+    def teardown_method(self):
+        rollups.reset_available_view_names()
+
+    def get_view_name(self, interval, aggregation="Avg", filters=None):
+        rollup = rollups.get_rollup(
+            interval=interval,
+            aggregation=aggregation,
+            active_filters=filters or {},
+        )
+        if rollup is None:
+            return None
+        return rollup.view_name
+
+    def test_coarsest_fitting_rollup_used(self):
+        assert self.get_view_name("15 minutes").endswith("_minute")
+        assert self.get_view_name("90 minutes").endswith("_minute")
+        assert self.get_view_name("6 hours").endswith("_hour")
+        assert self.get_view_name("1 day").endswith("_day")
+        assert self.get_view_name("1 week").endswith("_day")
+        assert self.get_view_name("1 month").endswith("_day")
+
+    def test_raw_values_for_non_aligned_interval(self):
+        assert self.get_view_name("30 seconds") is None
+        assert self.get_view_name("1 hour 30 minutes") is None
+
+    def test_raw_values_for_unknown_aggregation(self):
+        assert self.get_view_name("1 hour", aggregation="StdDev") is None
+
+    def test_filters_respected(self):
+        aligned = datetime(2022, 1, 1, 12, tzinfo=timezone.utc)
+        not_aligned = datetime(2022, 1, 1, 12, 0, 30, tzinfo=timezone.utc)
+
+        view_name = self.get_view_name("1 day", filters={"time__gte": aligned})
+        assert view_name.endswith("_hour")
+
+        view_name = self.get_view_name(
+            "1 day", filters={"time__gte": not_aligned}
+        )
+        assert view_name is None
+
+        view_name = self.get_view_name(
+            "1 day", filters={"datapoint__origin": "test"}
+        )
+        assert view_name is None
+
+    def test_missing_rollups_skipped(self):
+        rollups._available_view_names = {
+            rollups.VALUE_ROLLUPS[0].view_name
+        }
+        assert self.get_view_name("1 day").endswith("_minute")
+
+
+class TestRefreshAfterCommit(TestCase):
+    def setUp(self):
+        rollups._available_view_names = {
+            r.view_name for r in rollups.VALUE_ROLLUPS
+        }
+        rollups._available_view_names_checked_at = monotonic()
+        self.now = datetime.now(tz=timezone.utc)
+
+    def tearDown(self):
+        rollups.reset_available_view_names()
+
+    def test_old_values_refreshed(self):
+        """
+        Values older than the refresh window of the policies would never
+        be reflected in the rollups otherwise.
+        """
+        start = self.now - timedelta(days=30)
+        end = self.now - timedelta(days=20)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            rollups.refresh_after_commit([end, start])
+        with patch.object(rollups, "refresh_rollups") as refresh_rollups:
+            for callback in callbacks:
+                callback()
+
+        refresh_rollups.assert_called_once_with(
+            rollups.VALUE_ROLLUPS, start=start, end=end
+        )
+
+    def test_recent_values_refreshed_by_policies(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            rollups.refresh_after_commit([self.now - timedelta(hours=1)])
+
+        assert callbacks == []
+
+    def test_nothing_refreshed_without_rollups(self):
+        rollups._available_view_names = set()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            rollups.refresh_after_commit([self.now - timedelta(days=30)])
+
+        assert callbacks == []
+
+    @override_settings(HISTORY_RETENTION_DAYS={"value": 30})
+    def test_refresh_window_within_retention(self):
+        rollup = rollups.VALUE_ROLLUPS[2]
+        start = self.now - timedelta(days=60)
+        end = self.now - timedelta(days=20)
+
+        with patch.object(rollups, "connection") as db_connection:
+            rollups.refresh_rollups([rollup], start=start, end=end)
+            rollups.refresh_rollups(
+                [rollup], start=start, end=start + timedelta(days=1)
+            )
+
+        cursor = db_connection.cursor.return_value.__enter__.return_value
+        # The second window is before the retention start, i.e. skipped.
+        cursor.execute.assert_called_once_with(
+            rollup.get_refresh_sql(
+                start=rollup.get_bucket_start(self.now - timedelta(days=29)),
+                end=rollup.get_bucket_start(end) + rollup.bucket_width,
+            )
+        )
+
+
+class TestAvailableViewNames(TransactionTestCase):
+    def test_no_rollups_without_timescaledb(self):
+        """
+        E.g. on SQLite the raw values must be used.
+        """
+        if connection.vendor == "postgresql":
+            self.skipTest("Test requires a DB other than PostgreSQL.")
+        rollups.reset_available_view_names()
+        assert rollups.get_available_view_names() == set()
+        assert rollups.get_rollup("1 hour", "Avg", {}) is None
+
+
+class TestGetRollupQueryset(TransactionTestCase):
+    def test_queryset_built_and_evaluated(self):
+        """
+        The buckets must not conflict with the `bucket` field of the
+        rollups, and yield the same as the raw values.
+        """
+        rollup = rollups.VALUE_ROLLUPS[1]
+        datapoint = Datapoint.objects.create(type="Sensor")
+        day = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        for hour, value in [(1, 1.0), (2, 2.0), (3, 6.0)]:
+            ValueMessage.objects.create(
+                datapoint=datapoint, time=day.replace(hour=hour), value=value
+            )
+
+        bucketed = rollups.get_rollup_queryset(
+            rollup=rollup,
+            datapoints=Datapoint.objects.all(),
+            interval="1 day",
+            filters={"time__gte": day},
+        )
+        bucketed = rollups.annotate_rollup_value(bucketed, "Avg")
+        bucketed = bucketed.order_by("datapoint_id", "rollup_bucket")
+        # Compiling the query doesn't require the rollups in the DB.
+        assert "rollup_bucket" in str(bucketed.query)
+
+        rollups.reset_available_view_names()
+        if rollup.view_name not in rollups.get_available_view_names():
+            self.skipTest("Test requires the rollups of TimescaleDB.")
+        # The buckets that have not been materialized yet are computed from
+        # the raw values on read.
+        assert list(bucketed) == [
+            {"rollup_bucket": day, "value": 3.0, "datapoint_id": datapoint.id}
+        ]
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Tests for `emp_main.serializers`, which compare the orjson output with
+the `.json()` output of the pydantic models of the API.
+"""
+from copy import deepcopy
+import json
+
+from esg.models.datapoint import DatapointList
+from esg.models.datapoint import ValueMessageListByDatapointId
+from esg.models.datapoint import ScheduleMessageListByDatapointId
+from esg.models.datapoint import SetpointMessageListByDatapointId
+
+from emp_main import serializers
+from emp_main.tests.test_api import TEST_DATAPOINTS
+from emp_main.tests.test_api import TEST_DATASETS_VALUES_HISTORY
+from emp_main.tests.test_api import TEST_DATASETS_SCHEDULES_HISTORY
+from emp_main.tests.test_api import TEST_DATASETS_SETPOINTS_HISTORY
+
+
+def pydantic_reference_json(pydantic_model, python_data):
+    """
+    Return the output of the pydantic model for the data as bytes.
+
+    The only accepted differences to the output of `serializers.dumps` are
+    those documented in `emp_main.serializers`, i.e. whitespace and the
+    escaping of non ASCII characters. These are disabled via the arguments
+    `.json()` forwards to `json.dumps`, without parsing the output again,
+    as that would hide differences in key order or in the formatting of
+    floats and datetimes. The exponent format of floats, which differs
+    too, is checked by `TestAcceptedDifferences`.
+    """
+    data_pydantic = pydantic_model.construct_recursive(__root__=python_data)
+    data_json = data_pydantic.json(separators=(",", ":"), ensure_ascii=False)
+    return data_json.encode()
+
+
+class TestRowSerializerConformance:
+    """
+    Verify that `emp_main.serializers` generates the same JSON as the
+    pydantic models for the test data of `test_api.py`.
+    """
+
+    def check_messages(self, pydantic_model, row_serializer, test_datasets):
+        message_model = pydantic_model.__fields__["__root__"].type_
+        for test_dataset in test_datasets:
+            messages_by_dp_id = {}
+            for test_item in test_dataset["Python"]:
+                dp_id = str(test_item["datapoint__id"])
+                messages_by_dp_id.setdefault(dp_id, []).append(test_item)
+
+            expected_json = pydantic_reference_json(
+                pydantic_model, deepcopy(messages_by_dp_id)
+            )
+
+            # Simulate the rows as returned by `values()`.
+            rows_by_dp_id = {}
+            for dp_id, messages in deepcopy(messages_by_dp_id).items():
+                rows_by_dp_id[dp_id] = [
+                    row_serializer.convert(
+                        {f: m[f] for f in message_model.__fields__ if f in m}
+                    )
+                    for m in messages
+                ]
+            actual_json = serializers.dumps(rows_by_dp_id)
+
+            assert actual_json == expected_json
+
+    def test_value_messages(self):
+        self.check_messages(
+            pydantic_model=ValueMessageListByDatapointId,
+            row_serializer=serializers.value_message_serializer,
+            test_datasets=TEST_DATASETS_VALUES_HISTORY,
+        )
+
+    def test_schedule_messages(self):
+        self.check_messages(
+            pydantic_model=ScheduleMessageListByDatapointId,
+            row_serializer=serializers.schedule_message_serializer,
+            test_datasets=TEST_DATASETS_SCHEDULES_HISTORY,
+        )
+
+    def test_setpoint_messages(self):
+        self.check_messages(
+            pydantic_model=SetpointMessageListByDatapointId,
+            row_serializer=serializers.setpoint_message_serializer,
+            test_datasets=TEST_DATASETS_SETPOINTS_HISTORY,
+        )
+
+    def test_datapoints(self):
+        datapoint_model = DatapointList.__fields__["__root__"].type_
+        python_data = [deepcopy(d["Python"]) for d in TEST_DATAPOINTS]
+
+        expected_json = pydantic_reference_json(
+            DatapointList, deepcopy(python_data)
+        )
+
+        rows = []
+        for datapoint in python_data:
+            row = {f: datapoint.get(f) for f in datapoint_model.__fields__}
+            rows.append(serializers.datapoint_serializer.convert(row))
+        actual_json = serializers.dumps(rows)
+
+        assert actual_json == expected_json
+
+
+class TestAcceptedDifferences:
+    """
+    Verify the documented differences between `serializers.dumps` and the
+    pydantic output, which uses `json.dumps`, are the only ones.
+    """
+
+    def test_float_exponent_format(self):
+        for value in [1e16, 1e-7, 2.5e300, -1.5e-300]:
+            expected_json = json.dumps(value).encode()
+            expected_json = expected_json.replace(b"e+", b"e")
+            expected_json = expected_json.replace(b"e-0", b"e-")
+            assert serializers.dumps(value) == expected_json
+
+    def test_floats_without_exponent_identical(self):
+        for value in [0.1, 1.0, -21.5, 123456789.123, 1e15]:
+            assert serializers.dumps(value) == json.dumps(value).encode()
@@ -1,9 +1,19 @@
+from datetime import datetime
+from datetime import timezone
 from unittest.mock import MagicMock
+from unittest.mock import patch
 
+from django.core.cache import cache
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.contrib.auth.models import Permission
+from guardian.shortcuts import assign_perm
 
+from emp_demo_ui_app.models import DemoAppPage
 from emp_main.apps import EmpAppsCache
+from emp_main.models import Datapoint
+from emp_main.models import ValueMessage
 
 
 class TestUpdateUserPermissions(TestCase):
@@ -37,3 +47,106 @@ class TestUpdateUserPermissions(TestCase):
         del apps_cache
         del EmpAppsCache._instance
         EmpAppsCache()
+
+
+class TestInvalidateAppsCache(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create_user(username="u1", password="p1")
+
+    def setUp(self):
+        cache.clear()
+        self.page = DemoAppPage.objects.create(
+            page_name="Test Page", page_slug="test-page", page_content=""
+        )
+
+    def test_object_permission_change_invalidates_apps_cache(self):
+        """
+        Granting access to a page must be effective for already cached users.
+        """
+        apps_cache = EmpAppsCache.get_instance()
+        page_url = self.page.get_absolute_url()
+        allowed_urls = apps_cache.get_allowed_urls_for_user(self.user)
+        self.assertNotIn(page_url, allowed_urls)
+
+        assign_perm("emp_demo_ui_app.view_demoapppage", self.user, self.page)
+
+        allowed_urls = apps_cache.get_allowed_urls_for_user(self.user)
+        self.assertIn(page_url, allowed_urls)
+
+    def test_page_save_invalidates_apps_cache(self):
+        """
+        Changes of pages must be effective for already cached users.
+        """
+        assign_perm("emp_demo_ui_app.view_demoapppage", self.user, self.page)
+        apps_cache = EmpAppsCache.get_instance()
+        nav_content = apps_cache.get_apps_nav_content_for_user(self.user)
+        nav_pages = nav_content["Demo UI App"]["app_nav_pages"]
+        self.assertIn("Test Page", nav_pages)
+
+        self.page.page_name = "Renamed Page"
+        self.page.save()
+
+        nav_content = apps_cache.get_apps_nav_content_for_user(self.user)
+        nav_pages = nav_content["Demo UI App"]["app_nav_pages"]
+        self.assertIn("Renamed Page", nav_pages)
+
+    def test_model_permission_change_invalidates_apps_cache(self):
+        """
+        Model level permissions of users must be effective for already
+        cached users too.
+        """
+        apps_cache = EmpAppsCache.get_instance()
+        page_url = self.page.get_absolute_url()
+        allowed_urls = apps_cache.get_allowed_urls_for_user(self.user)
+        self.assertNotIn(page_url, allowed_urls)
+
+        permission = Permission.objects.get(
+            codename="view_demoapppage",
+            content_type__app_label="emp_demo_ui_app",
+        )
+        self.user.user_permissions.add(permission)
+
+        # Django caches the model level permissions on the user instance.
+        user = get_user_model().objects.get(pk=self.user.pk)
+        allowed_urls = apps_cache.get_allowed_urls_for_user(user)
+        self.assertIn(page_url, allowed_urls)
+
+    def test_group_permission_change_invalidates_apps_cache(self):
+        """
+        Model level permissions of groups must be effective for already
+        cached members of the group.
+        """
+        group = Group.objects.create(name="g1")
+        self.user.groups.add(group)
+        apps_cache = EmpAppsCache.get_instance()
+        page_url = self.page.get_absolute_url()
+        allowed_urls = apps_cache.get_allowed_urls_for_user(self.user)
+        self.assertNotIn(page_url, allowed_urls)
+
+        permission = Permission.objects.get(
+            codename="view_demoapppage",
+            content_type__app_label="emp_demo_ui_app",
+        )
+        group.permissions.add(permission)
+
+        user = get_user_model().objects.get(pk=self.user.pk)
+        allowed_urls = apps_cache.get_allowed_urls_for_user(user)
+        self.assertIn(page_url, allowed_urls)
+
+    def test_other_models_dont_invalidate_apps_cache(self):
+        """
+        The receivers must not run on every save, e.g. of value messages.
+        """
+        apps_cache = EmpAppsCache.get_instance()
+        with patch.object(apps_cache, "invalidate") as invalidate:
+            datapoint = Datapoint.objects.create(type="Sensor")
+            ValueMessage.objects.create(
+                datapoint=datapoint,
+                time=datetime(2022, 1, 1, tzinfo=timezone.utc),
+                value=1.0,
+            )
+            datapoint.delete()
+
+        invalidate.assert_not_called()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Tests for the routing of datapoint updates to websocket consumers.
+"""
+import asyncio
+
+from django.test import TestCase
+
+from emp_main.subscriptions import SubscriptionRouter
+
+
+class FakeConsumer:
+    """
+    Collects the messages that would be sent on websocket.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def push_update(self, dp_id, json_str):
+        self.sent.append(json_str)
+
+
+class FailingConsumer:
+    def push_update(self, dp_id, json_str):
+        raise RuntimeError("Consumer is broken.")
+
+
+class FakeChannelLayer:
+    """
+    A channel layer that fails on the first `receive` and yields the
+    messages of `messages` afterwards.
+    """
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.n_receive_calls = 0
+        self.group_adds = []
+
+    async def new_channel(self):
+        return "router.channel"
+
+    async def group_add(self, group_name, channel_name):
+        self.group_adds.append(group_name)
+
+    async def receive(self, channel_name):
+        self.n_receive_calls += 1
+        if self.n_receive_calls == 1:
+            raise ConnectionError("Connection to Redis lost.")
+        if self.messages:
+            return self.messages.pop(0)
+        # Block like a channel without messages.
+        await asyncio.sleep(3600)
+
+
+class TestSubscriptionRouter(TestCase):
+    """
+    Tests for `emp_main.subscriptions.SubscriptionRouter`
+    """
+
+    async def test_route_to_subscribed_consumers_only(self):
+        """
+        Verify that messages are forwarded per datapoint to the consumers
+        that subscribed, and not anymore after unsubscribing.
+        """
+        router = SubscriptionRouter()
+        consumer_1 = FakeConsumer()
+        consumer_2 = FakeConsumer()
+
+        await router.subscribe(consumer_1, "test.group", [1, 2])
+        await router.subscribe(consumer_2, "test.group", [2])
+        router.unsubscribe(consumer_1, "test.group", [2])
+
+        router.route(
+            {
+                "group": "test.group",
+                "json_by_dp_id": {"1": "msg 1", "2": "msg 2", "3": "msg 3"},
+            }
+        )
+
+        assert consumer_1.sent == ["msg 1"]
+        assert consumer_2.sent == ["msg 2"]
+
+        # No consumer left for datapoint 2 of consumer 2.
+        router.unsubscribe(consumer_2, "test.group", [2])
+        assert ("test.group", "2") not in router.consumers_by_dp
+
+    async def test_failing_consumer_does_not_affect_others(self):
+        router = SubscriptionRouter()
+        consumer = FakeConsumer()
+
+        await router.subscribe(FailingConsumer(), "test.group", [1])
+        await router.subscribe(consumer, "test.group", [1])
+        router.route({"group": "test.group", "json_by_dp_id": {"1": "msg 1"}})
+
+        assert consumer.sent == ["msg 1"]
+
+    async def test_receive_retried_after_channel_layer_failure(self):
+        """
+        Verify that a failing channel layer doesn't stop the forwarding of
+        messages.
+        """
+        router = SubscriptionRouter()
+        router.receive_retry_interval = 0.01
+        router.channel_layer = FakeChannelLayer(
+            messages=[{"group": "test.group", "json_by_dp_id": {"1": "msg 1"}}]
+        )
+        consumer = FakeConsumer()
+
+        await router.subscribe(consumer, "test.group", [1])
+        for _ in range(100):
+            if consumer.sent:
+                break
+            await asyncio.sleep(0.01)
+
+        assert consumer.sent == ["msg 1"]
+        assert not router.receive_task.done()
+        router.receive_task.cancel()
+        router.renew_task.cancel()
+
+    async def test_group_memberships_renewed(self):
+        """
+        Verify that the router channel is added to the groups again
+        periodically, without new subscriptions.
+        """
+        router = SubscriptionRouter()
+        router.group_renew_interval = 0.01
+        router.channel_layer = FakeChannelLayer(messages=[])
+        consumer = FakeConsumer()
+
+        await router.subscribe(consumer, "test.group", [1])
+        await asyncio.sleep(0.1)
+
+        assert router.channel_layer.group_adds.count("test.group") > 2
+        router.receive_task.cancel()
+        router.renew_task.cancel()
@@ -0,0 +1,22 @@
+from django.apps import apps
+from django.test import TestCase
+
+from emp_main.urls import get_emp_app_routers
+
+
+class TestGetEmpAppRouters(TestCase):
+    def test_apps_without_api_skipped(self):
+        emp_apps = ["emp_demo_ui_app", "emp_energy_flow"]
+
+        assert get_emp_app_routers(emp_apps) == []
+
+    def test_router_added_below_app_url_prefix(self):
+        if not apps.is_installed("emp_evaluation_system"):
+            self.skipTest("emp_evaluation_system is not installed.")
+        from emp_evaluation_system.api import router
+
+        emp_apps = ["emp_demo_ui_app", "emp_evaluation_system"]
+
+        assert get_emp_app_routers(emp_apps) == [
+            ("/evaluation_system/", router)
+        ]
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Tests for the write-behind mode of the latest endpoints.
+"""
+from datetime import datetime
+from datetime import timezone
+import json
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import pytest
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.db import OperationalError
+from django.test import Client
+from django.test import TestCase
+from django.test import override_settings
+
+from esg.services.base import RequestInducedException
+
+from emp_main import write_behind
+from emp_main.api import dp_value_view
+from emp_main.models import Datapoint
+from emp_main.models import LastValueMessage
+from emp_main.urls import API_ROOT_PATH
+from emp_main.write_behind import WriteBehindQueue
+from emp_main.write_behind import WriteBehindWorker
+from emp_main.write_behind import get_views_by_kind
+from emp_main.write_behind import merge_payloads
+
+
+class TestMergePayloads:
+    def test_newest_message_is_latest(self):
+        payloads = [
+            json.dumps(
+                {
+                    "1": {"value": "1.0", "time": "2022-01-01T00:02:00Z"},
+                    "2": {"value": "2.0", "time": "2022-01-01T00:00:00Z"},
+                }
+            ),
+            # An older message for datapoint 1 that arrived later.
+            json.dumps({"1": {"value": "3.0", "time": "2022-01-01T00:01:00Z"}}),
+            # A newer one for datapoint 2 and one with the same time.
+            json.dumps({"2": {"value": "4.0", "time": "2022-01-01T00:03:00Z"}}),
+            json.dumps({"2": {"value": "5.0", "time": "2022-01-01T00:03:00Z"}}),
+        ]
+
+        latest_dict, history_dict = merge_payloads(dp_value_view, payloads)
+
+        assert latest_dict["1"]["value"] == 1.0
+        assert latest_dict["2"]["value"] == 5.0
+        assert latest_dict["2"]["time"] == datetime(
+            2022, 1, 1, 0, 3, tzinfo=timezone.utc
+        )
+
+        values_1 = sorted(item["value"] for item in history_dict["1"])
+        assert values_1 == [1.0, 3.0]
+        # The last message wins for equal times.
+        values_2 = sorted(item["value"] for item in history_dict["2"])
+        assert values_2 == [2.0, 5.0]
+
+    def test_views_by_kind(self):
+        views_by_kind = get_views_by_kind()
+        assert views_by_kind["datapoint.value.latest"] is dp_value_view
+        assert len(views_by_kind) == 3
+
+
+def create_entry(entry_id, payload):
+    return (entry_id, {b"kind": b"datapoint.value.latest", b"payload": payload})
+
+
+class TestWriteBehindWorkerPersist(TestCase):
+    def setUp(self):
+        with patch.object(write_behind, "queue"):
+            self.worker = WriteBehindWorker()
+
+    def test_change_counter_bumped_after_commit(self):
+        """
+        ETags computed before the commit must be invalidated after it.
+        """
+        datapoint = Datapoint.objects.create(type="Sensor")
+        message = {"value": "1.0", "time": "2022-01-01T00:00:00Z"}
+        payload = json.dumps({str(datapoint.id): message})
+        change_counter = dp_value_view.latest_change_counter
+
+        with patch.object(change_counter, "bump") as bump:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.worker.persist([create_entry(b"1-0", payload)])
+                bump.assert_not_called()
+            bump.assert_called_once()
+
+        assert LastValueMessage.objects.get(datapoint=datapoint).value == 1.0
+
+
+class TestWriteBehindWorkerPersistOrDrop:
+    def setup_method(self):
+        with patch.object(write_behind, "queue"):
+            self.worker = WriteBehindWorker()
+        self.entries = [
+            create_entry(b"1-0", b"{}"),
+            create_entry(b"2-0", b"{}"),
+            create_entry(b"3-0", b"{}"),
+        ]
+
+    def test_failed_entries_dead_lettered(self):
+        """
+        Entries that fail with any error are dropped, the others written.
+        """
+
+        def persist(entries):
+            if len(entries) > 1:
+                raise IntegrityError("Some entry in the batch is invalid.")
+            entry_id = entries[0][0]
+            if entry_id == b"2-0":
+                raise RequestInducedException(detail="Datapoint deleted.")
+            if entry_id == b"3-0":
+                raise ValueError("Unexpected payload.")
+
+        self.worker.persist = MagicMock(side_effect=persist)
+        with patch.object(write_behind, "queue") as queue:
+            self.worker.persist_or_drop(self.entries)
+
+        assert self.worker.persist.call_count == 4
+        dead_letter_entries = [
+            c.args[0] for c in queue.dead_letter.call_args_list
+        ]
+        assert dead_letter_entries == self.entries[1:]
+
+    def test_connection_errors_raised(self):
+        """
+        The entries must be retried, not dropped, if the DB is unavailable.
+        """
+        self.worker.persist = MagicMock(
+            side_effect=OperationalError("DB unavailable.")
+        )
+        with patch.object(write_behind, "queue") as queue:
+            with pytest.raises(OperationalError):
+                self.worker.persist_or_drop(self.entries)
+
+        queue.dead_letter.assert_not_called()
+
+
+def create_pending_item(entry_id, consumer, idle_ms):
+    return {
+        "message_id": entry_id,
+        "consumer": consumer,
+        "time_since_delivered": idle_ms,
+        "times_delivered": 1,
+    }
+
+
+class TestWriteBehindQueueClaimIdle:
+    def test_idle_entries_of_other_workers_claimed(self):
+        redis = MagicMock()
+        redis.xpending_range.return_value = [
+            create_pending_item(b"1-0", consumer=b"old", idle_ms=90000),
+            create_pending_item(b"2-0", consumer=b"old", idle_ms=100),
+            create_pending_item(b"3-0", consumer=b"new", idle_ms=90000),
+        ]
+        claimed_entry = create_entry(b"1-0", b"{}")
+        redis.xclaim.return_value = [claimed_entry, (b"4-0", None)]
+        queue = WriteBehindQueue()
+        queue.get_redis = MagicMock(return_value=redis)
+
+        entries = queue.claim_idle(
+            consumer_name="new", min_idle_ms=60000, count=10
+        )
+
+        assert entries == [claimed_entry]
+        redis.xclaim.assert_called_once_with(
+            queue.stream_key,
+            queue.group_name,
+            "new",
+            min_idle_time=60000,
+            message_ids=[b"1-0"],
+        )
+
+
+@override_settings(API_WRITE_BEHIND_CLAIM_AFTER=60)
+class TestWriteBehindWorkerRunOnce(TestCase):
+    def setUp(self):
+        with patch.object(write_behind, "queue"):
+            self.worker = WriteBehindWorker()
+        self.worker.persist_or_drop = MagicMock()
+
+    def test_entries_of_stopped_worker_taken_over(self):
+        """
+        Entries left by a worker that has been replaced, e.g. with a new
+        hostname, must be written by the remaining workers.
+        """
+        self.worker.read_pending = False
+        entries = [create_entry(b"1-0", b"{}")]
+        with patch.object(write_behind, "queue") as queue:
+            queue.claim_idle.return_value = entries
+            queue.depth.return_value = 0
+            n_entries = self.worker.run_once()
+
+        assert n_entries == 1
+        queue.claim_idle.assert_called_once_with(
+            consumer_name=self.worker.consumer_name,
+            min_idle_ms=60000,
+            count=self.worker.batch_size,
+        )
+        queue.read.assert_not_called()
+        self.worker.persist_or_drop.assert_called_once_with(entries)
+        assert queue.acknowledge.call_args.kwargs["entry_ids"] == [b"1-0"]
+
+    def test_own_pending_entries_read_first(self):
+        with patch.object(write_behind, "queue") as queue:
+            queue.read.return_value = []
+            queue.depth.return_value = 0
+            self.worker.run_once()
+
+        queue.claim_idle.assert_not_called()
+        assert queue.read.call_args.kwargs["pending"] is True
+
+
+@override_settings(API_WRITE_BEHIND=True, API_LATEST_CACHE_TIMEOUT=300)
+class TestUpdateLatestWriteBehind(TestCase):
+    endpoint_url_latest = "/" + API_ROOT_PATH + "datapoint/value/latest/"
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.datapoint = Datapoint.objects.create(type="Sensor")
+
+    def put_latest(self, value, time):
+        message = {"value": value, "time": time}
+        with patch.object(write_behind.queue, "append"):
+            response = self.client.put(
+                self.endpoint_url_latest,
+                content_type="application/json",
+                data={str(self.datapoint.id): message},
+            )
+        assert response.status_code == 200
+
+    def test_older_message_not_cached(self):
+        """
+        The DB keeps the newer message, hence the cache must too.
+        """
+        self.put_latest(2.0, "2022-01-01T00:02:00+00:00")
+        self.put_latest(1.0, "2022-01-01T00:01:00+00:00")
+
+        cached = dp_value_view.latest_cache.get_many([self.datapoint.id])
+        assert cached[self.datapoint.id]["value"] == 2.0
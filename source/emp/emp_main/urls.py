@@ -14,6 +14,7 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from importlib import import_module
+from importlib.util import find_spec
 
 from django.contrib import admin
 from django.conf import settings
@@ -31,6 +32,43 @@ ROOT_PATH = settings.ROOT_PATH
 API_ROOT_PATH = "api/"
 
 
+def get_emp_app_routers(emp_apps):
+    """
+    Return the REST API endpoints of the emp apps.
+
+    These are the `router` of the `api` module of every app that has one,
+    with the path prefix below which the endpoints are added to the API.
+    The prefix is the `app_url_prefix` of the app, or the app name if the
+    app has no URL prefix.
+
+    Arguments:
+    ----------
+    emp_apps : list of str
+        The names of the emp apps, like `settings.EMP_APPS`.
+
+    Returns:
+    --------
+    routers : list of tuple
+        `(prefix, router)` for every app with an `api` module.
+    """
+    routers = []
+    for emp_app in emp_apps:
+        if find_spec(emp_app + ".api") is None:
+            continue
+        app_api = import_module(emp_app + ".api")
+        app_config = import_module(emp_app + ".apps")
+        app_url_prefix = getattr(app_config, "app_url_prefix", None) or emp_app
+        prefix = "/" + app_url_prefix.strip("/") + "/"
+        routers.append((prefix, app_api.router))
+    return routers
+
+
+# Add the REST API endpoints of the emp apps. This must happen before
+# `api.urls` is used.
+for prefix, router in get_emp_app_routers(settings.EMP_APPS):
+    api.add_router(prefix, router)
+
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path(
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Write-behind mode for the latest endpoints of the REST API.
+
+By default a PUT to e.g. `/datapoint/value/latest/` writes the messages to
+the latest and history tables before it responds, i.e. a slow DB stalls
+all clients. If `API_WRITE_BEHIND` is enabled, the validated messages are
+appended to a Redis stream instead (the latest cache and the websockets are
+updated right away), and the `write_behind_worker` management command
+writes the queued messages to DB in large merged batches.
+
+The worker acknowledges the queue entries only after the DB transaction has
+been committed, hence messages are written at least once, also if the
+worker is restarted. Entries left unacknowledged by a worker that is gone
+(e.g. as its container has been recreated with a new hostname) are taken
+over by the other workers after `API_WRITE_BEHIND_CLAIM_AFTER` seconds.
+Entries that can't be written at all (e.g. as the
+datapoint has been deleted in the meantime) are moved to a dead-letter
+stream, see `WriteBehindQueue.dead_letter`.
+
+`API_WRITE_BEHIND_ACK` defines when the PUT responds: `enqueued` as soon as
+the messages are stored in Redis, or `persisted` once the worker has written
+them to DB, which still profits from the batching.
+"""
+import logging
+import socket
+from time import monotonic
+from time import sleep
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import InterfaceError
+from django.db import OperationalError
+from django.db import transaction
+from prometheus_client import Gauge
+
+from esg.services.base import RequestInducedException
+
+logger = logging.getLogger(__name__)
+
+# Errors of the DB connection, the entries are retried by the worker instead
+# of being dropped.
+CONNECTION_ERRORS = (OperationalError, InterfaceError)
+
+prom_write_behind_queue_depth = Gauge(
+    "emp_api_write_behind_queue_depth",
+    "Number of messages in the write-behind queue not written to DB yet.",
+    multiprocess_mode="max",
+)
+
+
+def is_enabled():
+    return settings.API_WRITE_BEHIND
+
+
+class WriteBehindQueue:
+    """
+    The queue of the write-behind mode, a Redis stream read by a consumer
+    group.
+
+    Arguments:
+    ----------
+    stream_key: str
+        The key of the stream in Redis.
+    """
+
+    group_name = "emp.write_behind.workers"
+    # The number of dropped entries kept for inspection.
+    dead_letter_maxlen = 10000
+
+    def __init__(self, stream_key="emp.write_behind"):
+        self.stream_key = stream_key
+        self.persisted_key_prefix = stream_key + ".persisted."
+        self.dead_letter_key = stream_key + ".dead_letter"
+
+    def get_redis(self):
+        """
+        Return the Redis client of the cache, which must hence be Redis.
+        """
+        try:
+            from django_redis import get_redis_connection
+
+            return get_redis_connection("default")
+        except (ImportError, NotImplementedError):
+            raise ImproperlyConfigured(
+                "Write-behind mode requires Redis as cache backend."
+            )
+
+    def append(self, kind, payload):
+        """
+        Append messages to the queue.
+
+        Arguments:
+        ----------
+        kind: str
+            Identifies the API view that writes the messages, see
+            `get_views_by_kind`.
+        payload: str
+            The messages as JSON in the format of the PUT request.
+
+        Returns:
+        --------
+        entry_id: bytes
+            The ID of the queue entry.
+        """
+        return self.get_redis().xadd(
+            self.stream_key, {"kind": kind, "payload": payload}
+        )
+
+    def wait_persisted(self, entry_id, timeout, poll_interval=0.05):
+        """
+        Wait until the worker has written a queue entry to DB.
+
+        Returns:
+        --------
+        persisted: bool
+            False if the entry hasn't been written within `timeout` seconds.
+        """
+        redis = self.get_redis()
+        key = self.persisted_key_prefix + entry_id.decode()
+        deadline = monotonic() + timeout
+        while True:
+            if redis.exists(key):
+                return True
+            if monotonic() >= deadline:
+                return False
+            sleep(poll_interval)
+
+    def ensure_group(self):
+        """
+        Create the consumer group (and the stream) if these don't exist.
+        """
+        redis = self.get_redis()
+        try:
+            redis.xgroup_create(
+                self.stream_key, self.group_name, id="0", mkstream=True
+            )
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def read(self, consumer_name, count, block_ms, pending=False):
+        """
+        Read entries for a worker.
+
+        Arguments:
+        ----------
+        consumer_name: str
+            Identifies the worker within the consumer group.
+        count: int
+            The maximum number of entries returned.
+        block_ms: int
+            How long to wait for new entries.
+        pending: bool
+            If True, return the entries delivered to this worker before but
+            not acknowledged, e.g. due to a restart, instead of new ones.
+
+        Returns:
+        --------
+        entries: list
+            Of `(entry_id, fields)` tuples.
+        """
+        response = self.get_redis().xreadgroup(
+            self.group_name,
+            consumer_name,
+            {self.stream_key: "0" if pending else ">"},
+            count=count,
+            block=None if pending else block_ms,
+        )
+        if not response:
+            return []
+        _, entries = response[0]
+        return entries
+
+    def claim_idle(self, consumer_name, min_idle_ms, count):
+        """
+        Take over the entries delivered to other workers but not
+        acknowledged for a while, e.g. as the worker has been stopped.
+
+        Arguments:
+        ----------
+        consumer_name: str
+            Identifies the worker that takes over the entries.
+        min_idle_ms: int
+            Only entries delivered at least this long ago are taken over.
+        count: int
+            The maximum number of entries checked and returned.
+
+        Returns:
+        --------
+        entries: list
+            Of `(entry_id, fields)` tuples, like `read`.
+        """
+        redis = self.get_redis()
+        pending = redis.xpending_range(
+            self.stream_key, self.group_name, min="-", max="+", count=count
+        )
+        entry_ids = [
+            item["message_id"]
+            for item in pending
+            if item["consumer"].decode() != consumer_name
+            and item["time_since_delivered"] >= min_idle_ms
+        ]
+        if not entry_ids:
+            return []
+        # Checks the idle time again, in case another worker has claimed
+        # the entries in the meantime.
+        entries = redis.xclaim(
+            self.stream_key,
+            self.group_name,
+            consumer_name,
+            min_idle_time=min_idle_ms,
+            message_ids=entry_ids,
+        )
+        # Older Redis versions return deleted entries without fields.
+        return [entry for entry in entries if entry[1]]
+
+    def acknowledge(self, entry_ids, persisted_timeout):
+        """
+        Remove entries from the queue after these have been written to DB.
+        """
+        if not entry_ids:
+            return
+        pipeline = self.get_redis().pipeline()
+        pipeline.xack(self.stream_key, self.group_name, *entry_ids)
+        pipeline.xdel(self.stream_key, *entry_ids)
+        for entry_id in entry_ids:
+            key = self.persisted_key_prefix + entry_id.decode()
+            pipeline.set(key, 1, ex=persisted_timeout)
+        pipeline.execute()
+
+    def dead_letter(self, entry, reason):
+        """
+        Keep an entry that can't be written to DB in the dead-letter stream,
+        from which it can be inspected or requeued manually. The entry must
+        still be acknowledged.
+
+        Arguments:
+        ----------
+        entry: tuple
+            The `(entry_id, fields)` as returned by `read`.
+        reason: str
+            Why the entry has been dropped.
+        """
+        entry_id, fields = entry
+        dead_letter_fields = dict(fields)
+        dead_letter_fields[b"entry_id"] = entry_id
+        dead_letter_fields[b"reason"] = reason
+        self.get_redis().xadd(
+            self.dead_letter_key,
+            dead_letter_fields,
+            maxlen=self.dead_letter_maxlen,
+            approximate=True,
+        )
+
+    def depth(self):
+        """
+        Return the number of entries not written to DB yet.
+        """
+        return self.get_redis().xlen(self.stream_key)
+
+
+queue = WriteBehindQueue()
+
+
+def get_views_by_kind():
+    """
+    Return the API views that support the write-behind mode.
+    """
+    # Imported here as `emp_main.api` uses this module.
+    from .api import dp_value_view
+    from .api import dp_schedule_view
+    from .api import dp_setpoint_view
+
+    views = [dp_value_view, dp_schedule_view, dp_setpoint_view]
+    return {view.channel_group_name: view for view in views}
+
+
+def merge_payloads(view, payloads):
+    """
+    Merge the payloads of several PUTs to the latest endpoint of a view.
+
+    Arguments:
+    ----------
+    view: emp_main.api.GenericDatapointRelatedAPIView
+        The view the payloads have been sent to.
+    payloads: list of str or bytes
+        The payloads in the order of the requests.
+
+    Returns:
+    --------
+    latest_dict: dict
+        The newest message per datapoint, i.e. the one with the largest
+        `time`, the later one if these are equal.
+    history_dict: dict
+        All messages as lists per datapoint. Only the last one is kept if
+        several messages have the same time.
+    """
+    latest_dict = {}
+    history_by_time_by_dp_id = {}
+    for payload in payloads:
+        related_data = view.list_latest_response_model.parse_raw(payload)
+        for dp_id, item in related_data.dict()["__root__"].items():
+            history_by_time = history_by_time_by_dp_id.setdefault(dp_id, {})
+            history_by_time[item["time"]] = item
+            current_item = latest_dict.get(dp_id)
+            if current_item is None or item["time"] >= current_item["time"]:
+                latest_dict[dp_id] = dict(item)
+
+    history_dict = {
+        dp_id: list(history_by_time.values())
+        for dp_id, history_by_time in history_by_time_by_dp_id.items()
+    }
+    return latest_dict, history_dict
+
+
+class WriteBehindWorker:
+    """
+    Writes the queued messages to DB, see `write_behind_worker` command.
+
+    Arguments:
+    ----------
+    batch_size: int
+        The maximum number of queue entries (i.e. requests) written to DB
+        in one transaction.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        # Entries delivered to a previous process of the same name but not
+        # acknowledged are processed first after a restart. Those of other
+        # names are taken over by `run_once`, see `claim_idle`.
+        self.consumer_name = socket.gethostname()
+        self.views_by_kind = get_views_by_kind()
+        # Process the entries left by a previous run of this worker first.
+        self.read_pending = True
+        queue.ensure_group()
+
+    def persist(self, entries):
+        """
+        Write queue entries to DB in one transaction.
+        """
+        payloads_by_kind = {}
+        for _, fields in entries:
+            kind = fields[b"kind"].decode()
+            payloads_by_kind.setdefault(kind, []).append(fields[b"payload"])
+
+        with transaction.atomic():
+            for kind, payloads in payloads_by_kind.items():
+                view = self.views_by_kind[kind]
+                latest_dict, history_dict = merge_payloads(view, payloads)
+                view.write_latest(
+                    related_data_dict=latest_dict,
+                    second_related_object=None,
+                    write_history=False,
+                )
+                view.write_history(
+                    related_data_dict=history_dict, second_related_object=None,
+                )
+                # The PUT has bumped the counter already, but ETags computed
+                # until now may belong to content read before the commit.
+                if view.latest_change_counter is not None:
+                    transaction.on_commit(view.latest_change_counter.bump)
+
+    def persist_or_drop(self, entries):
+        """
+        Like `persist` but writes the entries one by one if the batch is
+        rejected, e.g. as a datapoint has been deleted in the meantime, and
+        moves the entries that can't be written to the dead-letter stream.
+
+        Errors of the DB connection are raised, as all entries would be
+        dropped else.
+        """
+        try:
+            self.persist(entries)
+            return
+        except CONNECTION_ERRORS:
+            raise
+        except Exception:
+            logger.warning(
+                "Writing %s write-behind entries failed, writing these one "
+                "by one.",
+                len(entries),
+                exc_info=True,
+            )
+        for entry in entries:
+            try:
+                self.persist([entry])
+            except CONNECTION_ERRORS:
+                raise
+            except RequestInducedException as e:
+                logger.error(
+                    "Dropping write-behind entry %s: %s", entry[0], e.detail
+                )
+                queue.dead_letter(entry, reason=str(e.detail))
+            except Exception as e:
+                logger.exception("Dropping write-behind entry %s.", entry[0])
+                queue.dead_letter(entry, reason=repr(e))
+
+    def run_once(self, block_ms=1000):
+        """
+        Write the next batch of queue entries to DB.
+
+        Entries left by other workers for longer than
+        `API_WRITE_BEHIND_CLAIM_AFTER` are processed before new ones.
+
+        Returns:
+        --------
+        n_entries: int
+            The number of processed entries.
+        """
+        entries = []
+        if not self.read_pending:
+            entries = queue.claim_idle(
+                consumer_name=self.consumer_name,
+                min_idle_ms=int(settings.API_WRITE_BEHIND_CLAIM_AFTER * 1000),
+                count=self.batch_size,
+            )
+        if not entries:
+            entries = queue.read(
+                consumer_name=self.consumer_name,
+                count=self.batch_size,
+                block_ms=block_ms,
+                pending=self.read_pending,
+            )
+            if self.read_pending and len(entries) < self.batch_size:
+                self.read_pending = False
+
+        if entries:
+            self.persist_or_drop(entries)
+            # Keep the markers for the requests waiting for these.
+            persisted_timeout = int(settings.API_WRITE_BEHIND_ACK_TIMEOUT) + 1
+            queue.acknowledge(
+                entry_ids=[entry_id for entry_id, _ in entries],
+                persisted_timeout=persisted_timeout,
+            )
+
+        prom_write_behind_queue_depth.set(queue.depth())
+        return len(entries)
+
+    def run_forever(self, retry_interval=5):
+        """
+        Process the queue until the process is stopped.
+        """
+        logger.info("Starting write-behind worker %s.", self.consumer_name)
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                # E.g. DB not available. The entries are kept in the queue
+                # and delivered again.
+                logger.exception("Writing queued messages to DB failed.")
+                self.read_pending = True
+                sleep(retry_interval)
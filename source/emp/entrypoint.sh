@@ -9,6 +9,9 @@ printf "\n\nCreating and applying migrations."
 python3 /source/emp/manage.py makemigrations
 python3 /source/emp/manage.py migrate
 
+# Apply the retention and compression settings of the history tables.
+python3 /source/emp/manage.py history_policies --apply
+
 # Run prod deploy checks if not in devl.
 if [ "${DJANGO_DEBUG:-False}" != "TRUE" ]
 then
@@ -34,6 +37,15 @@ fi
 # running in multiprocess mode.
 export PROMETHEUS_MULTIPROC_DIR="$(mktemp -d)"
 
+# Write the queued messages to DB if the write-behind mode is enabled.
+# Case insensitive, like `API_WRITE_BEHIND` in settings.py.
+EMP_API_WRITE_BEHIND="${EMP_API_WRITE_BEHIND:-FALSE}"
+if [[ "${EMP_API_WRITE_BEHIND,,}" == "true" ]]
+then
+    printf "\n\nStarting write-behind worker.\n"
+    python3 /source/emp/manage.py write_behind_worker &
+fi
+
 # Start up the server, use the internal devl server in debug mode.
 # Both serve plain http on port 8080 within the container.
 if  [[ "${DJANGO_DEBUG:-FALSE}" == "TRUE" ]]